@@ -0,0 +1,119 @@
+"""Benchmark the merge-join engine of `join_arrays` against the previous
+nested-loop implementation (get_idx_inner/get_idx_outer based on numba lists).
+
+Run e.g. via:
+
+.. code-block:: bash
+
+    python benchmarks/bench_join.py --sizes 1e5 1e6 1e7 1e8 --legacy-max 1e5
+
+The legacy implementation scales badly, so it is only run up to `--legacy-max`
+entries.
+"""
+import argparse
+import time
+import numba
+import numpy as np
+from sparsestack.utils import join_arrays, set_and_fill_new_array
+
+
+@numba.jit(nopython=True)
+def legacy_get_idx_inner(left_row, left_col, right_row, right_col,
+                         idx1, idx2):
+    #pylint: disable=too-many-arguments
+    #pylint: disable=too-many-locals
+    idx_left = []
+    idx_left_new = []
+    idx_right = []
+    idx_right_new = []
+    row_new = []
+    col_new = []
+    low = 0
+    counter = 0
+    for i in idx1:
+        for count, j in enumerate(idx2[low:]):
+            if (left_row[i] == right_row[j]) and (left_col[i] == right_col[j]):
+                idx_left.append(i)
+                idx_left_new.append(counter)
+                idx_right.append(j)
+                idx_right_new.append(counter)
+                row_new.append(left_row[i])
+                col_new.append(left_col[i])
+                counter += 1
+                low = count
+            if left_row[i] > right_row[j]:
+                low = count
+            if left_row[i] < right_row[j]:
+                break
+    return idx_left, idx_right, idx_left_new, idx_right_new, row_new, col_new
+
+
+def legacy_join_arrays_left(row1, col1, data1, row2, col2, data2, name):
+    """Previous implementation of a "left" join."""
+    #pylint: disable=too-many-arguments
+    idx1 = np.lexsort((col1, row1))
+    idx2 = np.lexsort((col2, row2))
+    idx_inner_left, idx_inner_right, _, _, _, _ = legacy_get_idx_inner(
+        row1, col1, row2, col2, idx1, idx2)
+    data_join = set_and_fill_new_array(data1, data2, name,
+                                       np.arange(0, len(row1)), np.arange(0, len(row1)),
+                                       idx_inner_right, idx_inner_left,
+                                       len(row1))
+    idx = np.lexsort((col1, row1))
+    return row1[idx], col1[idx], data_join[idx]
+
+
+def random_sparse_data(n_entries, n_row, n_col, seed):
+    rng = np.random.default_rng(seed)
+    keys = np.unique(rng.integers(0, n_row * n_col, n_entries, dtype=np.int64))
+    row, col = np.divmod(keys, n_col)
+    return row, col, rng.random(len(keys))
+
+
+def best_time(func, *args, repeats=1, **kwargs):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e5, 1e6, 1e7])
+    parser.add_argument("--legacy-max", type=float, default=1e5)
+    parser.add_argument("--overlap", type=float, default=0.5,
+                        help="Fraction of entries of the second array which also exist in the first.")
+    args = parser.parse_args()
+
+    # Warm up numba
+    row, col, values = random_sparse_data(100, 20, 20, seed=0)
+    data = np.array(values, dtype=[("layer1", values.dtype)])
+    for join_type in ["left", "right", "inner", "outer"]:
+        join_arrays(row, col, data, row, col, values, "layer2", join_type=join_type)
+    legacy_join_arrays_left(row, col, data, row, col, values, "layer2")
+
+    print(f"{'entries':>12} {'join_type':>10} {'merge [s]':>10} {'legacy [s]':>11}")
+    for size in args.sizes:
+        n_entries = int(size)
+        n_side = int(np.sqrt(n_entries * 10))
+        row1, col1, values1 = random_sparse_data(n_entries, n_side, n_side, seed=1)
+        data1 = np.array(values1, dtype=[("layer1", values1.dtype)])
+        n_shared = int(args.overlap * len(row1))
+        row2, col2, values2 = random_sparse_data(len(row1) - n_shared, n_side, n_side, seed=2)
+        row2 = np.concatenate((row2, row1[:n_shared]))
+        col2 = np.concatenate((col2, col1[:n_shared]))
+        values2 = np.concatenate((values2, values1[:n_shared]))
+
+        for join_type in ["left", "right", "inner", "outer"]:
+            t_merge = best_time(join_arrays, row1, col1, data1, row2, col2, values2,
+                                "layer2", join_type=join_type)
+            t_legacy = "-"
+            if join_type == "left" and n_entries <= args.legacy_max:
+                t_legacy = f"{best_time(legacy_join_arrays_left, row1, col1, data1, row2, col2, values2, 'layer2'):.3f}"
+            print(f"{len(row1):>12} {join_type:>10} {t_merge:>10.3f} {t_legacy:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Benchmarks for the main (public) operations of sparsestack.
+
+The classes follow the conventions of airspeed velocity (asv): `setup` prepares
+synthetic data for every parameter combination, `time_*` methods are timed and
+`peakmem_*` methods report the peak memory of the process. `timeraw_*` methods
+return code which is timed in a fresh python process.
+Run them with `asv run` (see asv.conf.json) or offline, without asv, via:
+
+.. code-block:: bash
+
+    python benchmarks/run.py --sizes 1e4 1e5 1e6 1e7
+
+The number of entries can also be set by the environment variable
+SPARSESTACK_BENCH_SIZES (e.g. "1e4 1e6 1e8").
+"""
+import os
+import numpy as np
+from sparsestack import StackedSparseArray
+from sparsestack.utils import get_idx_outer, join_arrays
+from .synthetic import matrix_shape, overlapping_coo, random_coo
+
+
+SIZES = [int(float(x)) for x in os.environ.get("SPARSESTACK_BENCH_SIZES", "1e4 1e5 1e6").split()]
+
+# Dense export is skipped above this number of dense matrix cells
+MAX_DENSE_SIZE = 2e8
+
+
+def create_stack(nnz, n_layers=1, dtype=np.float64, row_skew=0.0):
+    """Return StackedSparseArray with n_layers layers sharing nnz random entries."""
+    n_row, n_col = matrix_shape(nnz)
+    row, col, values = random_coo(nnz, n_row, n_col, row_skew=row_skew, dtype=dtype)
+    layers = {f"layer{i}": (row, col, values * (i + 1)) for i in range(n_layers)}
+    return StackedSparseArray.from_layers(layers, n_row=n_row, n_col=n_col)
+
+
+class Construction:
+    """Create stacks from (unsorted) COO data."""
+    params = (SIZES, ["float64", "float32", "int32"])
+    param_names = ["nnz", "dtype"]
+
+    def setup(self, nnz, dtype):
+        self.shape = matrix_shape(nnz)
+        self.row, self.col, self.values = random_coo(nnz, *self.shape, dtype=dtype)
+
+    def time_add_sparse_data(self, nnz, dtype):
+        stack = StackedSparseArray(*self.shape)
+        stack.add_sparse_data(self.row, self.col, self.values, "layer0")
+
+    def peakmem_add_sparse_data(self, nnz, dtype):
+        self.time_add_sparse_data(nnz, dtype)
+
+    def time_from_layers(self, nnz, dtype):
+        StackedSparseArray.from_layers({f"layer{i}": (self.row, self.col, self.values)
+                                        for i in range(3)},
+                                       n_row=self.shape[0], n_col=self.shape[1])
+
+    def peakmem_from_layers(self, nnz, dtype):
+        self.time_from_layers(nnz, dtype)
+
+
+class Join:
+    """Join a second layer which partly overlaps with the existing entries."""
+    params = (SIZES, [0.1, 0.9], ["left", "inner", "outer"])
+    param_names = ["nnz", "overlap", "join_type"]
+
+    def setup(self, nnz, overlap, join_type):
+        self.stack = create_stack(nnz)
+        self.row2, self.col2, self.values2 = overlapping_coo(
+            self.stack.row, self.stack.col, overlap, *self.stack.shape[:2])
+        self.data = self.stack.data
+
+    def time_add_sparse_data(self, nnz, overlap, join_type):
+        stack = self.stack.clone()
+        stack.add_sparse_data(self.row2, self.col2, self.values2, "layer1", join_type=join_type)
+
+    def peakmem_add_sparse_data(self, nnz, overlap, join_type):
+        self.time_add_sparse_data(nnz, overlap, join_type)
+
+    def time_join_arrays(self, nnz, overlap, join_type):
+        join_arrays(self.stack.row, self.stack.col, self.data,
+                    self.row2, self.col2, self.values2, "layer1",
+                    join_type=join_type, left_sorted=True)
+
+
+class GetIdx:
+    """Merge kernel on sorted inputs (no sorting, no filling of layers)."""
+    params = (SIZES, [0.1, 0.9])
+    param_names = ["nnz", "overlap"]
+
+    def setup(self, nnz, overlap):
+        stack = create_stack(nnz)
+        row2, col2, _ = overlapping_coo(stack.row, stack.col, overlap, *stack.shape[:2])
+        idx = np.lexsort((col2, row2))
+        self.arrays = (stack.row, stack.col, row2[idx].astype(stack.row.dtype),
+                       col2[idx].astype(stack.col.dtype))
+        get_idx_outer(*self.arrays)  # compile
+
+    def time_get_idx_outer(self, nnz, overlap):
+        get_idx_outer(*self.arrays)
+
+
+class Slicing:
+    """Access single rows/columns (cached index) and slice sub-stacks."""
+    params = (SIZES, [0.0, 2.0])
+    param_names = ["nnz", "row_skew"]
+
+    def setup(self, nnz, row_skew):
+        self.stack = create_stack(nnz, n_layers=2, row_skew=row_skew)
+        rng = np.random.default_rng(0)
+        self.rows = rng.integers(0, self.stack.shape[0], 100)
+        self.cols = rng.integers(0, self.stack.shape[1], 100)
+        # Build (cached) row and column index
+        _ = self.stack[0, :], self.stack[:, 0]
+
+    def time_get_rows(self, nnz, row_skew):
+        for row in self.rows:
+            self.stack[int(row), :]
+
+    def time_get_cols(self, nnz, row_skew):
+        for col in self.cols:
+            self.stack[:, int(col)]
+
+    def time_lookup(self, nnz, row_skew):
+        self.stack.lookup(self.rows, self.cols, "layer0")
+
+    def time_slice_rows(self, nnz, row_skew):
+        self.stack[self.rows, :]
+
+    def time_slice_range(self, nnz, row_skew):
+        self.stack[:self.stack.shape[0] // 2, :, "layer1"]
+
+
+class Filtering:
+    """Filter and select entries."""
+    params = (SIZES, )
+    param_names = ["nnz"]
+
+    def setup(self, nnz):
+        self.stack = create_stack(nnz, n_layers=2)
+
+    def time_filter_by_range(self, nnz):
+        self.stack.filter_by_range("layer0", low=0.5)
+
+    def peakmem_filter_by_range(self, nnz):
+        self.time_filter_by_range(nnz)
+
+    def time_filter_two_conditions(self, nnz):
+        self.stack.filter([("layer0", 0.2, np.inf), ("layer1", -np.inf, 1.5)])
+
+    def time_top_k(self, nnz):
+        self.stack.top_k("layer0", k=5)
+
+    def time_reduce_max(self, nnz):
+        self.stack.reduce("layer0", "max", axis=1)
+
+
+class Export:
+    """Export to other sparse formats."""
+    params = (SIZES, )
+    param_names = ["nnz"]
+
+    def setup(self, nnz):
+        self.stack = create_stack(nnz, n_layers=2)
+
+    def time_to_csr(self, nnz):
+        self.stack.to_csr("layer0")
+
+    def time_to_csc(self, nnz):
+        self.stack.to_csc("layer0")
+
+    def time_to_coo(self, nnz):
+        self.stack.to_coo("layer0")
+
+
+class DenseExport:
+    """Export to dense arrays (skipped if the dense array would be too large)."""
+    params = (SIZES, )
+    param_names = ["nnz"]
+
+    def setup(self, nnz):
+        n_row, n_col = matrix_shape(nnz)
+        if n_row * n_col > MAX_DENSE_SIZE:
+            raise NotImplementedError("Dense array too large")
+        self.stack = create_stack(nnz, n_layers=2)
+
+    def time_to_array(self, nnz):
+        self.stack.to_array("layer0")
+
+    def peakmem_to_array(self, nnz):
+        self.time_to_array(nnz)
+
+    def time_iter_row_blocks(self, nnz):
+        for _ in self.stack.iter_row_blocks("layer0", block_size=1000):
+            pass
+
+
+class Startup:
+    """Import time and latency of the first join in a fresh process.
+
+    Compiled numba kernels are loaded from the on-disk cache (after the first run),
+    so this measures numba import and cache loading, not compilation.
+    """
+    params = ([1000], )
+    param_names = ["n_entries"]
+
+    def timeraw_import(self, n_entries):
+        return "import sparsestack"
+
+    def timeraw_first_join(self, n_entries):
+        return f"""
+from sparsestack import StackedSparseArray
+import numpy as np
+row = np.arange({n_entries}) // 10
+col = np.arange({n_entries}) % 10
+stack = StackedSparseArray({n_entries} // 10, 10)
+stack.add_sparse_data(row, col, np.ones({n_entries}), "layer0")
+stack.add_sparse_data(row, col, np.ones({n_entries}), "layer1", join_type="outer")
+"""
+
+    def timeraw_warmup(self, n_entries):
+        return "import sparsestack; sparsestack.warmup()"
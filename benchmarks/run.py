@@ -0,0 +1,122 @@
+"""Run the sparsestack benchmarks offline (without asv).
+
+Reports the best wall time over several repeats, the throughput (stored entries per
+second) and the peak memory allocated by numpy/python during one call (tracemalloc).
+Run e.g. via:
+
+.. code-block:: bash
+
+    python benchmarks/run.py --sizes 1e4 1e5 1e6 1e7 1e8 --bench Join Filtering
+
+Numba functions are compiled in a warm-up call before timing. `timeraw_*` methods
+(startup latency) are timed in fresh python processes.
+"""
+import argparse
+import inspect
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def benchmark_classes(module):
+    return {name: cls for name, cls in inspect.getmembers(module, inspect.isclass)
+            if cls.__module__ == module.__name__ and hasattr(cls, "params")}
+
+
+def measure(func, repeat):
+    func()  # warm up (numba compilation, caches)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def measure_raw(code, repeat):
+    """Return best wall time of running code in a fresh python process."""
+    script = ("import time\nstart = time.perf_counter()\n" + code
+              + "\nprint(time.perf_counter() - start)")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    subprocess.run([sys.executable, "-c", code], check=True, env=env)  # fill caches
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", script], check=True, env=env,
+                                capture_output=True, text=True)
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(timings), 0
+
+
+def run_class(cls, sizes, repeat, method_filter=None):
+    """Yield results of all time_* and timeraw_* methods of cls for all parameter combinations."""
+    params = list(cls.params)
+    if sizes is not None and cls.param_names[0] == "nnz":
+        params[0] = sizes
+    methods = [name for name in dir(cls) if name.startswith(("time_", "timeraw_"))
+               and (method_filter is None or any(x in name for x in method_filter))]
+    for param in itertools.product(*params):
+        instance = cls()
+        try:
+            if hasattr(instance, "setup"):
+                instance.setup(*param)
+        except NotImplementedError as error:
+            print(f"skipped {cls.__name__}{param}: {error}")
+            continue
+        for method in methods:
+            func = getattr(instance, method)
+            if method.startswith("timeraw_"):
+                best, peak = measure_raw(func(*param), repeat)
+            else:
+                best, peak = measure(lambda func=func, param=param: func(*param), repeat)
+            yield {"benchmark": f"{cls.__name__}.{method}",
+                   "params": dict(zip(cls.param_names, param)),
+                   "time": best,
+                   "throughput": param[0] / best if cls.param_names[0] == "nnz" and best > 0 else None,
+                   "peak_memory": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--sizes", nargs="+", type=float, default=None,
+                        help="Number of entries (default: SPARSESTACK_BENCH_SIZES or 1e4 1e5 1e6).")
+    parser.add_argument("--bench", nargs="+", default=None, help="Benchmark classes to run.")
+    parser.add_argument("--methods", nargs="+", default=None,
+                        help="Only run methods containing one of these strings.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="Write results to this json file.")
+    args = parser.parse_args()
+
+    # pylint: disable=import-outside-toplevel
+    from benchmarks import benchmarks
+    classes = benchmark_classes(benchmarks)
+    if args.bench is not None:
+        classes = {name: classes[name] for name in args.bench}
+    sizes = None if args.sizes is None else [int(x) for x in args.sizes]
+
+    results = []
+    print(f"{'benchmark':<40} {'params':<45} {'time [s]':>10} {'M entries/s':>12} {'peak [MB]':>10}")
+    for cls in classes.values():
+        for result in run_class(cls, sizes, args.repeat, args.methods):
+            throughput = "-" if result["throughput"] is None else f"{result['throughput'] / 1e6:.2f}"
+            params = ", ".join(f"{key}={value}" for key, value in result["params"].items())
+            print(f"{result['benchmark']:<40} {params:<45} {result['time']:>10.4f} "
+                  f"{throughput:>12} {result['peak_memory'] / 1e6:>10.1f}")
+            results.append(result)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Synthetic data generators for the sparsestack benchmarks.
+
+All generators are seeded and only depend on numpy, so benchmarks can be run
+offline and results are comparable between runs.
+"""
+import numpy as np
+
+
+def matrix_shape(nnz: int, density: float = 0.01):
+    """Return (n_row, n_col) of a square matrix with `nnz` entries at given density."""
+    n = int(np.ceil(np.sqrt(nnz / density)))
+    return n, n
+
+
+def random_coo(nnz: int, n_row: int = None, n_col: int = None,
+               density: float = 0.01, row_skew: float = 0.0,
+               dtype=np.float64, seed: int = 0):
+    """Return row, col and values of `nnz` unique random entries (in random order).
+
+    Parameters
+    ----------
+    nnz
+        Number of entries.
+    n_row
+        Number of rows. Default is None, which means a square matrix of given density.
+    n_col
+        Number of columns. Default is None, which means a square matrix of given density.
+    density
+        Fraction of stored entries (only used if n_row and n_col are not given).
+    row_skew
+        Set to values > 0 to concentrate entries in the first rows (0 means uniform).
+        Rows are drawn as n_row * u**(1 + row_skew) with u uniform in [0, 1).
+    dtype
+        Data type of the values. Floats are drawn from [0, 1), integers from [0, 100).
+    seed
+        Seed of the random generator.
+    """
+    # pylint: disable=too-many-arguments
+    if n_row is None or n_col is None:
+        n_row, n_col = matrix_shape(nnz, density)
+    assert nnz <= n_row * n_col, "nnz exceeds size of matrix"
+    rng = np.random.default_rng(seed)
+    keys = np.array([], dtype=np.int64)
+    while len(keys) < nnz:
+        n_draw = int(1.05 * (nnz - len(keys))) + 10
+        row = (n_row * rng.random(n_draw) ** (1 + row_skew)).astype(np.int64)
+        col = rng.integers(0, n_col, n_draw)
+        keys = np.unique(np.concatenate([keys, row * n_col + col]))
+    keys = rng.permutation(keys)[:nnz]
+    row, col = np.divmod(keys, n_col)
+    return row, col, random_values(nnz, dtype, rng)
+
+
+def random_values(n: int, dtype=np.float64, rng=None):
+    """Return n random values of given dtype."""
+    if rng is None:
+        rng = np.random.default_rng(0)
+    if np.issubdtype(dtype, np.integer):
+        return rng.integers(0, 100, n).astype(dtype)
+    return rng.random(n).astype(dtype)
+
+
+def overlapping_coo(row, col, overlap: float, n_row: int, n_col: int,
+                    dtype=np.float64, seed: int = 1):
+    """Return entries of a second layer which share a fraction `overlap` with (row, col).
+
+    The other entries are drawn at random (and may rarely hit existing entries).
+    The result has the same number of entries and is in random order.
+    """
+    # pylint: disable=too-many-arguments
+    rng = np.random.default_rng(seed)
+    n_shared = int(overlap * len(row))
+    shared = rng.choice(len(row), n_shared, replace=False)
+    new_row, new_col, _ = random_coo(len(row) - n_shared, n_row, n_col, seed=seed)
+    keys = np.unique(np.concatenate([row[shared] * n_col + col[shared],
+                                     new_row * n_col + new_col]))
+    keys = rng.permutation(keys)
+    row2, col2 = np.divmod(keys, n_col)
+    return row2, col2, random_values(len(keys), dtype, rng)
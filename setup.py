@@ -23,7 +23,7 @@ setup(
     author="Florian Huber",
     author_email="florian.huber@hs-duesseldorf.de",
     url="https://github.com/florian-huber/stacked-sparse-array",
-    packages=find_packages(exclude=['*tests*']),
+    packages=find_packages(exclude=['*tests*', 'benchmarks*']),
     package_data={"stacked-sparse-array": ["data/*.csv"]},
     license="MIT",
     zip_safe=False,
@@ -43,7 +43,7 @@ setup(
     install_requires=[
         "numba",
         "numpy",
-        "scipy",
+        "scipy>=1.8",
     ],
     extras_require={"dev": ["bump2version",
                             "decorator",
@@ -53,5 +53,8 @@ setup(
                             "pytest",
                             "pytest-cov",
                             "testfixtures",
-                            "yapf",]},
+                            "yapf",],
+                    "arrow": ["pyarrow"],
+                    "compression": ["blosc", "lz4", "zstandard"],
+                    "sparse": ["sparse"]},
 )
@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
+import json
+import os
 import numpy as np
-from scipy.sparse import coo_matrix
-from .utils import join_arrays
+from scipy.sparse import coo_array, coo_matrix, csc_matrix, csr_matrix
+from .profiling import profile
+from .utils import (arg_extreme_segments, compact_array, fill_layer,
+                    get_n_jobs, is_canonical_coo, join_indices, join_layers,
+                    lexsort_if_needed, top_k_segments)
 
 
 _slicing_not_implemented_msg = "Wrong slicing, or option not yet implemented"
+_file_format_version = 1
+_arrow_metadata_key = b"sparsestack"
 
 
 def get_index_dtype(maxval):
-    if maxval <= np.iinfo(np.int32).max:
-        return np.int32
+    """Return smallest dtype for indices from 0 to maxval - 1 (uint16, uint32 or int64)."""
+    if maxval <= np.iinfo(np.uint16).max + 1:
+        return np.uint16
+    if maxval <= np.iinfo(np.uint32).max + 1:
+        return np.uint32
     return np.int64
 
 
@@ -42,12 +52,13 @@ class StackedSparseArray:
         # Add second scores and filter
         sparsestack.add_dense_matrix(scores2, "scores_2", join_type="left")
 
-        # Scores can be accessed using (limited) slicing capabilities
+        # Scores can be accessed using slicing
         sparsestack[3, 4]  # => scores_1 and scores_2 at position row=3, col=4
         sparsestack[3, :]  # => tuple with row, col, scores for all entries in row=3
         sparsestack[:, 2]  # => tuple with row, col, scores for all entries in col=2
         sparsestack[3, :, 0]  # => tuple with row, col, scores_1 for all entries in row=3
         sparsestack[3, :, "scores_1"]  # => same as the one before
+        sparsestack[2:5, [1, 4]]  # => new StackedSparseArray with rows 2-4 and columns 1, 4
 
         # Scores can also be converted to a dense numpy array:
         scores2_after_merge = sparsestack.to_array("scores_2")
@@ -56,10 +67,15 @@ class StackedSparseArray:
     def __init__(self, n_row, n_col):
         self.__n_row = n_row
         self.__n_col = n_col
-        self.idx_dtype = get_index_dtype(maxval=n_row * n_col)
-        self.row = np.array([], dtype=self.idx_dtype)
-        self.col = np.array([], dtype=self.idx_dtype)
-        self.data = None
+        self.row_dtype = get_index_dtype(maxval=n_row)
+        self.col_dtype = get_index_dtype(maxval=n_col)
+        self._row = np.array([], dtype=self.row_dtype)
+        self._col = np.array([], dtype=self.col_dtype)
+        self._layers = {}
+        self._unstructured_data = False
+        self._data_view = None
+        self._canonical = True
+        self._cache = {}
 
     def __repr__(self):
         msg = f"<{self.shape[0]}x{self.shape[1]}x{self.shape[2]} stacked sparse array" \
@@ -81,16 +97,21 @@ class StackedSparseArray:
             return False
         if np.any(self.col != other.col):
             return False
-        if np.any(self.data != other.data):
-            return False
+        for name, values in self._layers.items():
+            if np.any(values != other._layers[name]):
+                return False
         return True
 
     def __setitem__(self, key, d):
         # Typical COO method (e.g. below) would not be safe for stacked array.
         raise NotImplementedError
 
+    @profile
     def __getitem__(self, key):
         row, col, name = self._validate_indices(key)
+        if _is_fancy_index(row) or _is_fancy_index(col):
+            # e.g.: matrix[2:5, [1, 4], "score_1"]
+            return self._slice_stack(row, col, name)
         r, c, d = self._getitem_method(row, col, name)
         if isinstance(row, int) and isinstance(col, int):
             if len(r) == 0:
@@ -101,48 +122,110 @@ class StackedSparseArray:
     def _getitem_method(self, row, col, name):
         # e.g.: matrix[3, 7, "score_1"]
         if isinstance(row, int) and isinstance(col, int):
-            idx = np.where((self.row == row) & (self.col == col))
+            idx = self._find_entry(row, col)
             return self.row[idx], self.col[idx], self._slicing_data(name, idx)
         # e.g.: matrix[3, :, "score_1"]
         if isinstance(row, int) and isinstance(col, slice):
-            self._is_implemented_slice(col)
-            idx = np.where(self.row == row)
+            idx = self._find_axis_entries(row, axis=0)
             return self.row[idx], self.col[idx], self._slicing_data(name, idx)
         # e.g.: matrix[:, 7, "score_1"]
         if isinstance(row, slice) and isinstance(col, int):
-            self._is_implemented_slice(row)
-            idx = np.where(self.col == col)
+            idx = self._find_axis_entries(col, axis=1)
             return self.row[idx], self.col[idx], self._slicing_data(name, idx)
         # matrix[:, :, "score_1"]
         if isinstance(row, slice) and isinstance(col, slice):
-            self._is_implemented_slice(row)
-            self._is_implemented_slice(col)
             return self.row, self.col, self._slicing_data(name)
-        if row == col is None and isinstance(name, str):
+        if row is None and col is None and isinstance(name, str):
             return self.row, self.col, self._slicing_data(name)
         raise IndexError(_slicing_not_implemented_msg)
 
-    def _is_implemented_slice(self, input_slice):
-        # Currently slices like matrix[2:4, :] or not implemented
-        if not input_slice.start == input_slice.stop == input_slice.step is None:
-            raise IndexError(_slicing_not_implemented_msg)
+    def _slice_stack(self, row, col, name):
+        """Return new StackedSparseArray with the selected rows, columns and scores.
+
+        Rows and columns are re-indexed to their position in the selection. Entries are
+        gathered using the row pointer array and a sorted lookup of the selected columns,
+        so no per-index scans over all entries are needed.
+        """
+        # pylint: disable=too-many-locals
+        row_selection = _as_selection(row, self.__n_row)
+        col_selection = _as_selection(col, self.__n_col)
+        n_row_new = self.__n_row if row_selection is None else len(row_selection)
+        n_col_new = self.__n_col if col_selection is None else len(col_selection)
+
+        # Gather all entries of selected rows
+        if row_selection is None:
+            idx = np.arange(len(self.row))
+            row_new = self.row
+        else:
+            order, indptr = self._get_axis_index(axis=0)
+            starts = indptr[row_selection]
+            lengths = indptr[row_selection + 1] - starts
+            idx = _segment_positions(starts, lengths)
+            if order is not None:
+                idx = order[idx]
+            row_new = np.repeat(np.arange(n_row_new), lengths)
+
+        # Keep (and if needed repeat) entries of selected columns
+        if col_selection is None:
+            col_new = self.col[idx]
+        else:
+            col_order = np.argsort(col_selection, kind="stable")
+            col_sorted = col_selection[col_order]
+            cols = self.col[idx]
+            starts = np.searchsorted(col_sorted, cols, side="left")
+            lengths = np.searchsorted(col_sorted, cols, side="right") - starts
+            idx = np.repeat(idx, lengths)
+            row_new = np.repeat(row_new, lengths)
+            col_new = col_order[_segment_positions(starts[lengths > 0], lengths[lengths > 0])]
+
+        sliced_array = StackedSparseArray(n_row_new, n_col_new)
+        row_new = row_new.astype(sliced_array.row_dtype)
+        col_new = col_new.astype(sliced_array.col_dtype)
+        if not is_canonical_coo(row_new, col_new):
+            order = np.lexsort((col_new, row_new))
+            row_new, col_new, idx = row_new[order], col_new[order], idx[order]
+
+        # Collect selected scores
+        if isinstance(name, str):
+            name = [name]
+        elif isinstance(name, slice):
+            name = list(self.score_names)
+        sliced_array._set_coo(row_new, col_new, {x: self._layers[x][idx] for x in name},
+                              canonical=is_canonical_coo(row_new, col_new))
+        return sliced_array
 
     def _slicing_data(self, name, idx=None):
         if isinstance(name, slice) and len(self.score_names) == 1:
             name = self.score_names[0]
         if isinstance(name, str):
             if idx is None:
-                return self.data[name]
-            return self.data[name][idx]
+                return self._layers[name]
+            return self._layers[name][idx]
+        if isinstance(name, list):
+            return self._structured_data(name, idx)
         if isinstance(name, slice) and name.start == name.stop == name.step is None:
             if idx is None:
                 return self.data
-            return self.data[idx]
+            return self._structured_data(self.score_names, idx)
         raise IndexError(_slicing_not_implemented_msg)
 
+    def _structured_data(self, names, idx=None):
+        """Return (selected entries of) the given score layers as structured array."""
+        if idx is None:
+            length = len(self.row)
+        elif isinstance(idx, slice):
+            length = len(range(*idx.indices(len(self.row))))
+        else:
+            length = len(idx)
+        data = np.zeros(length, dtype=[(name, self._layers[name].dtype) for name in names])
+        for name in names:
+            data[name] = self._layers[name] if idx is None else self._layers[name][idx]
+        return data
+
     def _validate_indices(self, key):
         def validate_index(index, shape):
-            if isinstance(index, int):
+            if isinstance(index, (int, np.integer)) and not isinstance(index, bool):
+                index = int(index)
                 if index < -shape or index >= shape:
                     raise IndexError(f"Index ({index}) out of range")
                 if index < 0:
@@ -153,16 +236,37 @@ class StackedSparseArray:
 
         m, n, _ = self.shape
         row, col, name = _unpack_index(key)
-        if row == col is None and isinstance(name, str):
+        if row is None and col is None and isinstance(name, str):
             return row, col, name
 
-        if isinstance(name, int):
-            name = self.score_names[name]
-
+        name = self._validate_name(name)
         row = validate_index(row, m)
         col = validate_index(col, n)
         return row, col, name
 
+    def _validate_name(self, name):
+        """Convert score index (name, position, slice, list or mask) to name(s).
+
+        Returns a score name, a list of score names or slice(None) for all scores.
+        """
+        if isinstance(name, str):
+            return name
+        if isinstance(name, (int, np.integer)) and not isinstance(name, bool):
+            return self.score_names[name]
+        if isinstance(name, slice):
+            if name.start == name.stop == name.step is None:
+                return name
+            return list(self.score_names[name])
+        if isinstance(name, (list, tuple, np.ndarray)):
+            names = np.asarray(name)
+            if names.dtype.kind == "b" and len(names) == len(self.score_names):
+                return [x for x, keep in zip(self.score_names, names) if keep]
+            if names.dtype.kind in "iu":
+                return [self.score_names[i] for i in names]
+            if names.dtype.kind == "U":
+                return [str(x) for x in names]
+        raise IndexError(_slicing_not_implemented_msg)
+
     def _asindices(self, idx, length):
         """Convert `idx` to a valid index for an axis with a given length.
         Subclasses that need special validation can override this method.
@@ -175,8 +279,16 @@ class StackedSparseArray:
         if x.ndim not in (1, 2):
             raise IndexError('Index dimension must be 1 or 2')
 
+        if x.dtype.kind == "b":
+            if x.shape != (length,):
+                raise IndexError("Boolean index must have same length as axis")
+            return np.flatnonzero(x)
+
         if x.size == 0:
-            return x
+            return x.astype(np.int64)
+
+        if x.dtype.kind not in "iu":
+            raise IndexError(_slicing_not_implemented_msg)
 
         # Check bounds
         max_indx = x.max()
@@ -192,29 +304,467 @@ class StackedSparseArray:
             x[x < 0] += length
         return x
 
+    @property
+    def row(self):
+        return self._row
+
+    @row.setter
+    def row(self, row):
+        self._row = _as_index_array(row, self.__n_row, self.row_dtype)
+        self._canonical = False
+        self._cache = {}
+
+    @property
+    def col(self):
+        return self._col
+
+    @col.setter
+    def col(self, col):
+        self._col = _as_index_array(col, self.__n_col, self.col_dtype)
+        self._canonical = False
+        self._cache = {}
+
+    @property
+    def data(self):
+        """All scores as (read-only) structured numpy array.
+
+        Scores are stored as separate contiguous arrays per score name (layer), so this
+        structured array is only a (cached) compatibility view. It is created on first
+        access which requires a copy of all layers. Use `stack[name]` or
+        `stack.get_layer(name)` to access the scores of one layer without copying.
+        """
+        if len(self._layers) == 0:
+            return None
+        if self._unstructured_data:
+            return next(iter(self._layers.values()))
+        if self._data_view is None:
+            self._data_view = self._structured_data(self.score_names)
+            self._data_view.flags.writeable = False
+        return self._data_view
+
+    @data.setter
+    def data(self, data):
+        if data is None:
+            self._set_layers({})
+        elif data.dtype.names is None:
+            self._set_layers({data.dtype.str: data})
+            self._unstructured_data = True
+        else:
+            self._set_layers({name: np.ascontiguousarray(data[name])
+                              for name in data.dtype.names})
+
+    def _set_layers(self, layers):
+        self._layers = layers
+        self._unstructured_data = False
+        self._data_view = None
+
+    def get_layer(self, name):
+        """Return the scores of layer `name` (contiguous 1D array, no copy)."""
+        return self._layers[name]
+
+    def drop_score(self, name):
+        """Remove score layer `name` from the stack (in-place).
+
+        Entries are kept, even if they have no other scores left.
+        """
+        layers = dict(self._layers)
+        del layers[name]
+        self._set_layers(layers)
+
+    @property
+    def nbytes(self):
+        """Total number of bytes of row, col and all score layers."""
+        layers_nbytes = sum(values.nbytes for values in self._layers.values())
+        return self.row.nbytes + self.col.nbytes + layers_nbytes
+
+    def memory_usage(self):
+        """Return number of bytes of index arrays, score layers and cached indexes.
+
+        Memory-mapped arrays are counted with their full size (even if not in memory).
+
+        Returns
+        -------
+        Dictionary with "row", "col", "layers" (bytes per score layer), "cache" (bytes per
+        cached index, e.g. for lookups and slicing) and "total".
+        """
+        cache = {name: sum(x.nbytes for x in arrays if x is not None)
+                 for name, arrays in self._cache.items()}
+        if self._data_view is not None:
+            cache["data_view"] = self._data_view.nbytes
+        usage = {"row": self.row.nbytes,
+                 "col": self.col.nbytes,
+                 "layers": {name: values.nbytes for name, values in self._layers.items()},
+                 "cache": cache}
+        usage["total"] = usage["row"] + usage["col"] + sum(usage["layers"].values()) \
+            + sum(cache.values())
+        return usage
+
+    def downcast_layers(self, names=None, float_dtype=np.float32):
+        """Convert score layers to more compact dtypes (in-place).
+
+        Integer layers (e.g. counts) are converted to the smallest integer dtype that
+        can hold all their values, e.g. uint8 or uint16, which is lossless. Float layers
+        are converted to `float_dtype`, which reduces precision.
+
+        Parameters
+        ----------
+        names
+            Name(s) of the score layers to convert. Default is None (all layers).
+        float_dtype
+            Dtype for float layers, np.float32 (default) or np.float64. Set to None
+            to only convert integer layers. np.float16 is not supported (top_k, reduce
+            and in-place filtering run compiled numba code, which has no float16).
+
+        Returns
+        -------
+        Number of bytes saved.
+        """
+        if float_dtype is not None and np.dtype(float_dtype) == np.float16:
+            raise ValueError("float16 layers are not supported, use float32")
+        if names is None:
+            names = list(self._layers)
+        elif isinstance(names, str):
+            names = [names]
+        nbytes = self.nbytes
+        layers = dict(self._layers)
+        for name in names:
+            values = layers[name]
+            if values.dtype.kind in "iu" and len(values) > 0:
+                dtype = np.result_type(np.min_scalar_type(values.min()),
+                                       np.min_scalar_type(values.max()))
+            elif values.dtype.kind == "f" and float_dtype is not None:
+                dtype = np.dtype(float_dtype)
+            else:
+                continue
+            if dtype.itemsize < values.dtype.itemsize:
+                layers[name] = values.astype(dtype)
+        unstructured_data = self._unstructured_data
+        self._set_layers(layers)
+        self._unstructured_data = unstructured_data
+        return nbytes - self.nbytes
+
+    @property
+    def is_canonical(self):
+        """True if entries are sorted by row and then by col, without duplicates.
+
+        All methods to add or filter data maintain this flag. Assigning new `row` or `col`
+        arrays resets it, changing them in-place is not tracked.
+        """
+        return self._canonical
+
+    def _set_coo(self, row, col, layers, canonical):
+        """Set row, col and score layers of the stack and the matching canonical flag.
+
+        row and col are converted to the (compact) index dtypes of the stack, so they
+        must be within its dimensions.
+        """
+        self._row = row.astype(self.row_dtype, copy=False)
+        self._col = col.astype(self.col_dtype, copy=False)
+        self._set_layers(layers)
+        self._canonical = canonical
+        self._cache = {}
+
+    def _get_key_index(self):
+        """Return sorted packed (row, col) keys and the matching order of the entries.
+
+        Keys are computed as row * n_col + col (int64). The index is built lazily and
+        cached until row or col change. For canonical stacks the keys are already sorted
+        and the returned order is None.
+        """
+        if "key_index" not in self._cache:
+            keys = self.row.astype(np.int64) * self.__n_col + self.col
+            order = None
+            if not self._canonical:
+                order = np.argsort(keys, kind="stable")
+                keys = keys[order]
+            self._cache["key_index"] = (keys, order)
+        return self._cache["key_index"]
+
+    def _get_axis_index(self, axis):
+        """Return order and indptr of all entries grouped by row (axis=0) or col (axis=1).
+
+        Entries of row/col i are found at order[indptr[i]:indptr[i + 1]] (CSR/CSC-style).
+        Within each group, entries keep their stored order. The index is built lazily and
+        cached until row or col change. If the entries are already grouped (rows of a
+        canonical stack), the returned order is None.
+        """
+        cache_name = f"axis_index_{axis}"
+        if cache_name not in self._cache:
+            indices = self.row if axis == 0 else self.col
+            order = None
+            if not (axis == 0 and self._canonical):
+                order = np.argsort(indices, kind="stable")
+            counts = np.bincount(indices, minlength=self.shape[axis])
+            indptr = np.zeros(self.shape[axis] + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            self._cache[cache_name] = (order, indptr)
+        return self._cache[cache_name]
+
+    def _find_axis_entries(self, index, axis):
+        """Return index of all entries in row (axis=0) or col (axis=1) `index`."""
+        order, indptr = self._get_axis_index(axis)
+        if order is None:
+            return slice(indptr[index], indptr[index + 1])
+        return order[indptr[index]:indptr[index + 1]]
+
+    def _find_entry(self, row, col):
+        """Return index of all entries at position row, col."""
+        keys, order = self._get_key_index()
+        key = np.int64(row) * self.__n_col + col
+        low = np.searchsorted(keys, key, side="left")
+        high = np.searchsorted(keys, key, side="right")
+        if order is None:
+            return slice(low, high)
+        return order[low:high]
+
     @property
     def shape(self):
         return self.__n_row, self.__n_col, len(self.score_names)
 
     @property
     def score_names(self):
-        if self.data is None:
+        if len(self._layers) == 0:
             return []
-        if self.data.dtype.names is None:
-            return [self.data.dtype.str]
-        return self.data.dtype.names
+        if self._unstructured_data:
+            return list(self._layers)
+        return tuple(self._layers)
+
+    def lookup(self, rows, cols, name=None, fill_value=0):
+        """Return scores for many (row, col) positions at once.
+
+        Uses a (lazily built) sorted index of packed (row, col) keys, so that every
+        lookup is a binary search rather than a scan over all entries.
+
+        Parameters
+        ----------
+        rows
+            Row indices of the positions to look up.
+        cols
+            Column indices of the positions to look up (same length as `rows`).
+        name
+            Name of the score that should be returned (if multiple scores are stored).
+            If set to None (default) all scores will be returned as structured array.
+        fill_value
+            Value returned for positions without stored entry. Default is 0.
+        """
+        rows = self._asindices(np.atleast_1d(rows), self.__n_row)
+        cols = self._asindices(np.atleast_1d(cols), self.__n_col)
+        if rows.shape != cols.shape:
+            raise IndexError("rows and cols must have the same shape")
+        if name is None and self.shape[2] == 1:
+            name = self.score_names[0]
+        if name is None:
+            dtype = [(x, values.dtype) for x, values in self._layers.items()]
+        else:
+            dtype = self._layers[name].dtype
+
+        keys, order = self._get_key_index()
+        lookup_keys = rows.astype(np.int64) * self.__n_col + cols
+        values = np.full(lookup_keys.shape, fill_value, dtype=dtype)
+        if len(keys) == 0:
+            return values
+        positions = np.searchsorted(keys, lookup_keys)
+        positions[positions == len(keys)] = len(keys) - 1
+        found = keys[positions] == lookup_keys
+        if order is not None:
+            positions = order[positions]
+        if name is None:
+            for x, layer in self._layers.items():
+                values[x][found] = layer[positions[found]]
+        else:
+            values[found] = self._layers[name][positions[found]]
+        return values
 
     def clone(self):
         """ Returns clone (deepcopy) of StackedSparseArray instance."""
         cloned_array = StackedSparseArray(self.__n_row, self.__n_col)
-        cloned_array.row = self.row
-        cloned_array.col = self.col
-        cloned_array.data = self.data
+        cloned_array._set_coo(self.row.copy(), self.col.copy(),
+                              {name: values.copy() for name, values in self._layers.items()},
+                              self._canonical)
         return cloned_array
 
+    @classmethod
+    def from_blocks(cls, n_row, n_col, blocks,
+                    name: str,
+                    low=-np.inf, high=np.inf,
+                    above_operator='>',
+                    below_operator='<'):
+        """Create StackedSparseArray from blocks (tiles) of a large score matrix.
+
+        Each block is sparsified (and filtered) on arrival, so the full (dense) score
+        matrix never has to be in memory. Peak memory is proportional to the number of
+        stored entries plus one block.
+
+        Code example:
+
+        .. code-block:: python
+
+            def compute_blocks(block_size=1000):
+                for i in range(0, n_row, block_size):
+                    yield i, 0, compute_scores(queries[i:i + block_size], references)
+
+            scores = StackedSparseArray.from_blocks(n_row, n_col, compute_blocks(),
+                                                    "scores_1", low=0.5)
+
+        Parameters
+        ----------
+        n_row
+            Number of rows of sparse array.
+        n_col
+            Number of colums of sparse array.
+        blocks
+            Iterable of (row_offset, col_offset, block) tuples. A block can be a dense
+            numpy array or a sparse matrix (e.g. scipy COO-matrix with .row, .col, .data).
+            Blocks may come in any order but must not overlap.
+        name
+            Name of the score which is added.
+        low
+            Lower threshold below which scores will not be stored. Default is -np.inf.
+        high
+            Upper threshold above of which scores will not be stored. Default is np.inf.
+        above_operator
+            Define operator to be used to compare against `low`. Default is '>'.
+            Possible choices are '>', '<', '>=', '<='.
+        below_operator
+            Define operator to be used to compare against `high`. Default is '<'.
+            Possible choices are '>', '<', '>=', '<='.
+        """
+        # pylint: disable=too-many-arguments
+        # pylint: disable=too-many-locals
+        stacked_array = cls(n_row, n_col)
+        rows, cols, values = [], [], []
+        for row_offset, col_offset, block in blocks:
+            block_row, block_col, block_values = _sparse_entries(block)
+            if _is_range_set(low, high):
+                idx = np.where(_range_mask(block_values, low, high,
+                                           above_operator, below_operator))
+                block_row, block_col, block_values = block_row[idx], block_col[idx], block_values[idx]
+            if len(block_row) == 0:
+                continue
+            assert row_offset + np.max(block_row) < n_row, "block rows exceed dimension of sparse stack"
+            assert col_offset + np.max(block_col) < n_col, "block columns exceed dimension of sparse stack"
+            rows.append((block_row + row_offset).astype(stacked_array.row_dtype))
+            cols.append((block_col + col_offset).astype(stacked_array.col_dtype))
+            values.append(block_values)
+
+        if len(values) == 0:
+            return stacked_array
+        row = np.concatenate(rows)
+        del rows
+        col = np.concatenate(cols)
+        del cols
+        layers = _as_layers(np.concatenate(values), name)
+        del values
+        if not is_canonical_coo(row, col):
+            idx = np.lexsort((col, row))
+            row, col = row[idx], col[idx]
+            layers = {x: values[idx] for x, values in layers.items()}
+        stacked_array._set_coo(row, col, layers, canonical=is_canonical_coo(row, col))
+        return stacked_array
+
+    @classmethod
+    def from_layers(cls, layers: dict, join_type: str = "outer",
+                    n_row: int = None, n_col: int = None):
+        """Create StackedSparseArray from several score layers at once.
+
+        The joint set of (row, col) entries is computed once for all layers, and every
+        layer is filled in a single pass (instead of one join per added layer).
+
+        Code example:
+
+        .. code-block:: python
+
+            scores = StackedSparseArray.from_layers({"scores_1": coo_1, "scores_2": csr_2},
+                                                    join_type="inner")
+
+        Parameters
+        ----------
+        layers
+            Dictionary with score names as keys and score matrices as values. Score matrices
+            can be scipy sparse matrices (any format), COO-style objects (with .row, .col,
+            .data), dense numpy arrays or (row, col, data) tuples. Entries (row, col) must
+            be unique within each layer.
+        join_type
+            Choose from "outer" (default, keep entries of all layers), "inner" (keep entries
+            present in all layers) or "left" (keep entries of the first layer).
+        n_row
+            Number of rows of sparse array. Default is None, which means the largest
+            number of rows of all score matrices (largest row + 1 for tuples).
+        n_col
+            Number of colums of sparse array. Default is None, which means the largest
+            number of columns of all score matrices (largest col + 1 for tuples).
+        """
+        # pylint: disable=too-many-locals
+        if join_type not in ["outer", "inner", "left"]:
+            raise ValueError("Unknown join_type (must be 'outer', 'inner', 'left')")
+        entries = {name: _sparse_entries(layer) for name, layer in layers.items()}
+        shapes = [_matrix_shape(layers[name], row, col) for name, (row, col, _) in entries.items()]
+        if n_row is None:
+            n_row = max((shape[0] for shape in shapes), default=0)
+        if n_col is None:
+            n_col = max((shape[1] for shape in shapes), default=0)
+        stacked_array = cls(n_row, n_col)
+        if len(entries) == 0:
+            return stacked_array
+
+        # Entries as sorted (row-major) keys
+        keys = {}
+        for name, (row, col, _) in entries.items():
+            assert len(row) == 0 or np.max(row) < n_row, "row values have dimension larger than sparse stack"
+            assert len(col) == 0 or np.max(col) < n_col, "column values have dimension larger than sparse stack"
+            keys[name] = row.astype(np.int64) * n_col + col
+        if join_type == "left":
+            keys_new = np.sort(next(iter(keys.values())))
+        else:
+            # Stable sort merges the sorted runs of all layers
+            keys_all = np.sort(np.concatenate([np.sort(x) for x in keys.values()]), kind="stable")
+            is_first = np.ones(len(keys_all), dtype=bool)
+            is_first[1:] = keys_all[1:] != keys_all[:-1]
+            keys_new = keys_all[is_first]
+            if join_type == "inner":
+                counts = np.diff(np.append(np.flatnonzero(is_first), len(keys_all)))
+                keys_new = keys_new[counts == len(keys)]
+
+        new_layers = {}
+        for name, (_, _, values) in entries.items():
+            positions = np.searchsorted(keys_new, keys[name])
+            if join_type != "outer":
+                found = positions < len(keys_new)
+                found[found] = keys_new[positions[found]] == keys[name][found]
+                positions, values = positions[found], values[found]
+            new_layers[name] = np.zeros(len(keys_new), dtype=values.dtype)
+            new_layers[name][positions] = values
+        row, col = np.divmod(keys_new, n_col)
+        stacked_array._set_coo(row, col, new_layers, canonical=True)
+        return stacked_array
+
+    @classmethod
+    def from_dict(cls, dictionary: dict):
+        """Create StackedSparseArray from dictionary (as created by `.to_dict()`)."""
+        stacked_array = cls(dictionary["n_row"], dictionary["n_col"])
+        row = np.array(dictionary["row"], dtype=stacked_array.row_dtype)
+        col = np.array(dictionary["col"], dtype=stacked_array.col_dtype)
+        descr = [tuple(x) for x in dictionary["dtype"]]
+        if len(descr) == 1 and descr[0][0] == "":
+            # Unstructured data
+            data = np.array(dictionary["data"], dtype=descr[0][1])
+            stacked_array._set_coo(row, col, {data.dtype.str: data},
+                                   canonical=is_canonical_coo(row, col))
+            stacked_array._unstructured_data = True
+        else:
+            columns = list(zip(*dictionary["data"])) if len(row) > 0 else [[]] * len(descr)
+            layers = {name: np.array(values, dtype=dtype)
+                      for (name, dtype), values in zip(descr, columns)}
+            stacked_array._set_coo(row, col, layers, canonical=is_canonical_coo(row, col))
+        return stacked_array
+
     def add_dense_matrix(self, matrix: np.ndarray,
                          name: str,
-                         join_type="left"):
+                         join_type="left",
+                         low=-np.inf, high=np.inf,
+                         above_operator='>',
+                         below_operator='<',
+                         n_jobs=1):
         """Add dense array (numpy array) to stacked sparse scores.
 
         If the StackedSparseArray is still empty, the full dense matrix will
@@ -233,42 +783,56 @@ class StackedSparseArray:
             the added scores, for instance via `sss_array.toarray("my_score_name")`.
         join_mode
             Choose from left, right, outer, inner to specify the merge type.
+        low
+            Lower threshold. Only scores above `low` will be added, all other values
+            are dropped before joining. Default is -np.inf.
+        high
+            Upper threshold. Only scores below `high` will be added, all other values
+            are dropped before joining. Default is np.inf.
+        above_operator
+            Define operator to be used to compare against `low`. Default is '>'.
+            Possible choices are '>', '<', '>=', '<='.
+        below_operator
+            Define operator to be used to compare against `high`. Default is '<'.
+            Possible choices are '>', '<', '>=', '<='.
+        n_jobs
+            Number of threads used to sort and join the data. The join is split
+            into row ranges which are processed in parallel. Set to -1 to use all
+            cpu cores. Default is 1.
         """
+        # pylint: disable=too-many-arguments
         if matrix is None:
             self.data = np.array([])
         else:
-            self._add_dense_matrix(matrix, name, join_type)
-
-    def _add_dense_matrix(self, matrix, name, join_type):
-        def get_dtype(data):
-            if data.dtype.type == np.void:
-                return data.dtype[0]
-            return data.dtype
+            self._add_dense_matrix(matrix, name, join_type,
+                                   (low, high, above_operator, below_operator),
+                                   n_jobs=n_jobs)
 
+    def _add_dense_matrix(self, matrix, name, join_type, value_range, n_jobs=1):
+        # pylint: disable=too-many-arguments
         # Handle 1D arrays
         if matrix.ndim == 1:
             matrix = matrix.reshape(-1, 1)
 
-        # Handle structured arrays > 1 dimension
-        if len(matrix.dtype) > 1:
-            dtype_data = [(f"{name}_{dtype_name}", get_dtype(matrix[dtype_name])) for dtype_name in matrix.dtype.names]
+        if _is_range_set(*value_range[:2]):
+            _check_not_structured(matrix)
+            (idx_row, idx_col) = np.where((matrix != 0) & _range_mask(matrix, *value_range))
         else:
-            dtype_data = [(name, get_dtype(matrix))]
-
-
-        if self.shape[2] == 0 or (self.shape[2] == 1 and name in self.score_names):
-            # Add first (sparse) array of scores
             (idx_row, idx_col) = np.where(matrix)
-            self.row = idx_row
-            self.col = idx_col
 
-            self.data = np.array(matrix[idx_row, idx_col], dtype=dtype_data)
+        values = matrix[idx_row, idx_col]
+        if values.dtype.names is not None and len(values.dtype.names) == 1:
+            # Structured arrays with only one field are added as one score `name`
+            values = values[values.dtype.names[0]]
+        if self.shape[2] == 0 or (self.shape[2] == 1 and name in self.score_names):
+            # Add first (sparse) array of scores (np.where returns row-major order)
+            self._set_coo(idx_row, idx_col, _as_layers(values, name), canonical=True)
         else:
             # Add new stack of scores
-            (idx_row, idx_col) = np.where(matrix)
-            self.add_sparse_data(idx_row, idx_col, matrix[idx_row, idx_col],
+            self.add_sparse_data(idx_row, idx_col, values,
                                  name=name,
-                                 join_type=join_type)
+                                 join_type=join_type,
+                                 n_jobs=n_jobs)
 
     def guess_score_name(self):
         if len(self.score_names) == 1:
@@ -279,7 +843,11 @@ class StackedSparseArray:
 
     def add_coo_matrix(self, coo_matrix,
                        name,
-                       join_type="left"):
+                       join_type="left",
+                       low=-np.inf, high=np.inf,
+                       above_operator='>',
+                       below_operator='<',
+                       n_jobs=1):
         """Add sparse matrix (scipy COO-matrix) to stacked sparse scores.
 
         If the StackedSparseArray is still empty, the full sparse matrix will
@@ -299,12 +867,38 @@ class StackedSparseArray:
             the added scores, for instance via `sss_array.toarray("my_score_name")`.
         join_mode
             Choose from left, right, outer, inner to specify the merge type.
+        low
+            Lower threshold. Only scores above `low` will be added, all other values
+            are dropped before joining. Default is -np.inf.
+        high
+            Upper threshold. Only scores below `high` will be added, all other values
+            are dropped before joining. Default is np.inf.
+        above_operator
+            Define operator to be used to compare against `low`. Default is '>'.
+            Possible choices are '>', '<', '>=', '<='.
+        below_operator
+            Define operator to be used to compare against `high`. Default is '<'.
+            Possible choices are '>', '<', '>=', '<='.
+        n_jobs
+            Number of threads used to sort and join the data. The join is split
+            into row ranges which are processed in parallel. Set to -1 to use all
+            cpu cores. Default is 1.
         """
-        self.add_sparse_data(coo_matrix.row, coo_matrix.col, coo_matrix.data, name, join_type)
+        # pylint: disable=too-many-arguments
+        self.add_sparse_data(coo_matrix.row, coo_matrix.col, coo_matrix.data, name, join_type,
+                             low=low, high=high,
+                             above_operator=above_operator,
+                             below_operator=below_operator,
+                             n_jobs=n_jobs)
 
+    @profile
     def add_sparse_data(self, row, col, data: np.ndarray,
                         name: str,
-                        join_type="left"):
+                        join_type="left",
+                        low=-np.inf, high=np.inf,
+                        above_operator='>',
+                        below_operator='<',
+                        n_jobs=1):
         """Add sparse data to stacked sparse scores.
 
         If the StackedSparseArray is still empty, the full sparse data will
@@ -323,23 +917,212 @@ class StackedSparseArray:
             the added scores, for instance via `sss_array.toarray("my_score_name")`.
         join_mode
             Choose from left, right, outer, inner to specify the merge type.
+        low
+            Lower threshold. Only scores above `low` will be added, all other values
+            are dropped before joining. Default is -np.inf.
+        high
+            Upper threshold. Only scores below `high` will be added, all other values
+            are dropped before joining. Default is np.inf.
+        above_operator
+            Define operator to be used to compare against `low`. Default is '>'.
+            Possible choices are '>', '<', '>=', '<='.
+        below_operator
+            Define operator to be used to compare against `high`. Default is '<'.
+            Possible choices are '>', '<', '>=', '<='.
+        n_jobs
+            Number of threads used to sort and join the data. The join is split
+            into row ranges which are processed in parallel. Set to -1 to use all
+            cpu cores. Default is 1.
         """
         # pylint: disable=too-many-arguments
-        if self.shape[2] == 0 or (self.shape[2] == 1 and name in self.score_names):
+        row = np.asarray(row)
+        col = np.asarray(col)
+        if _is_range_set(low, high):
+            _check_not_structured(data)
+            idx = np.where(_range_mask(data, low, high, above_operator, below_operator))
+            row, col, data = row[idx], col[idx], data[idx]
+        is_first_layer = self.shape[2] == 0 or (self.shape[2] == 1 and name in self.score_names)
+        if not is_first_layer and join_type in ["left", "inner"]:
+            # Entries outside of the stack can not match existing entries
+            inside = _within_dimension(row, self.shape[0]) & _within_dimension(col, self.shape[1])
+            if not np.all(inside):
+                row, col, data = row[inside], col[inside], data[inside]
+        elif len(row) > 0:
+            assert np.all(_within_dimension(row, self.shape[0])), \
+                "row values have dimension larger than sparse stack"
+            assert np.all(_within_dimension(col, self.shape[1])), \
+                "column values have dimension larger than sparse stack"
+        # Convert to the (compact) index dtypes of the stack
+        row = row.astype(self.row_dtype, copy=False)
+        col = col.astype(self.col_dtype, copy=False)
+        if is_first_layer:
             # Add first (sparse) array of scores
-            self.data = update_structed_array_names(data, name)
-            self.row = row.copy()
-            self.col = col.copy()
+            layers = _as_layers(data, name)
+            if is_canonical_coo(row, col):
+                # Copy to not share (and later compact) the arrays of the caller
+                self._set_coo(row.copy(), col.copy(),
+                              {x: values.copy() for x, values in layers.items()}, canonical=True)
+            else:
+                idx = lexsort_if_needed(row, col, get_n_jobs(n_jobs))
+                self._set_coo(row[idx], col[idx], {x: values[idx] for x, values in layers.items()},
+                              canonical=is_canonical_coo(row[idx], col[idx]))
+        else:
+            row, col, layers = join_layers(self.row, self.col, self._layers,
+                                           row, col, _as_layers(data, name),
+                                           join_type=join_type,
+                                           left_sorted=self._canonical,
+                                           n_jobs=n_jobs)
+            # Left and inner joins only keep (unique) keys of a canonical stack
+            canonical = self._canonical and join_type in ["left", "inner"]
+            self._set_coo(row, col, layers,
+                          canonical=canonical or is_canonical_coo(row, col))
+
+    def derive(self, name: str, func, names=None, chunk_size: int = None):
+        """Compute a new score layer `name` from the existing score layers.
+
+        The new scores are computed on the entries (row, col) which are already in the
+        stack, so no join is needed (unlike extracting scores and adding them again
+        via `add_sparse_data`).
+
+        Parameters
+        ----------
+        name
+            Name of the new score layer.
+        func
+            Function that computes the new scores. If `names` is None, func gets a
+            dictionary with all score layers, e.g. `lambda d: 0.7 * d["a"] + 0.3 * d["b"]`.
+            Otherwise func gets the score layers in `names` as positional arguments,
+            which also allows to pass numba-compiled functions.
+            Must return one value per entry.
+        names
+            Name(s) of the score layers which are passed to func. Default is None.
+        chunk_size
+            If given, func is evaluated on chunks of at most `chunk_size` entries to
+            limit the size of temporary arrays. Default is None (all entries at once).
+        """
+        if name in self._layers:
+            raise ValueError(f"Score name(s) {[name]} already exist.")
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        if names is None:
+            def evaluate(chunk):
+                return func({key: values[chunk] for key, values in self._layers.items()})
         else:
-            if join_type in ["outer", "right"]:
-                assert np.max(row) <= self.shape[0], "row values have dimension larger than sparse stack"
-                assert np.max(col) <= self.shape[1], "column values have dimension larger than sparse stack"
-            self.row, self.col, self.data = join_arrays(self.row, self.col, self.data,
-                                                        row, col,
-                                                        data,
-                                                        name,
-                                                        join_type=join_type)
+            names = [names] if isinstance(names, str) else list(names)
+            layers = [self._layers[key] for key in names]
 
+            def evaluate(chunk):
+                return func(*(values[chunk] for values in layers))
+
+        nnz = len(self.row)
+        if chunk_size is None or chunk_size >= nnz:
+            layer = _as_layer_values(evaluate(slice(None)), nnz)
+            if any(np.may_share_memory(layer, values) for values in self._layers.values()):
+                # e.g. func returns one of the layers (layers must not share buffers)
+                layer = layer.copy()
+        else:
+            first = _as_layer_values(evaluate(slice(0, chunk_size)), chunk_size)
+            layer = np.empty(nnz, dtype=first.dtype)
+            layer[:chunk_size] = first
+            for start in range(chunk_size, nnz, chunk_size):
+                end = min(start + chunk_size, nnz)
+                layer[start:end] = _as_layer_values(evaluate(slice(start, end)), end - start)
+        layers = dict(self._layers)
+        layers[name] = layer
+        self._set_layers(layers)
+
+    def merge(self, other, how: str = "outer", layers=None,
+              suffixes=("", "_other"), n_jobs=1):
+        """Merge score layers of two StackedSparseArrays by (row, col) into a new array.
+
+        Both arrays are aligned in one merge pass. Entries missing in one of the arrays
+        get 0 as score in the respective layers.
+
+        Parameters
+        ----------
+        other
+            StackedSparseArray to merge with.
+        how
+            Choose from left, right, outer (default), inner to specify the merge type.
+        layers
+            Name(s) of the score layers of `other` which are merged. Default is None,
+            which means all layers.
+        suffixes
+            Suffixes which are added to score names that exist in both arrays.
+            Default is ("", "_other"), so score names of this array are kept.
+        n_jobs
+            Number of threads used to sort and join the data. Default is 1.
+
+        Returns
+        -------
+        New StackedSparseArray containing the merged entries and score layers.
+        """
+        # pylint: disable=too-many-arguments
+        if layers is None:
+            layers = list(other._layers)
+        elif isinstance(layers, str):
+            layers = [layers]
+        duplicate_names = set(layers).intersection(self._layers)
+        layers1 = {_add_suffix(name, suffixes[0], name in duplicate_names): values
+                   for name, values in self._layers.items()}
+        layers2 = {_add_suffix(name, suffixes[1], name in duplicate_names): other._layers[name]
+                   for name in layers}
+        shape = _merged_shape(self.shape, other.shape, how)
+        row1, col1, row2, col2 = _as_joined_indices(self, other)
+        row, col, layers = join_layers(row1, col1, layers1,
+                                       row2, col2, layers2,
+                                       join_type=how,
+                                       left_sorted=self._canonical,
+                                       n_jobs=n_jobs)
+        # Left joins keep the arrays of self, which must not be shared (e.g. by in-place filters)
+        shared = {id(x) for x in (self.row, self.col, *self._layers.values())}
+        row, col = _unshared(row, shared), _unshared(col, shared)
+        layers = {name: _unshared(values, shared) for name, values in layers.items()}
+        merged_array = StackedSparseArray(*shape)
+        merged_array._set_coo(row, col, layers,
+                              canonical=(self._canonical and how in ["left", "inner"])
+                              or is_canonical_coo(row, col))
+        return merged_array
+
+    def _combine(self, other, operator, how):
+        """Apply operator layer-wise to two StackedSparseArrays aligned by (row, col)."""
+        if not isinstance(other, StackedSparseArray):
+            return NotImplemented
+        if set(self.score_names) != set(other.score_names):
+            raise ValueError("Both arrays must contain the same score names.")
+        shape = _merged_shape(self.shape, other.shape, how)
+        row, col, idx_left, idx_left_new, idx_right, idx_right_new = join_indices(
+            *_as_joined_indices(self, other), join_type=how, left_sorted=self._canonical)
+        layers = {name: operator(fill_layer(values, idx_left, idx_left_new, len(row)),
+                                 fill_layer(other._layers[name], idx_right, idx_right_new, len(row)))
+                  for name, values in self._layers.items()}
+        combined_array = StackedSparseArray(*shape)
+        combined_array._set_coo(row, col, layers, canonical=is_canonical_coo(row, col))
+        return combined_array
+
+    def __add__(self, other):
+        # Missing entries count as 0, so the union of all entries is kept
+        return self._combine(other, np.add, how="outer")
+
+    def __sub__(self, other):
+        return self._combine(other, np.subtract, how="outer")
+
+    def __mul__(self, other):
+        if np.isscalar(other):
+            scaled_array = StackedSparseArray(*self.shape[:2])
+            scaled_array._set_coo(self.row.copy(), self.col.copy(),
+                                  {name: values * other for name, values in self._layers.items()},
+                                  canonical=self._canonical)
+            return scaled_array
+        # Products with missing entries are 0, so only shared entries are kept
+        return self._combine(other, np.multiply, how="inner")
+
+    def __rmul__(self, other):
+        if np.isscalar(other):
+            return self.__mul__(other)
+        return NotImplemented
+
+    @profile
     def filter_by_range(self, name: str = None,
                         low=-np.inf, high=np.inf,
                         above_operator='>',
@@ -363,19 +1146,191 @@ class StackedSparseArray:
             Possible choices are '>', '<', '>=', '<='.
         """
         # pylint: disable=too-many-arguments
-        above_operator = _get_operator(above_operator)
-        below_operator = _get_operator(below_operator)
+        return self.filter([(name, low, high, above_operator, below_operator)])
+
+    @profile
+    def filter(self, conditions, combine: str = "and", inplace: bool = False):
+        """Keep only the entries for which the given score conditions hold.
+
+        All conditions are evaluated into a single mask (with a fixed number of
+        temporary arrays) and all arrays are gathered only once.
+
+        Parameters
+        ----------
+        conditions
+            List of conditions (name, low, high) or (name, low, high, above_operator,
+            below_operator), each defined as for `filter_by_range`. Also accepts a
+            single condition or a dictionary {name: (low, high, ...)}.
+        combine
+            Set to "and" (default) to keep entries for which all conditions hold, or
+            to "or" to keep entries for which at least one condition holds.
+        inplace
+            Set to True to compact row, col and all score layers in-place instead of
+            returning a new StackedSparseArray. Existing buffers are overwritten (so
+            arrays obtained before, e.g. via `.get_layer()`, change as well), only
+            memory-mapped or read-only layers are copied. Default is False.
+
+        Returns
+        -------
+        New StackedSparseArray with the selected entries (None if `inplace=True`).
+        """
+        if combine not in ("and", "or"):
+            raise ValueError("combine must be 'and' or 'or'")
+        mask = np.full(len(self.row), combine == "and")
+        condition = np.empty(len(self.row), dtype=bool)
+        within_range = np.empty(len(self.row), dtype=bool)
+        for name, low, high, above_operator, below_operator in _as_conditions(conditions):
+            if name is None:
+                name = self.guess_score_name()
+            _get_operator(above_operator)(self._layers[name], low, out=condition)
+            _get_operator(below_operator)(self._layers[name], high, out=within_range)
+            np.logical_and(condition, within_range, out=condition)
+            if combine == "and":
+                np.logical_and(mask, condition, out=mask)
+            else:
+                np.logical_or(mask, condition, out=mask)
+        if not inplace:
+            return self._take(np.flatnonzero(mask))
+        self._compact(mask)
+        return None
+
+    def _compact(self, mask):
+        """Keep only entries where mask is True by moving them to the front of each array.
+
+        Every buffer is compacted only once. Arrays which overlap with other arrays, as
+        well as memory-mapped and read-only arrays, are gathered into new arrays instead.
+        """
+        arrays = [self._row, self._col, *self._layers.values()]
+        unique_arrays = list({id(values): values for values in arrays}.values())
+
+        def compact_in_place(values):
+            if isinstance(values, np.memmap) or not values.flags.writeable:
+                return False
+            return not any(other is not values and np.may_share_memory(values, other)
+                           for other in unique_arrays)
+
+        # Copies first, before any buffer is changed
+        compacted = {id(values): values[mask] for values in unique_arrays
+                     if not compact_in_place(values)}
+        for values in unique_arrays:
+            if id(values) not in compacted:
+                compacted[id(values)] = values[:compact_array(values, mask)]
+        row, col, *layers = [compacted[id(values)] for values in arrays]
+        self._set_coo(row, col, dict(zip(self._layers, layers)), canonical=self._canonical)
+
+    @profile
+    def top_k(self, name: str = None, k: int = 1, axis: int = 1,
+              largest: bool = True):
+        """Keep only the k highest (or lowest) scores per row or per column.
+
+        Selection runs as one (parallel) numba pass over all rows (or columns) using
+        partial selection, so it scales linearly with the number of stored entries.
+
+        Parameters
+        ----------
+        name
+            Name of the score which is used for selecting entries. Run `.score_names`
+            to see all scores scored in the sparse array.
+        k
+            Number of entries to keep per row (or column). On ties, entries stored
+            first are kept.
+        axis
+            Select along axis=1 (k entries per row, default) or axis=0 (k entries
+            per column).
+        largest
+            Set to False to keep the k lowest scores instead. Default is True.
+
+        Returns
+        -------
+        New StackedSparseArray containing all scores for the selected entries.
+        """
         if name is None:
             name = self.guess_score_name()
-        idx = np.where(above_operator(self.data[name], low)
-                       & below_operator(self.data[name], high))
-        cloned_array = StackedSparseArray(self.__n_row, self.__n_col)
-        cloned_array.col = self.col[idx]
-        cloned_array.row = self.row[idx]
-        cloned_array.data = self.data[idx]
-        return cloned_array
+        if axis not in (0, 1):
+            raise ValueError("axis must be 0 or 1")
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        order, indptr = self._get_axis_index(axis=1 - axis)
+        if order is None:
+            idx = np.flatnonzero(top_k_segments(self._layers[name], indptr, k, largest))
+        else:
+            keep = np.zeros(len(self.row), dtype=bool)
+            keep[order[top_k_segments(self._layers[name][order], indptr, k, largest)]] = True
+            idx = np.flatnonzero(keep)
+        return self._take(idx)
+
+    @profile
+    def reduce(self, name: str = None, operation: str = "max", axis: int = 1, fill_value=None):
+        """Reduce the scores of one layer per row or per column (without densifying).
 
-    def to_array(self, name=None):
+        Reductions run over the stored entries only (positions without entry are not
+        counted as zeros), as segmented reductions in O(nnz).
+
+        Parameters
+        ----------
+        name
+            Name of the score which is reduced. Run `.score_names` to see all scores
+            scored in the sparse array.
+        operation
+            Choose from "max" (default), "min", "argmax", "argmin", "sum", "mean", "count".
+            "argmax" and "argmin" return the column (or row) of the highest (or lowest)
+            score; on ties the entry stored first.
+        axis
+            Reduce along axis=1 (one result per row, default) or axis=0 (one result
+            per column).
+        fill_value
+            Result for rows (or columns) without any entry. Default is None, which means
+            -1 for "argmax"/"argmin", np.nan for "mean" and 0 otherwise.
+
+        Returns
+        -------
+        Numpy array with one result per row (axis=1) or per column (axis=0).
+        """
+        if name is None:
+            name = self.guess_score_name()
+        if axis not in (0, 1):
+            raise ValueError("axis must be 0 or 1")
+        if operation not in ("max", "min", "argmax", "argmin", "sum", "mean", "count"):
+            raise ValueError(f"Unknown operation {operation} (must be 'max', 'min', 'argmax', "
+                             "'argmin', 'sum', 'mean', 'count')")
+        order, indptr = self._get_axis_index(axis=1 - axis)
+        counts = np.diff(indptr)
+        if operation == "count":
+            return counts
+        values = self._layers[name]
+        if order is not None:
+            values = values[order]
+        if operation in ("argmax", "argmin"):
+            positions = arg_extreme_segments(values, indptr, operation == "argmax")
+            indices = self.col if axis == 1 else self.row
+            if order is not None:
+                indices = indices[order]
+            result = np.full(len(positions), -1 if fill_value is None else fill_value, dtype=np.int64)
+            result[positions >= 0] = indices[positions[positions >= 0]]
+            return result
+
+        ufunc = {"max": np.maximum, "min": np.minimum, "sum": np.add, "mean": np.add}[operation]
+        filled = counts > 0
+        reduced = ufunc.reduceat(values, indptr[:-1][filled]) if len(values) > 0 else values
+        if operation == "mean":
+            reduced = reduced / counts[filled]
+            fill_value = np.nan if fill_value is None else fill_value
+        fill_value = 0 if fill_value is None else fill_value
+        result = np.full(len(counts), fill_value,
+                         dtype=np.result_type(reduced.dtype, np.min_scalar_type(fill_value)))
+        result[filled] = reduced
+        return result
+
+    def _take(self, idx):
+        """Return new StackedSparseArray with only the entries at (sorted) idx."""
+        new_array = StackedSparseArray(self.__n_row, self.__n_col)
+        new_array._set_coo(self.row[idx], self.col[idx],
+                           {name: values[idx] for name, values in self._layers.items()},
+                           canonical=self._canonical)
+        return new_array
+
+    @profile
+    def to_array(self, name=None, out=None, dtype=None, fill_value=0):
         """Return scores as (non-sparse) numpy array.
 
         Parameters
@@ -383,26 +1338,203 @@ class StackedSparseArray:
         name
             Name of the score that should be returned (if multiple scores are stored).
             If set to None (default) a 3D array with all scores will be returned.
+        out
+            Array of shape (n_row, n_col) to write the scores to, e.g. a `np.memmap` to
+            create the dense array out-of-core. Needs the same fields as the returned
+            array if all scores are returned. Default is None (create new array).
+        dtype
+            Data type of the returned scores. Default is None (keep the dtype of the
+            score layers).
+        fill_value
+            Value for all positions without stored entry. Default is 0.
         """
-        if self.data is None:
+        if len(self._layers) == 0:
             return None
+        name = self._dense_name(name)
+        array = self._new_dense_array((self.__n_row, self.__n_col), name, dtype, fill_value, out)
+        self._fill_dense_array(array, name, slice(None))
+        return array
+
+    def iter_row_blocks(self, name=None, block_size: int = 1000, dtype=None, fill_value=0):
+        """Iterate over the scores as dense blocks of rows.
+
+        Only one dense block of `block_size` rows is created at a time, so dense
+        tiles of large arrays can be processed with bounded memory.
+
+        Parameters
+        ----------
+        name
+            Name of the score that should be returned (if multiple scores are stored).
+            If set to None (default) all scores will be returned (as for `.to_array()`).
+        block_size
+            Number of rows per block. Default is 1000.
+        dtype
+            Data type of the returned scores. Default is None (keep the dtype of the
+            score layers).
+        fill_value
+            Value for all positions without stored entry. Default is 0.
+
+        Yields
+        ------
+        (row_start, block) with block being the dense scores of rows row_start to
+        row_start + block_size - 1 (numpy array of shape (<=block_size, n_col)).
+        """
+        # pylint: disable=too-many-arguments
+        if len(self._layers) == 0:
+            return
+        name = self._dense_name(name)
+        order, indptr = self._get_axis_index(axis=0)
+        for row_start in range(0, self.__n_row, block_size):
+            row_end = min(row_start + block_size, self.__n_row)
+            block = self._new_dense_array((row_end - row_start, self.__n_col), name,
+                                          dtype, fill_value)
+            idx = slice(indptr[row_start], indptr[row_end])
+            if order is not None:
+                idx = order[idx]
+            self._fill_dense_array(block, name, idx, row_offset=row_start)
+            yield row_start, block
+
+    def _dense_name(self, name):
         if name is None and self.shape[2] == 1:
-            name = self.score_names[0]
+            return self.score_names[0]
+        return name
+
+    def _new_dense_array(self, shape, name, dtype, fill_value, out=None):
+        """Return dense array for score `name` (or all scores) filled with fill_value."""
+        # pylint: disable=too-many-arguments
         if isinstance(name, str):
-            array = np.zeros((self.__n_row, self.__n_col),
-                             dtype=self.data[name].dtype)
-            array[self.row, self.col] = self.data[name]
-            return array
-        array = np.zeros((self.__n_row, self.__n_col),
-                         dtype=self.data.dtype)
-        if len(self.row) > 0 and len(self.col) > 0:
-            array[self.row, self.col] = self.data.reshape(-1)
-        return array
+            dtype = self._layers[name].dtype if dtype is None else dtype
+        else:
+            dtype = [(x, values.dtype if dtype is None else dtype)
+                     for x, values in self._layers.items()]
+        if out is None:
+            if fill_value == 0:
+                return np.zeros(shape, dtype=dtype)
+            out = np.empty(shape, dtype=dtype)
+        else:
+            assert out.shape == shape, f"out must be of shape {shape}"
+        out[...] = fill_value
+        return out
+
+    def _fill_dense_array(self, array, name, idx, row_offset=0):
+        """Write scores of entries idx into dense array (starting at row_offset)."""
+        row = self.row[idx] - row_offset if row_offset else self.row[idx]
+        if isinstance(name, str):
+            array[row, self.col[idx]] = self._layers[name][idx]
+            return
+        for x, values in self._layers.items():
+            array[x][row, self.col[idx]] = values[idx]
 
     def to_coo(self, name):
-        return coo_matrix((self.data[name], (self.row, self.col)),
+        return coo_matrix((self._layers[name], (self.row, self.col)),
                           shape=(self.__n_row, self.__n_col))
 
+    def to_coo_array(self, name=None):
+        """Return score layer `name` as scipy sparse `coo_array`.
+
+        row and col are shared with the stack (no copy), scores are copied, so changing
+        the scores of the array does not change the stack.
+        """
+        if name is None:
+            name = self.guess_score_name()
+        array = coo_array((self._layers[name].copy(), (self.row, self.col)),
+                          shape=(self.__n_row, self.__n_col), copy=False)
+        array.has_canonical_format = self._canonical
+        return array
+
+    def to_csr(self, name=None):
+        """Return score layer `name` as scipy sparse CSR matrix.
+
+        For canonical stacks (see `.is_canonical`) indptr is computed in O(nnz) and the
+        column indices and scores are used without sorting (column indices without
+        copying, if their dtype is supported by scipy). Scores are always copied, so
+        in-place operations on the matrix do not change the stack.
+        """
+        if name is None:
+            name = self.guess_score_name()
+        order, indptr = self._get_axis_index(axis=0)
+        values, indices = self._layers[name], self.col
+        if order is None:
+            values = values.copy()
+        else:
+            values, indices = values[order], indices[order]
+        return _compressed_matrix(csr_matrix, values, indices, indptr,
+                                  (self.__n_row, self.__n_col), self._canonical)
+
+    def to_csc(self, name=None):
+        """Return score layer `name` as scipy sparse CSC matrix.
+
+        Entries are grouped by column using the cached column index (stable, so rows
+        stay sorted within each column for canonical stacks).
+        """
+        if name is None:
+            name = self.guess_score_name()
+        order, indptr = self._get_axis_index(axis=1)
+        return _compressed_matrix(csc_matrix, self._layers[name][order], self.row[order], indptr,
+                                  (self.__n_row, self.__n_col), self._canonical)
+
+    def to_sparse_coo(self):
+        """Return all score layers as 3D pydata/sparse COO array of shape `.shape`.
+
+        Requires the optional `sparse` package. All layers are converted to a common dtype.
+        """
+        try:
+            import sparse  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise ImportError("Export to pydata/sparse requires the 'sparse' package "
+                              "(pip install sparse).") from error
+        n_layers = len(self._layers)
+        coords = np.empty((3, len(self.row) * n_layers), dtype=np.int64)
+        coords[0] = np.repeat(self.row, n_layers)
+        coords[1] = np.repeat(self.col, n_layers)
+        coords[2] = np.tile(np.arange(n_layers), len(self.row))
+        data = np.empty((len(self.row), n_layers),
+                        dtype=np.result_type(*self._layers.values()) if n_layers > 0 else float)
+        for i, values in enumerate(self._layers.values()):
+            data[:, i] = values
+        return sparse.COO(coords, data.ravel(), shape=self.shape,
+                          has_duplicates=not self._canonical,
+                          sorted=self._canonical)
+
+    def to_arrow(self):
+        """Return row, col and all score layers as columns of a pyarrow Table.
+
+        Requires the optional `pyarrow` package. Columns share the memory of row, col
+        and the score layers (no copy). Shape, index dtypes and the canonical flag
+        are stored in the schema metadata, so `StackedSparseArray.from_arrow()`
+        restores the same array.
+        """
+        pa = _import_pyarrow()
+        for name in self._layers:
+            if name in ("row", "col"):
+                raise ValueError(f"Score name '{name}' cannot be exported (reserved column name)")
+        columns = {"row": self.row, "col": self.col, **self._layers}
+        metadata = {"n_row": self.__n_row, "n_col": self.__n_col, "canonical": self._canonical}
+        return pa.table({name: pa.array(np.ascontiguousarray(values))
+                         for name, values in columns.items()},
+                        metadata={_arrow_metadata_key: json.dumps(metadata)})
+
+    def to_parquet(self, path, row_group_size: int = 1_000_000, **kwargs):
+        """Write StackedSparseArray to a parquet file (requires `pyarrow`).
+
+        Columns are row, col and all score layers (see `.to_arrow()`). Canonical stacks
+        are stored sorted by row, so every row group covers a narrow range of rows and
+        row-range filters in `StackedSparseArray.read_parquet()` can skip most row groups.
+
+        Parameters
+        ----------
+        path
+            File to write to.
+        row_group_size
+            Maximum number of entries per row group. Smaller row groups allow for
+            more selective reading with filters. Default is 1,000,000.
+        kwargs
+            Passed on to `pyarrow.parquet.write_table` (e.g. compression="zstd").
+        """
+        _import_pyarrow()
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+        pq.write_table(self.to_arrow(), path, row_group_size=row_group_size, **kwargs)
+
     def to_dict(self):
         """Convert StackedSparseArray to dictionary.
         """
@@ -415,17 +1547,301 @@ class StackedSparseArray:
             "dtype": self.data.dtype.descr
         }
 
+    def save(self, path):
+        """Save StackedSparseArray to a folder in a binary, memory-mappable format.
+
+        row, col and every score layer are stored as separate (contiguous) .npy files,
+        shape, dtypes and score names are stored in a small json header. Use
+        `StackedSparseArray.load(path)` to open the stored array again.
+
+        Parameters
+        ----------
+        path
+            Folder to store the array in (will be created if it does not exist).
+        """
+        os.makedirs(path, exist_ok=True)
+        layers = []
+        for i, (name, values) in enumerate(self._layers.items()):
+            filename = f"layer_{i}.npy"
+            np.save(os.path.join(path, filename), np.ascontiguousarray(values))
+            layers.append({"name": name, "file": filename, "dtype": values.dtype.str})
+        np.save(os.path.join(path, "row.npy"), np.ascontiguousarray(self.row))
+        np.save(os.path.join(path, "col.npy"), np.ascontiguousarray(self.col))
+        header = {
+            "format_version": _file_format_version,
+            "n_row": self.__n_row,
+            "n_col": self.__n_col,
+            "nnz": len(self.row),
+            "canonical": self._canonical,
+            "row": {"file": "row.npy", "dtype": self.row.dtype.str},
+            "col": {"file": "col.npy", "dtype": self.col.dtype.str},
+            "layers": layers,
+        }
+        with open(os.path.join(path, "header.json"), "w", encoding="utf-8") as f:
+            json.dump(header, f, indent=2)
+
+    def save_chunked(self, path, chunk_size: int = 1_000_000, codec: str = "zlib",
+                     level: int = None):
+        """Save StackedSparseArray to a folder in compressed chunks of consecutive rows.
+
+        Use `StackedSparseArray.open_chunked(path)` to open the stored array lazily and
+        to slice, filter or select top-k entries chunk by chunk (see
+        `sparsestack.chunked`).
+
+        Parameters
+        ----------
+        path
+            Folder to store the array in (will be created if it does not exist).
+        chunk_size
+            Maximum number of entries per chunk (chunks are only split between rows).
+            Default is 1,000,000.
+        codec
+            Compression codec, one of "zlib" (default, no dependency), "blosc", "zstd"
+            or "lz4" (require the blosc, zstandard or lz4 package).
+        level
+            Compression level. Default is None, which means the default level of the codec.
+        """
+        # pylint: disable=import-outside-toplevel
+        from .chunked import ChunkedWriter
+        with ChunkedWriter(path, self.__n_row, self.__n_col, chunk_size=chunk_size,
+                           codec=codec, level=level) as writer:
+            writer.write(self)
+
+    @staticmethod
+    def open_chunked(path):
+        """Open array stored with `.save_chunked(path)` (returns a ChunkedStackedSparseArray)."""
+        # pylint: disable=import-outside-toplevel
+        from .chunked import ChunkedStackedSparseArray
+        return ChunkedStackedSparseArray(path)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Load StackedSparseArray which was stored using `.save(path)`.
+
+        Parameters
+        ----------
+        path
+            Folder the array was stored in.
+        mmap_mode
+            Memory-map mode passed on to `np.load` for row, col and all score layers
+            ("r" by default, so data is only read from disk when accessed). Set to None
+            to load all data into memory.
+        """
+        with open(os.path.join(path, "header.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("format_version") != _file_format_version:
+            raise ValueError(f"Unknown file format version {header.get('format_version')}")
+
+        stacked_array = cls(header["n_row"], header["n_col"])
+        row = np.load(os.path.join(path, header["row"]["file"]), mmap_mode=mmap_mode)
+        col = np.load(os.path.join(path, header["col"]["file"]), mmap_mode=mmap_mode)
+        layers = {layer["name"]: np.load(os.path.join(path, layer["file"]), mmap_mode=mmap_mode)
+                  for layer in header["layers"]}
+        # Keep stored index dtypes (avoids loading memory-mapped arrays for conversion)
+        stacked_array.row_dtype, stacked_array.col_dtype = row.dtype, col.dtype
+        stacked_array._set_coo(row, col, layers, canonical=header["canonical"])
+        return stacked_array
+
+    @classmethod
+    def from_arrow(cls, table, n_row: int = None, n_col: int = None):
+        """Create StackedSparseArray from a pyarrow Table (as created by `.to_arrow()`).
+
+        The table needs "row" and "col" columns, all other columns are added as score
+        layers. Columns without missing values and in a single chunk are used without
+        copying (the resulting arrays are read-only).
+
+        Parameters
+        ----------
+        table
+            pyarrow Table.
+        n_row
+            Number of rows. Default is None, which means taken from the table metadata
+            (if created by `.to_arrow()`) or from the largest row index.
+        n_col
+            Number of columns. Default is None, which means taken from the table metadata
+            (if created by `.to_arrow()`) or from the largest column index.
+        """
+        metadata = {}
+        if table.schema.metadata is not None and _arrow_metadata_key in table.schema.metadata:
+            metadata = json.loads(table.schema.metadata[_arrow_metadata_key])
+        columns = {name: _arrow_column_to_numpy(table.column(name)) for name in table.column_names}
+        if "row" not in columns or "col" not in columns:
+            raise ValueError("Table must contain 'row' and 'col' columns")
+        row, col = columns.pop("row"), columns.pop("col")
+        if n_row is None:
+            n_row = metadata.get("n_row", int(row.max()) + 1 if len(row) > 0 else 0)
+        if n_col is None:
+            n_col = metadata.get("n_col", int(col.max()) + 1 if len(col) > 0 else 0)
+        stacked_array = cls(n_row, n_col)
+        row = _as_index_array(row, n_row, stacked_array.row_dtype)
+        col = _as_index_array(col, n_col, stacked_array.col_dtype)
+        # Filtered tables can lose the canonical order, so it is checked again
+        canonical = metadata.get("canonical", True) and is_canonical_coo(row, col)
+        stacked_array._set_coo(row, col, columns, canonical=canonical)
+        return stacked_array
+
+    @classmethod
+    def read_parquet(cls, path, columns=None, filters=None):
+        """Read StackedSparseArray from a parquet file (as written by `.to_parquet()`).
+
+        Requires the optional `pyarrow` package. Filters are pushed down to the parquet
+        reader, which skips all row groups whose statistics (min/max per column) do not
+        match, and then removes all non-matching entries.
+
+        Parameters
+        ----------
+        path
+            File to read from.
+        columns
+            Names of score layers to read. Default is None, which means all layers.
+        filters
+            Filters in pyarrow format, e.g. [("row", ">=", 100), ("row", "<", 200),
+            ("scores_1", ">", 0.5)] (all conditions must hold) or a list of such lists
+            (at least one of the lists must hold). Filters can refer to score layers which
+            are not read.
+
+        Code example:
+
+        .. code-block:: python
+
+            scores.to_parquet("scores.parquet")
+            # Read only rows 100-199 with scores_1 above 0.5
+            subset = StackedSparseArray.read_parquet(
+                "scores.parquet", filters=[("row", ">=", 100), ("row", "<", 200),
+                                           ("scores_1", ">", 0.5)])
+        """
+        _import_pyarrow()
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+        if columns is not None:
+            columns = ["row", "col", *[name for name in columns if name not in ("row", "col")]]
+        table = pq.read_table(path, columns=columns, filters=filters)
+        return cls.from_arrow(table)
+
+
+def _as_layers(data: np.ndarray, name: str):
+    """Return dictionary of (contiguous) score layers of data.
 
-def update_structed_array_names(input_array: np.ndarray, name: str):
-    if input_array.dtype.names is None:  # no structured array
-        return np.array(input_array, dtype=[(name, input_array.dtype)])
+    Fields of structured data are named "{name}_{field}" (or only "{field}" if name
+    is empty or None), unstructured data is named `name`.
+    """
+    if data.dtype.names is None:  # no structured array
+        return {name: data}
     if (name == "") or name is None:
-        dtype_new = np.dtype({'names': [f"{x}" for x in input_array.dtype.names],
-                              'formats': [x[0] for x in input_array.dtype.fields.values()]})
+        return {x: np.ascontiguousarray(data[x]) for x in data.dtype.names}
+    return {f"{name}_{x}": np.ascontiguousarray(data[x]) for x in data.dtype.names}
+
+
+def _sparse_entries(matrix):
+    """Return row, col and values of all stored entries of a sparse or dense matrix."""
+    if isinstance(matrix, tuple):
+        row, col, values = matrix
+        return np.asarray(row), np.asarray(col), np.asarray(values)
+    if hasattr(matrix, "tocoo"):
+        matrix = matrix.tocoo()
+    if hasattr(matrix, "row"):
+        return matrix.row, matrix.col, matrix.data
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(-1, 1)
+    (row, col) = np.where(matrix)
+    return row, col, matrix[row, col]
+
+
+def _matrix_shape(matrix, row, col):
+    """Return (n_row, n_col) of a score matrix (or of its entries if it has no shape)."""
+    if isinstance(matrix, tuple) or not hasattr(matrix, "shape"):
+        return (int(row.max()) + 1 if len(row) > 0 else 0,
+                int(col.max()) + 1 if len(col) > 0 else 0)
+    if len(matrix.shape) == 1:
+        return matrix.shape[0], 1
+    return matrix.shape[0], matrix.shape[1]
+
+
+def _compressed_matrix(matrix_type, values, indices, indptr, shape, canonical):
+    """Create scipy CSR/CSC matrix, using indices and indptr of the same (scipy) dtype."""
+    # pylint: disable=too-many-arguments
+    index_dtype = np.int32
+    if max(shape[0], shape[1], indptr[-1]) > np.iinfo(np.int32).max:
+        index_dtype = np.int64
+    indices = indices.astype(index_dtype, copy=False)
+    matrix = matrix_type((values, indices, indptr.astype(indices.dtype, copy=False)),
+                         shape=shape, copy=False)
+    if canonical:
+        matrix.has_sorted_indices = True
+        matrix.has_canonical_format = True
     else:
-        dtype_new = np.dtype({'names': [f"{name}_{x}" for x in input_array.dtype.names],
-                              'formats': [x[0] for x in input_array.dtype.fields.values()]})
-    return input_array.astype(dtype_new)
+        matrix.sum_duplicates()
+    return matrix
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow  # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise ImportError("Arrow and parquet support requires the 'pyarrow' package "
+                          "(pip install pyarrow).") from error
+    return pyarrow
+
+
+def _arrow_column_to_numpy(column):
+    """Return pyarrow (chunked) array as numpy array, without copying if possible."""
+    if column.null_count > 0:
+        raise ValueError("Columns with missing values are not supported")
+    if column.num_chunks == 1:
+        return column.chunk(0).to_numpy(zero_copy_only=False)
+    return column.to_numpy()
+
+
+def _as_index_array(index, length, dtype):
+    """Return index as array of given dtype (all indices must be within 0 and length - 1)."""
+    index = np.asarray(index)
+    if index.dtype != dtype:
+        assert index.size == 0 or (index.min() >= 0 and index.max() < length), \
+            "index values exceed dimension of sparse stack"
+        index = index.astype(dtype)
+    return index
+
+
+def _within_dimension(index, length):
+    return (index >= 0) & (index < length)
+
+
+def _unshared(values, shared):
+    """Return copy of values if it is one of the arrays with ids in shared."""
+    return values.copy() if id(values) in shared else values
+
+
+def _as_joined_indices(array1, array2):
+    """Return row and col of both arrays with index dtypes which fit the indices of both."""
+    n_row, n_col = _merged_shape(array1.shape, array2.shape, "outer")
+    row_dtype, col_dtype = get_index_dtype(n_row), get_index_dtype(n_col)
+    return (array1.row.astype(row_dtype, copy=False), array1.col.astype(col_dtype, copy=False),
+            array2.row.astype(row_dtype, copy=False), array2.col.astype(col_dtype, copy=False))
+
+
+def _add_suffix(name, suffix, add):
+    if add:
+        return f"{name}{suffix}"
+    return name
+
+
+def _merged_shape(shape1, shape2, how):
+    """Return (n_row, n_col) of the result of merging arrays of shape1 and shape2."""
+    if how == "left":
+        return shape1[:2]
+    if how == "right":
+        return shape2[:2]
+    if how == "inner":
+        return min(shape1[0], shape2[0]), min(shape1[1], shape2[1])
+    return max(shape1[0], shape2[0]), max(shape1[1], shape2[1])
+
+
+def _as_layer_values(values, length):
+    """Return values as contiguous 1D array of given length (scalars are broadcast)."""
+    values = np.asarray(values)
+    if values.ndim == 0:
+        return np.full(length, values)
+    assert values.shape == (length, ), "Derived scores must contain one value per entry."
+    return np.ascontiguousarray(values)
 
 
 def _unpack_index(index):
@@ -442,13 +1858,71 @@ def _unpack_index(index):
             raise IndexError("Invalid number of indices")
     elif isinstance(index, str):
         row, col, name = None, None, index
-    elif isinstance(index, int):
+    elif isinstance(index, (int, np.integer, slice, list, np.ndarray)):
         row, col, name = index, slice(None), slice(None)
     else:
         raise IndexError(_slicing_not_implemented_msg)
     return row, col, name
 
 
+def _is_fancy_index(index):
+    """True for indices which select a sub-stack (arrays, slices other than [:])."""
+    if isinstance(index, np.ndarray):
+        return True
+    return isinstance(index, slice) and not index.start == index.stop == index.step is None
+
+
+def _as_selection(index, length):
+    """Convert index to array of selected positions (or None for all positions)."""
+    if isinstance(index, slice):
+        if index.start == index.stop == index.step is None:
+            return None
+        return np.arange(*index.indices(length))
+    if isinstance(index, int):
+        return np.array([index])
+    if index.ndim != 1:
+        raise IndexError("Index arrays for slicing must be 1-dimensional")
+    return index.astype(np.int64)
+
+
+def _segment_positions(starts, lengths):
+    """Return concatenated positions range(start, start + length) for all segments."""
+    total = lengths.sum()
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+
+def _is_range_set(low, high):
+    """True if a (finite) lower or upper threshold is given."""
+    return not (low == -np.inf and high == np.inf)
+
+
+def _check_not_structured(data):
+    if data.dtype.names is not None:
+        raise ValueError("Filtering by range is only possible for non-structured data.")
+
+
+def _range_mask(values, low, high, above_operator='>', below_operator='<'):
+    """Return mask of all values within the given range."""
+    above_operator = _get_operator(above_operator)
+    below_operator = _get_operator(below_operator)
+    return above_operator(values, low) & below_operator(values, high)
+
+
+def _as_conditions(conditions):
+    """Return filter conditions as list of (name, low, high, above_operator, below_operator)."""
+    if isinstance(conditions, dict):
+        conditions = [(name, *condition) for name, condition in conditions.items()]
+    elif isinstance(conditions, tuple):
+        conditions = [conditions]
+    result = []
+    for name, low, high, *operators in conditions:
+        above_operator = operators[0] if len(operators) > 0 else '>'
+        below_operator = operators[1] if len(operators) > 1 else '<'
+        result.append((name, low, high, above_operator, below_operator))
+    return result
+
+
 def _get_operator(relation: str):
     relation = relation.strip()
     ops = {'>': np.greater,
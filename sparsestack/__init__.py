@@ -1,10 +1,14 @@
 from .__version__ import __version__
+from .chunked import ChunkedStackedSparseArray
 from .StackedSparseArray import StackedSparseArray
+from .utils import warmup
 
 
 __author__ = "Florian Huber"
 __email__ = 'florian.hubern@hs-duesseldorf.de'
 __all__ = [
     "__version__",
+    "ChunkedStackedSparseArray",
     "StackedSparseArray",
+    "warmup",
 ]
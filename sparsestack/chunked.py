@@ -0,0 +1,415 @@
+"""Compressed, chunked on-disk storage for StackedSparseArrays larger than memory.
+
+Entries are stored in chunks covering consecutive (non-overlapping) ranges of rows.
+row, col and every score layer of a chunk are compressed separately, so only the
+chunks and layers needed for an operation are read and decompressed. Row slices,
+filters and top-k selections are evaluated chunk by chunk. Chunks whose rows or
+score ranges (min/max per layer, stored in the header) cannot match are skipped.
+
+Code example:
+
+.. code-block:: python
+
+    from sparsestack.chunked import ChunkedStackedSparseArray, ChunkedWriter
+
+    scores.save_chunked("scores_chunked", codec="zstd")
+    stored = ChunkedStackedSparseArray("scores_chunked")
+    rows = stored[1000:2000, :]  # reads only chunks with rows 1000-1999
+    best = stored.filter(("scores_1", 0.9, np.inf))
+
+    # Stacks which do not fit into memory can be written block by block
+    with ChunkedWriter("large_stack", n_row, n_col) as writer:
+        for block in blocks:  # StackedSparseArrays with increasing rows
+            writer.write(block)
+"""
+import json
+import os
+import zlib
+import numpy as np
+from .StackedSparseArray import (StackedSparseArray, _as_conditions,
+                                 _get_operator, _unpack_index)
+
+
+_file_format_version = 1
+
+
+def _get_codec(codec: str, level: int = None):
+    """Return compress(array) and decompress(bytes) functions of the given codec.
+
+    "zlib" (default) only needs the python standard library, "blosc", "zstd" and
+    "lz4" require the blosc, zstandard or lz4 package.
+    """
+    # pylint: disable=import-outside-toplevel
+    try:
+        if codec == "zlib":
+            return (lambda array: zlib.compress(array, -1 if level is None else level),
+                    zlib.decompress)
+        if codec == "blosc":
+            import blosc
+            return (lambda array: blosc.compress(memoryview(array).cast("B"),
+                                                 typesize=array.itemsize,
+                                                 clevel=5 if level is None else level),
+                    blosc.decompress)
+        if codec == "zstd":
+            import zstandard
+            return (zstandard.ZstdCompressor(level=3 if level is None else level).compress,
+                    zstandard.ZstdDecompressor().decompress)
+        if codec == "lz4":
+            import lz4.frame
+            return (lambda array: lz4.frame.compress(
+                array, compression_level=0 if level is None else level), lz4.frame.decompress)
+    except ImportError as error:
+        package = {"blosc": "blosc", "zstd": "zstandard", "lz4": "lz4"}[codec]
+        raise ImportError(f"Codec '{codec}' requires the '{package}' package "
+                          f"(pip install {package}).") from error
+    raise ValueError(f"Unknown codec {codec} (must be 'zlib', 'blosc', 'zstd' or 'lz4')")
+
+
+def _statistics(values):
+    """Return [min, max] of values (None if not available)."""
+    if len(values) == 0 or not (np.issubdtype(values.dtype, np.number)
+                                or values.dtype == bool):
+        return None
+    low, high = np.nanmin(values).item(), np.nanmax(values).item()
+    if np.isnan(low):
+        return None
+    return [low, high]
+
+
+def _may_match(statistics, low, high, above_operator, below_operator):
+    """Return False if no value within statistics (min, max) fulfills the condition."""
+    if statistics is None:
+        return True
+    value_min, value_max = statistics
+
+    def bound(operator):
+        return value_max if operator.strip() in (">", ">=") else value_min
+
+    return bool(_get_operator(above_operator)(bound(above_operator), low)
+                and _get_operator(below_operator)(bound(below_operator), high))
+
+
+class ChunkedWriter:
+    """Write a StackedSparseArray to compressed row-range chunks, block by block.
+
+    Blocks (StackedSparseArrays of the full shape) must be written in order of their
+    rows: all rows of a block must be larger than the rows of the previous blocks.
+    The header is written on `.close()` (or when leaving the `with` block).
+
+    Parameters
+    ----------
+    path
+        Folder to store the chunks in (will be created if it does not exist).
+    n_row
+        Number of rows of the stored array.
+    n_col
+        Number of columns of the stored array.
+    chunk_size
+        Maximum number of entries per chunk. Chunks are only split between rows, so
+        chunks with rows which contain more entries can be larger. Default is 1,000,000.
+    codec
+        Compression codec, one of "zlib" (default, no dependency), "blosc", "zstd" or "lz4".
+    level
+        Compression level. Default is None, which means the default level of the codec.
+    """
+    # pylint: disable=too-many-arguments, too-many-instance-attributes
+    def __init__(self, path, n_row: int, n_col: int, chunk_size: int = 1_000_000,
+                 codec: str = "zlib", level: int = None):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.path = path
+        self.n_row = n_row
+        self.n_col = n_col
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self._compress, _ = _get_codec(codec, level)
+        self._chunks = []
+        self._layers = None
+        self._dtypes = None
+        self._canonical = True
+        os.makedirs(path, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def write(self, stack: StackedSparseArray):
+        """Append all entries of stack (split into chunks of up to chunk_size entries)."""
+        # pylint: disable=protected-access
+        assert stack.shape[:2] == (self.n_row, self.n_col), "Shape of stack does not match"
+        if self._layers is None:
+            if "row" in stack.score_names or "col" in stack.score_names:
+                raise ValueError("Score names 'row' and 'col' are reserved")
+            self._layers = list(stack.score_names)
+            self._dtypes = {"row": stack.row.dtype, "col": stack.col.dtype,
+                            **{name: stack.get_layer(name).dtype for name in self._layers}}
+        elif list(stack.score_names) != self._layers:
+            raise ValueError(f"Score names {stack.score_names} do not match {self._layers}")
+        if len(stack.row) == 0:
+            return
+        row_stop = self._chunks[-1]["row_stop"] if self._chunks else 0
+        if stack.row.min() < row_stop:
+            raise ValueError("Rows must be written in increasing order (chunks cannot overlap)")
+        self._canonical &= stack.is_canonical
+
+        order, indptr = stack._get_axis_index(axis=0)
+        row_start = int(stack.row.min())
+        while indptr[row_start] < indptr[-1]:
+            row_end = np.searchsorted(indptr, indptr[row_start] + self.chunk_size, side="right") - 1
+            row_end = max(row_end, row_start + 1)
+            idx = slice(indptr[row_start], indptr[row_end])
+            if order is not None:
+                idx = order[idx]
+            self._write_chunk(stack.row[idx], stack.col[idx],
+                              {name: stack.get_layer(name)[idx] for name in self._layers})
+            row_start = row_end
+
+    def _write_chunk(self, row, col, layers):
+        i = len(self._chunks)
+        chunk = {"row_start": int(row[0]), "row_stop": int(row[-1]) + 1, "nnz": len(row),
+                 "files": {}, "statistics": {}}
+        columns = {"row": row, "col": col, **layers}
+        for name, values in columns.items():
+            if name in ("row", "col"):
+                filename = f"chunk_{i}_{name}.bin"
+            else:
+                filename = f"chunk_{i}_layer_{self._layers.index(name)}.bin"
+            values = np.ascontiguousarray(values, dtype=self._dtypes[name])
+            with open(os.path.join(self.path, filename), "wb") as f:
+                f.write(self._compress(values))
+            chunk["files"][name] = filename
+            if name not in ("row", "col"):
+                chunk["statistics"][name] = _statistics(values)
+        self._chunks.append(chunk)
+
+    def close(self):
+        """Write the header (required to open the stored array)."""
+        layers = self._layers or []
+        dtypes = self._dtypes or {"row": np.dtype(np.int64), "col": np.dtype(np.int64)}
+        header = {
+            "format_version": _file_format_version,
+            "n_row": self.n_row,
+            "n_col": self.n_col,
+            "nnz": sum(chunk["nnz"] for chunk in self._chunks),
+            "canonical": self._canonical,
+            "codec": self.codec,
+            "row_dtype": dtypes["row"].str,
+            "col_dtype": dtypes["col"].str,
+            "layers": [{"name": name, "dtype": dtypes[name].str} for name in layers],
+            "chunks": self._chunks,
+        }
+        with open(os.path.join(self.path, "header.json"), "w", encoding="utf-8") as f:
+            json.dump(header, f, indent=2)
+
+
+class ChunkedStackedSparseArray:
+    """StackedSparseArray stored in compressed row-range chunks (opened lazily).
+
+    Only the header is read when opening. Data is read and decompressed chunk by
+    chunk when accessed, so memory use depends on the size of the results and of a
+    single chunk, not on the size of the stored array.
+
+    Parameters
+    ----------
+    path
+        Folder the array was stored in (see `StackedSparseArray.save_chunked` or
+        `ChunkedWriter`).
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, "header.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("format_version") != _file_format_version:
+            raise ValueError(f"Unknown file format version {header.get('format_version')}")
+        self.path = path
+        self._header = header
+        self._dtypes = {"row": np.dtype(header["row_dtype"]), "col": np.dtype(header["col_dtype"]),
+                        **{layer["name"]: np.dtype(layer["dtype"]) for layer in header["layers"]}}
+        _, self._decompress = _get_codec(header["codec"])
+
+    def __repr__(self):
+        return f"<{self.shape[0]}x{self.shape[1]}x{self.shape[2]} chunked stacked sparse array" \
+            f" containing scores for {self.score_names}" \
+            f" with {self.nnz} stored elements in {self.n_chunks} chunks>"
+
+    @property
+    def shape(self):
+        return self._header["n_row"], self._header["n_col"], len(self._header["layers"])
+
+    @property
+    def score_names(self):
+        return tuple(layer["name"] for layer in self._header["layers"])
+
+    @property
+    def nnz(self):
+        return self._header["nnz"]
+
+    @property
+    def n_chunks(self):
+        return len(self._header["chunks"])
+
+    def guess_score_name(self):
+        if len(self.score_names) == 1:
+            return self.score_names[0]
+        if len(self.score_names) == 0:
+            raise KeyError("Array is empty.")
+        raise KeyError("Name of score is required.")
+
+    def _read(self, chunk, name):
+        with open(os.path.join(self.path, chunk["files"][name]), "rb") as f:
+            return np.frombuffer(self._decompress(f.read()), dtype=self._dtypes[name])
+
+    def read_chunk(self, i: int, names=None):
+        """Return chunk i as StackedSparseArray (of the full shape).
+
+        Parameters
+        ----------
+        i
+            Number of the chunk.
+        names
+            Score layers to read. Default is None, which means all layers.
+        """
+        # pylint: disable=protected-access
+        chunk = self._header["chunks"][i]
+        names = self.score_names if names is None else names
+        stack = StackedSparseArray(*self.shape[:2])
+        stack._set_coo(self._read(chunk, "row"), self._read(chunk, "col"),
+                       {name: self._read(chunk, name) for name in names},
+                       canonical=self._header["canonical"])
+        return stack
+
+    def iter_chunks(self, names=None):
+        """Iterate over all chunks as StackedSparseArrays (see `.read_chunk()`)."""
+        for i in range(self.n_chunks):
+            yield self.read_chunk(i, names)
+
+    def load(self, names=None):
+        """Read all chunks (or only the given score layers) into one StackedSparseArray."""
+        names = self.score_names if names is None else names
+        return self._concatenate(list(self.iter_chunks(names)), names)
+
+    def _concatenate(self, stacks, names):
+        """Join stacks of consecutive, non-overlapping row ranges into one stack."""
+        # pylint: disable=protected-access
+        result = StackedSparseArray(*self.shape[:2])
+        if len(stacks) == 0:
+            result._set_coo(np.array([], dtype=result.row_dtype), np.array([], dtype=result.col_dtype),
+                            {name: np.array([], dtype=self._dtypes[name]) for name in names},
+                            canonical=True)
+        elif len(stacks) == 1:
+            stack = stacks[0]
+            layers = {name: stack.get_layer(name) for name in names}
+            result._set_coo(stack.row, stack.col, layers, canonical=stack.is_canonical)
+        else:
+            row = np.concatenate([stack.row for stack in stacks])
+            col = np.concatenate([stack.col for stack in stacks])
+            layers = {name: np.concatenate([stack.get_layer(name) for stack in stacks])
+                      for name in names}
+            result._set_coo(row, col, layers,
+                            canonical=all(stack.is_canonical for stack in stacks))
+        return result
+
+    def _chunks_with_rows(self, rows):
+        """Return numbers of all chunks which contain any of the (sorted) rows."""
+        chunks = []
+        for i, chunk in enumerate(self._header["chunks"]):
+            position = np.searchsorted(rows, chunk["row_start"])
+            if position < len(rows) and rows[position] < chunk["row_stop"]:
+                chunks.append(i)
+        return chunks
+
+    def __getitem__(self, key):
+        """Slice the stored array as a StackedSparseArray, e.g. stored[10:20, :, "score_1"].
+
+        Only chunks containing selected rows (and only the selected score, if given
+        by name) are read. Results are the same as for the (fully loaded) stack.
+        """
+        row, _, name = _unpack_index(key)
+        if row is None or (isinstance(row, slice) and row == slice(None)):
+            chunks = range(self.n_chunks)
+        else:
+            rows = np.unique(np.atleast_1d(np.arange(self.shape[0])[row]))
+            chunks = self._chunks_with_rows(rows)
+        names = [name] if isinstance(name, str) else self.score_names
+        stack = self._concatenate([self.read_chunk(i, names) for i in chunks], names)
+        return stack[key]
+
+    def filter(self, conditions, combine: str = "and", names=None):
+        """Return all entries for which the given score conditions hold.
+
+        Conditions are defined as for `StackedSparseArray.filter`. Chunks in which
+        no entry can fulfill the conditions (according to the min/max of each score
+        layer in the chunk) are not read.
+
+        Parameters
+        ----------
+        conditions
+            List of conditions (name, low, high) or (name, low, high, above_operator,
+            below_operator), see `StackedSparseArray.filter`.
+        combine
+            Set to "and" (default) to keep entries for which all conditions hold, or
+            to "or" to keep entries for which at least one condition holds.
+        names
+            Score layers of the result. Default is None, which means all layers.
+
+        Returns
+        -------
+        StackedSparseArray with the selected entries.
+        """
+        if combine not in ("and", "or"):
+            raise ValueError("combine must be 'and' or 'or'")
+        conditions = [(self.guess_score_name() if name is None else name, *condition)
+                      for name, *condition in _as_conditions(conditions)]
+        names = self.score_names if names is None else names
+        read_names = list(dict.fromkeys([*names, *(condition[0] for condition in conditions)]))
+        selected = []
+        for i, chunk in enumerate(self._header["chunks"]):
+            matches = [_may_match(chunk["statistics"][name], *condition)
+                       for name, *condition in conditions]
+            if (combine == "and" and not all(matches)) or (combine == "or" and not any(matches)):
+                continue
+            selected.append(self.read_chunk(i, read_names).filter(conditions, combine))
+        return self._concatenate(selected, names)
+
+    def top_k(self, name: str = None, k: int = 1, axis: int = 1,
+              largest: bool = True, names=None):
+        """Keep only the k highest (or lowest) scores per row or per column.
+
+        Selection is done chunk by chunk (see `StackedSparseArray.top_k`). For axis=1
+        (per row) chunks are independent, for axis=0 (per column) the k best entries
+        per column are kept while reading all chunks. Results are the same as for the
+        (fully loaded) stack.
+
+        Parameters
+        ----------
+        name
+            Name of the score which is used for selecting entries.
+        k
+            Number of entries to keep per row (or column).
+        axis
+            Select along axis=1 (k entries per row, default) or axis=0 (k entries
+            per column).
+        largest
+            Set to False to keep the k lowest scores instead. Default is True.
+        names
+            Score layers of the result. Default is None, which means all layers.
+        """
+        # pylint: disable=too-many-arguments
+        if name is None:
+            name = self.guess_score_name()
+        if axis not in (0, 1):
+            raise ValueError("axis must be 0 or 1")
+        names = self.score_names if names is None else names
+        read_names = list(dict.fromkeys([*names, name]))
+        if axis == 1:
+            selected = [stack.top_k(name, k, axis, largest) for stack in self.iter_chunks(read_names)]
+            return self._concatenate(selected, names)
+        best = None
+        for stack in self.iter_chunks(read_names):
+            stack = stack.top_k(name, k, axis, largest)
+            if best is not None:
+                stack = self._concatenate([best, stack], read_names).top_k(name, k, axis, largest)
+            best = stack
+        return self._concatenate([] if best is None else [best], names)
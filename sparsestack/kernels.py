@@ -0,0 +1,295 @@
+"""Numba kernels of sparsestack.
+
+This module is only imported when a kernel is used for the first time (see
+`sparsestack.utils`), so importing sparsestack does not import numba. Compiled
+kernels are cached on disk. Use `compile_kernels` (or `sparsestack.warmup()`) to
+compile them for given index dtypes in advance.
+"""
+import itertools
+import numba
+import numpy as np
+
+
+# Index dtypes of row and col (see get_index_dtype) and of user input
+INDEX_DTYPES = ("uint16", "uint32", "int32", "int64")
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def compact_array(values, mask):
+    """Move all values[mask] to the front of values (in-place).
+
+    Returns the number of selected values, i.e. values[:n] contains the result.
+    """
+    n = 0
+    for i, keep in enumerate(mask):
+        if keep:
+            values[n] = values[i]
+            n += 1
+    return n
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def is_canonical_coo(row, col):
+    """Return True if (row, col) are sorted by row and then by col without duplicates.
+    """
+    for i in range(1, len(row)):
+        if row[i] < row[i - 1]:
+            return False
+        if row[i] == row[i - 1] and col[i] <= col[i - 1]:
+            return False
+    return True
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def _merge_join(left_row, left_col, right_row, right_col,
+                keep_left, keep_right):
+    """Single two-pointer merge over two (row, col) sorted sparse arrays.
+
+    left_row, left_col, right_row, right_col
+        Numpy arrays sorted by row and then by col (e.g. using np.lexsort).
+    keep_left, keep_right
+        Set to True to also keep entries which only exist in the left/right array.
+    """
+    #pylint: disable=too-many-arguments
+    #pylint: disable=too-many-locals
+    #pylint: disable=too-many-branches
+    #pylint: disable=too-many-statements
+    n_left = len(left_row)
+    n_right = len(right_row)
+    if keep_left and keep_right:
+        max_length = n_left + n_right
+    elif keep_left:
+        max_length = n_left
+    elif keep_right:
+        max_length = n_right
+    else:
+        max_length = min(n_left, n_right)
+
+    idx_left = np.empty(min(n_left, max_length), dtype=np.int64)
+    idx_left_new = np.empty(min(n_left, max_length), dtype=np.int64)
+    idx_right = np.empty(min(n_right, max_length), dtype=np.int64)
+    idx_right_new = np.empty(min(n_right, max_length), dtype=np.int64)
+    row_new = np.empty(max_length, dtype=left_row.dtype)
+    col_new = np.empty(max_length, dtype=left_col.dtype)
+
+    i = 0
+    j = 0
+    counter = 0
+    count_left = 0
+    count_right = 0
+    while i < n_left and j < n_right:
+        if left_row[i] == right_row[j] and left_col[i] == right_col[j]:
+            idx_left[count_left] = i
+            idx_left_new[count_left] = counter
+            idx_right[count_right] = j
+            idx_right_new[count_right] = counter
+            row_new[counter] = left_row[i]
+            col_new[counter] = left_col[i]
+            count_left += 1
+            count_right += 1
+            counter += 1
+            i += 1
+            j += 1
+        elif left_row[i] < right_row[j] or (left_row[i] == right_row[j]
+                                            and left_col[i] < right_col[j]):
+            if keep_left:
+                idx_left[count_left] = i
+                idx_left_new[count_left] = counter
+                row_new[counter] = left_row[i]
+                col_new[counter] = left_col[i]
+                count_left += 1
+                counter += 1
+            i += 1
+        else:
+            if keep_right:
+                idx_right[count_right] = j
+                idx_right_new[count_right] = counter
+                row_new[counter] = right_row[j]
+                col_new[counter] = right_col[j]
+                count_right += 1
+                counter += 1
+            j += 1
+
+    # Remaining entries (only one of the two arrays can have some left)
+    if keep_left:
+        while i < n_left:
+            idx_left[count_left] = i
+            idx_left_new[count_left] = counter
+            row_new[counter] = left_row[i]
+            col_new[counter] = left_col[i]
+            count_left += 1
+            counter += 1
+            i += 1
+    if keep_right:
+        while j < n_right:
+            idx_right[count_right] = j
+            idx_right_new[count_right] = counter
+            row_new[counter] = right_row[j]
+            col_new[counter] = right_col[j]
+            count_right += 1
+            counter += 1
+            j += 1
+    return (idx_left[:count_left], idx_right[:count_right],
+            idx_left_new[:count_left], idx_right_new[:count_right],
+            row_new[:counter], col_new[:counter])
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def get_idx_match(left_row, left_col, right_row, right_col):
+    """Get positions of all matching entries (inner merge) without joined row and col.
+
+    left_row, left_col, right_row, right_col
+        Numpy arrays sorted by row and then by col (e.g. using np.lexsort).
+    """
+    n_left = len(left_row)
+    n_right = len(right_row)
+    idx_left = np.empty(min(n_left, n_right), dtype=np.int64)
+    idx_right = np.empty(min(n_left, n_right), dtype=np.int64)
+    i = 0
+    j = 0
+    counter = 0
+    while i < n_left and j < n_right:
+        if left_row[i] == right_row[j] and left_col[i] == right_col[j]:
+            idx_left[counter] = i
+            idx_right[counter] = j
+            counter += 1
+            i += 1
+            j += 1
+        elif left_row[i] < right_row[j] or (left_row[i] == right_row[j]
+                                            and left_col[i] < right_col[j]):
+            i += 1
+        else:
+            j += 1
+    return idx_left[:counter], idx_right[:counter]
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def get_idx_inner(left_row, left_col, right_row, right_col):
+    """Get current and new indices for inner merge.
+
+    left_row, left_col, right_row, right_col
+        Numpy arrays sorted by row and then by col (e.g. using np.lexsort).
+    """
+    return _merge_join(left_row, left_col, right_row, right_col, False, False)
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def get_idx_left(left_row, left_col, right_row, right_col):
+    """Get current and new indices for left merge.
+
+    left_row, left_col, right_row, right_col
+        Numpy arrays sorted by row and then by col (e.g. using np.lexsort).
+    """
+    return _merge_join(left_row, left_col, right_row, right_col, True, False)
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def get_idx_right(left_row, left_col, right_row, right_col):
+    """Get current and new indices for right merge.
+
+    left_row, left_col, right_row, right_col
+        Numpy arrays sorted by row and then by col (e.g. using np.lexsort).
+    """
+    return _merge_join(left_row, left_col, right_row, right_col, False, True)
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def get_idx_outer(left_row, left_col, right_row, right_col):
+    """Get current and new indices for outer merge.
+
+    left_row, left_col, right_row, right_col
+        Numpy arrays sorted by row and then by col (e.g. using np.lexsort).
+    """
+    return _merge_join(left_row, left_col, right_row, right_col, True, True)
+
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def top_k_segments(values, indptr, k, largest=True):
+    """Return mask of values which are among the k largest (or smallest) per segment.
+
+    values
+        Numpy array with values grouped into contiguous segments.
+    indptr
+        Segment i is given by values[indptr[i]:indptr[i + 1]].
+    k
+        Number of values to select per segment. On ties, the first occurrences are kept.
+    largest
+        Set to False to select the k smallest values instead.
+    """
+    keep = np.zeros(len(values), dtype=np.bool_)
+    for i in numba.prange(len(indptr) - 1):  # pylint: disable=not-an-iterable
+        start = indptr[i]
+        end = indptr[i + 1]
+        if end - start <= k:
+            keep[start:end] = True
+            continue
+        # Partial selection of the k-th best value
+        segment = values[start:end]
+        if largest:
+            threshold = np.partition(segment, end - start - k)[end - start - k]
+        else:
+            threshold = np.partition(segment, k - 1)[k - 1]
+        counter = 0
+        for j in range(start, end):
+            if (largest and values[j] > threshold) or (not largest and values[j] < threshold):
+                keep[j] = True
+                counter += 1
+        for j in range(start, end):
+            if counter == k:
+                break
+            if values[j] == threshold:
+                keep[j] = True
+                counter += 1
+    return keep
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def arg_extreme_segments(values, indptr, largest=True):
+    """Return position of the largest (or smallest) value per segment.
+
+    values
+        Numpy array with values grouped into contiguous segments.
+    indptr
+        Segment i is given by values[indptr[i]:indptr[i + 1]].
+    largest
+        Set to False to return the position of the smallest value instead.
+        On ties, the first occurrence is returned, for empty segments -1.
+    """
+    positions = np.full(len(indptr) - 1, -1, dtype=np.int64)
+    for i in range(len(indptr) - 1):
+        best = indptr[i]
+        for j in range(indptr[i] + 1, indptr[i + 1]):
+            if (largest and values[j] > values[best]) or (not largest and values[j] < values[best]):
+                best = j
+        if indptr[i + 1] > indptr[i]:
+            positions[i] = best
+    return positions
+
+
+def compile_kernels(index_dtypes=INDEX_DTYPES, value_dtypes=("float64", )):
+    """Compile (or load from cache) kernels with explicit signatures.
+
+    Parameters
+    ----------
+    index_dtypes
+        Dtypes of row and col arrays. Kernels are compiled for all combinations of
+        row and col dtypes.
+    value_dtypes
+        Dtypes of score layers for kernels that work on scores (top_k_segments,
+        arg_extreme_segments, compact_array). compact_array (used by in-place filters)
+        is compiled for the index dtypes as well.
+    """
+    for row_dtype, col_dtype in itertools.product(index_dtypes, repeat=2):
+        row_type = numba.from_dtype(np.dtype(row_dtype))[::1]
+        col_type = numba.from_dtype(np.dtype(col_dtype))[::1]
+        is_canonical_coo.compile((row_type, col_type))
+        for kernel in (get_idx_match, get_idx_inner, get_idx_left, get_idx_right, get_idx_outer):
+            kernel.compile((row_type, col_type, row_type, col_type))
+    for index_dtype in index_dtypes:
+        compact_array.compile((numba.from_dtype(np.dtype(index_dtype))[::1], numba.boolean[::1]))
+    indptr_type = numba.int64[::1]
+    for value_dtype in value_dtypes:
+        value_type = numba.from_dtype(np.dtype(value_dtype))[::1]
+        top_k_segments.compile((value_type, indptr_type, numba.int64, numba.boolean))
+        arg_extreme_segments.compile((value_type, indptr_type, numba.boolean))
+        compact_array.compile((value_type, numba.boolean[::1]))
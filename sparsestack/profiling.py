@@ -0,0 +1,162 @@
+"""Opt-in instrumentation of the main sparsestack operations.
+
+Functions decorated with `profile` report wall time, peak memory allocation and
+input/output sizes of every call to all registered callbacks. Without registered
+callbacks, the only overhead is a single check per call.
+
+Code example:
+
+.. code-block:: python
+
+    from sparsestack.profiling import Profiler
+
+    with Profiler() as profiler:
+        scores.add_sparse_data(row, col, data, "scores_2", join_type="outer")
+        scores.filter_by_range("scores_2", low=0.5)
+    print(profiler.summary())
+"""
+import functools
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+
+_callbacks = []
+_local = threading.local()
+
+
+def add_callback(callback):
+    """Register callback which is called with a record (dict) for every profiled call.
+
+    Records contain "name", "wall_time" (seconds), "peak_memory" (bytes allocated at
+    peak during the call, None if tracemalloc is not tracing), "input_size" and
+    "output_size" (number of entries of the array inputs and outputs).
+
+    The peak of tracemalloc is process-wide and can only be reset on Python >= 3.9.
+    Peak memory is therefore only measured for calls made in the main thread (it
+    includes allocations by worker threads, e.g. with n_jobs > 1, during the call)
+    and is None for calls in other threads or on older Python versions.
+    """
+    _callbacks.append(callback)
+
+
+def remove_callback(callback):
+    """Unregister callback (see `add_callback`)."""
+    _callbacks.remove(callback)
+
+
+def profile(func):
+    """Decorator to report wall time, peak allocation and sizes of calls to func."""
+    name = func.__qualname__ if hasattr(func, "__qualname__") else func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _callbacks:
+            return func(*args, **kwargs)
+        return _profiled_call(name, func, args, kwargs)
+
+    return wrapper
+
+
+def _profiled_call(name, func, args, kwargs):
+    tracing = _can_trace_peak() and tracemalloc.is_tracing()
+    peaks = _peak_stack()
+    if tracing:
+        start_memory = tracemalloc.get_traced_memory()[0]
+        if peaks:
+            # Keep peak of the calling (profiled) function before resetting
+            peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        peaks.append(start_memory)
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        wall_time = time.perf_counter() - start
+        peak_memory = None
+        if tracing:
+            peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+            peak_memory = peak - start_memory
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+    record = {"name": name,
+              "wall_time": wall_time,
+              "peak_memory": peak_memory,
+              "input_size": _size(args) + _size(tuple(kwargs.values())),
+              "output_size": _size(result)}
+    for callback in list(_callbacks):
+        callback(record)
+    return result
+
+
+def _peak_stack():
+    if not hasattr(_local, "peaks"):
+        _local.peaks = []
+    return _local.peaks
+
+
+def _can_trace_peak():
+    # tracemalloc.reset_peak is only available for Python >= 3.9 and resets the
+    # peak of all threads, which would corrupt peaks measured in the main thread
+    return hasattr(tracemalloc, "reset_peak") and threading.current_thread() is threading.main_thread()
+
+
+def _size(obj):
+    """Return number of entries of arrays (or StackedSparseArrays) in obj."""
+    if isinstance(obj, np.ndarray):
+        return obj.size
+    if isinstance(obj, (tuple, list)):
+        return sum(_size(x) for x in obj)
+    if isinstance(obj, dict):
+        return sum(_size(x) for x in obj.values())
+    if hasattr(obj, "row") and isinstance(obj.row, np.ndarray):
+        return len(obj.row)
+    return 0
+
+
+class Profiler:
+    """Context manager which collects records of all profiled calls.
+
+    Parameters
+    ----------
+    trace_memory
+        Set to True (default) to measure peak memory allocations using tracemalloc
+        (started if not yet tracing). This slows down allocations. Allocations made
+        by compiled numba code are not traced. Peak memory is only reported for calls
+        in the main thread on Python >= 3.9 (see `add_callback`).
+    """
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.records = []
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        add_callback(self.records.append)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        remove_callback(self.records.append)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def summary(self):
+        """Return dictionary with calls, total and maximum wall time, maximum peak
+        memory and total input/output sizes per profiled function."""
+        summary = {}
+        for record in self.records:
+            entry = summary.setdefault(record["name"], {"calls": 0, "total_time": 0.0,
+                                                        "max_time": 0.0, "max_peak_memory": None,
+                                                        "input_size": 0, "output_size": 0})
+            entry["calls"] += 1
+            entry["total_time"] += record["wall_time"]
+            entry["max_time"] = max(entry["max_time"], record["wall_time"])
+            if record["peak_memory"] is not None:
+                entry["max_peak_memory"] = max(entry["max_peak_memory"] or 0, record["peak_memory"])
+            entry["input_size"] += record["input_size"]
+            entry["output_size"] += record["output_size"]
+        return summary
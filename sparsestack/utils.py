@@ -1,75 +1,257 @@
-import numba
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from .profiling import profile
 
 
+# Minimum number of entries per thread for parallel joins and sorts
+_min_entries_per_job = 100_000
+
+
+@profile
 def join_arrays(row1, col1, data1,
                 row2, col2, data2, name,
-                join_type="left"):
+                join_type="left",
+                left_sorted=False,
+                n_jobs=1):
     """Joins two (structured) sparse arrays.
+
+    Both arrays are sorted by (row, col) and then joined in a single merge pass,
+    so that the returned row, col and data are sorted by row (and col).
+
+    Parameters
+    ----------
+    left_sorted
+        Set to True if row1 and col1 are already sorted by row and then by col
+        (e.g. when `is_canonical_coo(row1, col1)` holds). Sorting of the left
+        array is then skipped.
+    n_jobs
+        Number of threads used to sort and join the arrays (split into row ranges).
+        Set to -1 to use all cpu cores. Default is 1.
+    """
+    #pylint: disable=too-many-arguments
+    row_new, col_new, idx_left, idx_left_new, idx_right, idx_right_new = join_indices(
+        row1, col1, row2, col2, join_type=join_type, left_sorted=left_sorted, n_jobs=n_jobs)
+    data_join = set_and_fill_new_array(data1, data2, name,
+                                       idx_left, idx_left_new,
+                                       idx_right, idx_right_new,
+                                       len(row_new))
+    return row_new, col_new, data_join
+
+
+@profile
+def join_layers(row1, col1, layers1,
+                row2, col2, layers2,
+                join_type="left",
+                left_sorted=False,
+                n_jobs=1):
+    """Joins two sparse arrays with scores stored as dictionaries of 1D arrays (layers).
+
+    Works like `join_arrays`, but every score layer is a separate contiguous array.
+    For a "left" join onto sorted row1 and col1, row1, col1 and all layers1 are kept
+    as they are (no copies). Only matching entries are searched and their values
+    scattered into the newly allocated layers.
+
+    Parameters
+    ----------
+    layers1, layers2
+        Dictionaries with score names as keys and 1D numpy arrays as values.
+    left_sorted
+        Set to True if row1 and col1 are already sorted by row and then by col.
+    n_jobs
+        Number of threads used to sort and join the arrays (split into row ranges).
+        Set to -1 to use all cpu cores. Default is 1.
+    """
+    #pylint: disable=too-many-arguments
+    duplicate_names = set(layers1).intersection(layers2)
+    if duplicate_names:
+        raise ValueError(f"Score name(s) {sorted(duplicate_names)} already exist.")
+    if join_type == "left" and left_sorted:
+        # Existing entries (and their order) remain unchanged
+        idx_left, idx_right = match_indices(row1, col1, row2, col2, n_jobs=n_jobs)
+        layers = dict(layers1)
+        for name, values in layers2.items():
+            layers[name] = fill_layer(values, idx_right, idx_left, len(row1), n_jobs=n_jobs)
+        return row1, col1, layers
+
+    row_new, col_new, idx_left, idx_left_new, idx_right, idx_right_new = join_indices(
+        row1, col1, row2, col2, join_type=join_type, left_sorted=left_sorted, n_jobs=n_jobs)
+    layers = {name: fill_layer(values, idx_left, idx_left_new, len(row_new), n_jobs=n_jobs)
+              for name, values in layers1.items()}
+    for name, values in layers2.items():
+        layers[name] = fill_layer(values, idx_right, idx_right_new, len(row_new), n_jobs=n_jobs)
+    return row_new, col_new, layers
+
+
+def match_indices(row1, col1, row2, col2, n_jobs=1):
+    """Get positions of all entries of (sorted) row1, col1 which also exist in row2, col2.
+
+    Returns idx_left, idx_right with idx_right being positions in the (unsorted)
+    arrays row2, col2. Unlike `join_indices`, no joined row and col arrays are created.
+    """
+    n_jobs = get_n_jobs(n_jobs)
+    row1, col1, row2, col2 = _harmonize_dtypes(row1, col1, row2, col2)
+    idx2 = lexsort_if_needed(row2, col2, n_jobs)
+    if idx2 is not None:
+        row2, col2 = row2[idx2], col2[idx2]
+    idx_left, idx_right = _partitioned(get_idx_match, row1, col1, row2, col2, n_jobs)
+    if idx2 is not None:
+        idx_right = idx2[idx_right]
+    return idx_left, idx_right
+
+
+def join_indices(row1, col1, row2, col2,
+                 join_type="left",
+                 left_sorted=False,
+                 n_jobs=1):
+    """Get joined row and col as well as the positions of all joined entries.
+
+    Both arrays are sorted by (row, col) and then joined in a single merge pass,
+    so that the returned row and col are sorted by row (and col).
+
+    Returns row_new, col_new, idx_left, idx_left_new, idx_right, idx_right_new.
+    idx_left/idx_right are positions in the (unsorted) input arrays, idx_left_new/
+    idx_right_new the respective positions in the joined array.
     """
     #pylint: disable=too-many-arguments
+    n_jobs = get_n_jobs(n_jobs)
+    row1, col1, row2, col2 = _harmonize_dtypes(row1, col1, row2, col2)
+
+    # Sort inputs (if needed) and join them in a single merge pass (per row range)
+    idx1 = None if left_sorted else lexsort_if_needed(row1, col1, n_jobs)
+    idx2 = lexsort_if_needed(row2, col2, n_jobs)
+    if idx1 is not None:
+        row1, col1 = row1[idx1], col1[idx1]
+    if idx2 is not None:
+        row2, col2 = row2[idx2], col2[idx2]
+    get_idx_join_type = {"left": get_idx_left, "right": get_idx_right,
+                         "inner": get_idx_inner, "outer": get_idx_outer}.get(join_type)
+    if get_idx_join_type is None:
+        raise ValueError("Unknown join_type (must be 'left', 'right', 'inner', 'outer')")
+    idx_left, idx_right, idx_left_new, idx_right_new, row_new, col_new = _partitioned(
+        get_idx_join_type, row1, col1, row2, col2, n_jobs)
+    if idx1 is not None:
+        idx_left = idx1[idx_left]
+    if idx2 is not None:
+        idx_right = idx2[idx_right]
+    return row_new, col_new, idx_left, idx_left_new, idx_right, idx_right_new
 
-    # Harmonize row and col dtype
+
+def _harmonize_dtypes(row1, col1, row2, col2):
+    """Return row1, col1, row2 and col2 with common dtypes for rows and for cols.
+
+    Indices are never cast to a narrower dtype (which would wrap around large indices).
+    """
     if row1.dtype != row2.dtype:
-        row2 = row2.astype(row1.dtype)
+        row_dtype = np.promote_types(row1.dtype, row2.dtype)
+        row1, row2 = row1.astype(row_dtype, copy=False), row2.astype(row_dtype, copy=False)
     if col1.dtype != col2.dtype:
-        col2 = col2.astype(col1.dtype)
+        col_dtype = np.promote_types(col1.dtype, col2.dtype)
+        col1, col2 = col1.astype(col_dtype, copy=False), col2.astype(col_dtype, copy=False)
+    return row1, col1, row2, col2
 
-    r, c, d = _join_arrays(row1, col1, data1,
-                           row2, col2, data2, name,
-                           join_type=join_type)
-    # Sort by rows
-    idx = np.lexsort((c, r))
-    return r[idx], c[idx], d[idx]
 
+def lexsort_if_needed(row, col, n_jobs=1):
+    """Return indices to sort by row and then col, or None if already sorted."""
+    if is_canonical_coo(row, col):
+        return None
+    if _number_of_partitions(len(row), n_jobs) == 1:
+        return np.lexsort((col, row))
+    return _parallel_lexsort(row, col, n_jobs)
 
-def _join_arrays(row1, col1, data1,
-                row2, col2, data2, name,
-                join_type="left"):
-    """Join array (numpy array, not structured)
+
+def fill_layer(values, idx, idx_new, length, n_jobs=1):
+    """Create new layer of given length and fill values[idx] in at idx_new."""
+    n_jobs = get_n_jobs(n_jobs)
+    layer = np.zeros(length, dtype=values.dtype)
+    bounds = np.linspace(0, len(idx), _number_of_partitions(len(idx), n_jobs) + 1).astype(np.int64)
+
+    def fill_chunk(i):
+        chunk = slice(bounds[i], bounds[i + 1])
+        layer[idx_new[chunk]] = values[idx[chunk]]
+
+    _run_parallel(fill_chunk, range(len(bounds) - 1), n_jobs)
+    return layer
+
+
+def get_n_jobs(n_jobs):
+    """Return number of threads to use (n_jobs < 0 counts backwards from all cpu cores)."""
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return n_jobs
+
+
+def _number_of_partitions(n_entries, n_jobs):
+    return int(max(1, min(n_jobs, n_entries // _min_entries_per_job)))
+
+
+def _run_parallel(func, arguments, n_jobs):
+    """Run func for all arguments in a thread pool (requires GIL-releasing functions)."""
+    arguments = list(arguments)
+    if n_jobs == 1 or len(arguments) == 1:
+        return [func(x) for x in arguments]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(func, arguments))
+
+
+def _parallel_lexsort(row, col, n_jobs):
+    """Sort by row and then col: split into row ranges which are sorted in parallel."""
+    n_partitions = _number_of_partitions(len(row), n_jobs)
+    sample = np.sort(row[::max(1, len(row) // (100 * n_partitions))])
+    positions = np.linspace(0, len(sample), n_partitions + 1)[1:-1].astype(np.int64)
+    boundaries = np.unique(sample[positions])
+    partition = np.searchsorted(boundaries, row, side="right").astype(np.uint16)
+    order = np.argsort(partition, kind="stable")
+    bounds = np.zeros(len(boundaries) + 2, dtype=np.int64)
+    np.cumsum(np.bincount(partition, minlength=len(boundaries) + 1), out=bounds[1:])
+
+    def sort_partition(i):
+        part = order[bounds[i]:bounds[i + 1]]
+        order[bounds[i]:bounds[i + 1]] = part[np.lexsort((col[part], row[part]))]
+
+    _run_parallel(sort_partition, range(len(bounds) - 1), n_jobs)
+    return order
+
+
+def _partitioned(get_idx_function, row1, col1, row2, col2, n_jobs):
+    """Run get_idx_function on (sorted) arrays split into row ranges in parallel.
+
+    Positions returned by get_idx_function for every row range are shifted to
+    positions in the full arrays, and all results are concatenated.
     """
-    #pylint: disable=too-many-arguments
-    #pylint: disable=too-many-locals
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-locals
+    n_partitions = _number_of_partitions(max(len(row1), len(row2)), n_jobs)
+    if n_partitions == 1:
+        return get_idx_function(row1, col1, row2, col2)
+    row_longer = row1 if len(row1) >= len(row2) else row2
+    positions = np.linspace(0, len(row_longer), n_partitions + 1)[1:-1].astype(np.int64)
+    boundaries = np.unique(row_longer[positions])
+    bounds1 = np.concatenate(([0], np.searchsorted(row1, boundaries), [len(row1)]))
+    bounds2 = np.concatenate(([0], np.searchsorted(row2, boundaries), [len(row2)]))
 
-    idx1 = np.lexsort((col1, row1))
-    idx2 = np.lexsort((col2, row2))
-    # join types
-    if join_type == "left":
-        idx_inner_left, idx_inner_right, _, _, _, _ = get_idx(row1, col1, row2, col2,
-                                                             idx1, idx2, join_type="inner")
-        data_join = set_and_fill_new_array(data1, data2, name,
-                                           np.arange(0, len(row1)), np.arange(0, len(row1)),
-                                           idx_inner_right, idx_inner_left,
-                                           len(row1))
-        return row1, col1, data_join
-    if join_type == "right":
-        idx_inner_left, idx_inner_right, _, _, _, _ = get_idx(row1, col1, row2, col2,
-                                                             idx1, idx2, join_type="inner")
-        data_join = set_and_fill_new_array(data1, data2, name,
-                                           idx_inner_left, idx_inner_right,
-                                           np.arange(0, len(row2)), np.arange(0, len(row2)),
-                                           len(row2))
-        return row2, col2, data_join
-    if join_type == "inner":
-        idx_inner_left, idx_inner_right, _, _, _, _ = get_idx(row1, col1, row2, col2,
-                                                             idx1, idx2, join_type="inner")
-        data_join = set_and_fill_new_array(data1, data2, name,
-                                           idx_inner_left, np.arange(0, len(idx_inner_left)),
-                                           idx_inner_right, np.arange(0, len(idx_inner_left)),
-                                           len(idx_inner_left))
-        return row1[idx_inner_left], col1[idx_inner_left], data_join
-    if join_type == "outer":
-        idx_left, idx_right, idx_left_new, idx_right_new, row_new, col_new = get_idx_outer(
-            row1, col1, row2, col2,
-            idx1, idx2
-            )
-        data_join = set_and_fill_new_array(data1, data2, name,
-                                           idx_left, idx_left_new, idx_right, idx_right_new,
-                                           len(row_new))
-        return np.array(row_new, dtype=row1.dtype), np.array(col_new, dtype=col1.dtype), data_join
-    raise ValueError("Unknown join_type (must be 'left', 'right', 'inner', 'outer')")
+    def run_partition(i):
+        part1 = slice(bounds1[i], bounds1[i + 1])
+        part2 = slice(bounds2[i], bounds2[i + 1])
+        return get_idx_function(row1[part1], col1[part1], row2[part2], col2[part2])
+
+    results = _run_parallel(run_partition, range(len(bounds1) - 1), n_jobs)
+    if len(results[0]) == 2:
+        # Only matching positions (left, right)
+        return (np.concatenate([x[0] + bounds1[i] for i, x in enumerate(results)]),
+                np.concatenate([x[1] + bounds2[i] for i, x in enumerate(results)]))
+    offsets = np.cumsum([0] + [len(x[4]) for x in results])
+    return (np.concatenate([x[0] + bounds1[i] for i, x in enumerate(results)]),
+            np.concatenate([x[1] + bounds2[i] for i, x in enumerate(results)]),
+            np.concatenate([x[2] + offsets[i] for i, x in enumerate(results)]),
+            np.concatenate([x[3] + offsets[i] for i, x in enumerate(results)]),
+            np.concatenate([x[4] for x in results]),
+            np.concatenate([x[5] for x in results]))
 
 
+@profile
 def set_and_fill_new_array(data1, data2, name,
                            idx_left, idx_left_new, idx_right, idx_right_new,
                            length):
@@ -100,106 +282,71 @@ def set_and_fill_new_array(data1, data2, name,
     return data_join
 
 
-@numba.jit(nopython=True)
-def get_idx_inner(left_row, left_col, right_row, right_col,
-                  idx1, idx2):
-    """Get current and new indices for inner merge.
+_kernels = None
 
-    idx1, idx2
-        Numpy array of pre-sorted (np.lexsort) indices for left/right arrays.
-    """
-    #pylint: disable=too-many-arguments
-    #pylint: disable=too-many-locals
-
-    idx_left = []
-    idx_left_new = []
-    idx_right = []
-    idx_right_new = []
-    row_new = []
-    col_new = []
-    low = 0
-    counter = 0
-    for i in idx1:
-        for count, j in enumerate(idx2[low:]):
-            if (left_row[i] == right_row[j]) and (left_col[i] == right_col[j]):
-                idx_left.append(i)
-                idx_left_new.append(counter)
-                idx_right.append(j)
-                idx_right_new.append(counter)
-                row_new.append(left_row[i])
-                col_new.append(left_col[i])
-                counter += 1
-                low = count
-            if left_row[i] > right_row[j]:
-                low = count
-            if left_row[i] < right_row[j]:
-                break
-    return idx_left, idx_right, idx_left_new, idx_right_new, row_new, col_new
-
-
-@numba.jit(nopython=True)
-def get_idx_outer(left_row, left_col, right_row, right_col,
-                  idx1, idx2):
-    """Get current and new indices for outer merge.
-
-    idx1, idx2
-        Numpy array of pre-sorted (np.lexsort) indices for left/right arrays.
+
+def _get_kernels():
+    """Return numba kernels (numba is imported on first use)."""
+    global _kernels  # pylint: disable=global-statement
+    if _kernels is None:
+        from . import kernels  # pylint: disable=import-outside-toplevel
+        _kernels = kernels
+    return _kernels
+
+
+def _lazy_kernel(name):
+    """Return function calling numba kernel `name` of sparsestack.kernels."""
+    def kernel(*args):
+        return getattr(_get_kernels(), name)(*args)
+    kernel.__name__ = kernel.__qualname__ = name
+    kernel.__doc__ = f"Numba kernel, see sparsestack.kernels.{name}."
+    return kernel
+
+
+compact_array = _lazy_kernel("compact_array")
+is_canonical_coo = _lazy_kernel("is_canonical_coo")
+get_idx_match = profile(_lazy_kernel("get_idx_match"))
+get_idx_inner = profile(_lazy_kernel("get_idx_inner"))
+get_idx_left = profile(_lazy_kernel("get_idx_left"))
+get_idx_right = profile(_lazy_kernel("get_idx_right"))
+get_idx_outer = profile(_lazy_kernel("get_idx_outer"))
+top_k_segments = _lazy_kernel("top_k_segments")
+arg_extreme_segments = _lazy_kernel("arg_extreme_segments")
+
+
+def warmup(index_dtypes=("uint16", "uint32"), value_dtypes=("float64", )):
+    """Import numba and compile all kernels for the given dtypes in advance.
+
+    Compiled kernels are cached on disk, so only the first warmup (per installation)
+    compiles them; later processes load them from the cache. This avoids paying for
+    compilation at the first join.
+
+    Parameters
+    ----------
+    index_dtypes
+        Dtypes of row and col. StackedSparseArrays use uint16 for up to 65536
+        rows/columns and uint32 above. Default is ("uint16", "uint32").
+    value_dtypes
+        Dtypes of score layers used for top_k and reductions. Default is ("float64", ).
     """
-    #pylint: disable=too-many-arguments
-    #pylint: disable=too-many-locals
-
-    idx_left = []
-    idx_left_new = []
-    idx_right = []
-    idx_right_new = []
-    row_new = []
-    col_new = []
-
-    right_in_inner = []
-    low = 0
-    counter = 0
-    for i in idx1:
-        current_match = False
-        for count, j in enumerate(idx2[low:]):
-            if (left_row[i] == right_row[j]) and (left_col[i] == right_col[j]):
-                right_in_inner.append(j)
-                current_match = True
-            if left_row[i] > right_row[j]:
-                low = count
-            if left_row[i] < right_row[j]:
-                break
-        if current_match:
-            x = right_in_inner[-1]
-            idx_left.append(i)
-            idx_left_new.append(counter)
-            idx_right.append(x)
-            idx_right_new.append(counter)
-            row_new.append(left_row[i])
-            col_new.append(left_col[i])
-            counter += 1
-        else:
-            idx_left.append(i)
-            idx_left_new.append(counter)
-            row_new.append(left_row[i])
-            col_new.append(left_col[i])
-            counter += 1
-
-    for j in set(idx2).difference(set(right_in_inner)):
-        idx_right.append(j)
-        idx_right_new.append(counter)
-        row_new.append(right_row[j])
-        col_new.append(right_col[j])
-        counter += 1
-    return idx_left, idx_right, idx_left_new, idx_right_new, row_new, col_new
-
-
-def get_idx(left_row, left_col, right_row, right_col, idx1, idx2,
+    _get_kernels().compile_kernels(index_dtypes, value_dtypes)
+
+
+def get_idx(left_row, left_col, right_row, right_col,
             join_type="left"):
+    """Get current and new indices to join two (row, col) sorted sparse arrays.
+
+    Returns idx_left, idx_right, idx_left_new, idx_right_new, row_new, col_new
+    as numpy arrays. idx_left/idx_right are positions in the (sorted) input
+    arrays, idx_left_new/idx_right_new the respective positions in the joined array.
+    """
     #pylint: disable=too-many-arguments
+    if join_type == "left":
+        return get_idx_left(left_row, left_col, right_row, right_col)
+    if join_type == "right":
+        return get_idx_right(left_row, left_col, right_row, right_col)
     if join_type == "inner":
-        return get_idx_inner(left_row, left_col, right_row, right_col,
-                             idx1, idx2)
+        return get_idx_inner(left_row, left_col, right_row, right_col)
     if join_type == "outer":
-        return get_idx_outer(left_row, left_col, right_row, right_col,
-                             idx1, idx2)
-    raise ValueError("Unknown join_type")
+        return get_idx_outer(left_row, left_col, right_row, right_col)
+    raise ValueError("Unknown join_type (must be 'left', 'right', 'inner', 'outer')")
@@ -0,0 +1,125 @@
+import os
+import numpy as np
+import pytest
+from sparsestack import ChunkedStackedSparseArray, StackedSparseArray
+from sparsestack.chunked import ChunkedWriter
+
+
+@pytest.fixture
+def stack():
+    rng = np.random.default_rng(0)
+    dense = rng.random((50, 40))
+    dense[dense < 0.8] = 0
+    matrix = StackedSparseArray(50, 40)
+    matrix.add_dense_matrix(dense, "scoreA")
+    matrix.add_dense_matrix(np.sqrt(dense), "scoreB")
+    return matrix
+
+
+@pytest.fixture
+def stored(tmp_path, stack):
+    path = os.path.join(tmp_path, "chunked")
+    stack.save_chunked(path, chunk_size=50)
+    return StackedSparseArray.open_chunked(path)
+
+
+@pytest.mark.parametrize("codec", ["zlib", "blosc", "zstd", "lz4"])
+def test_save_chunked_and_load(tmp_path, stack, codec):
+    if codec != "zlib":
+        pytest.importorskip({"blosc": "blosc", "zstd": "zstandard", "lz4": "lz4"}[codec])
+    path = os.path.join(tmp_path, "chunked")
+    stack.save_chunked(path, chunk_size=50, codec=codec)
+    stored = ChunkedStackedSparseArray(path)
+    assert stored.shape == stack.shape
+    assert stored.score_names == stack.score_names
+    assert stored.nnz == len(stack.row)
+    assert stored.n_chunks > 1
+    loaded = stored.load()
+    assert loaded == stack
+    assert loaded.is_canonical
+    assert loaded.row.dtype == stack.row.dtype
+    assert stored.load(["scoreB"]).score_names == ("scoreB", )
+
+
+def test_chunks_cover_row_ranges(stored):
+    chunks = list(stored.iter_chunks())
+    for chunk, previous in zip(chunks[1:], chunks[:-1]):
+        assert chunk.row.min() > previous.row.max()
+    assert all(len(chunk.row) <= 50 for chunk in chunks)
+
+
+@pytest.mark.parametrize("key", [
+    (slice(10, 20), slice(None)),
+    (slice(10, 20), slice(None), "scoreB"),
+    (np.array([3, 45, 17]), slice(5, 30)),
+    (7, slice(None), "scoreA"),
+    (slice(None), slice(2, 4)),
+    slice(10, 20),
+    [3, 45, 17],
+])
+def test_chunked_getitem(stack, stored, key):
+    result = stored[key]
+    expected = stack[key]
+    if isinstance(expected, tuple):
+        for x, y in zip(result, expected):
+            assert np.all(x == y)
+    else:
+        assert result == expected
+
+
+def test_chunked_getitem_reads_only_needed_chunks(stored, monkeypatch):
+    read = []
+    read_chunk = stored.read_chunk
+    monkeypatch.setattr(stored, "read_chunk",
+                        lambda i, names=None: read.append(i) or read_chunk(i, names))
+    stored[0:2, :]
+    assert read == [0]
+
+
+@pytest.mark.parametrize("conditions, combine", [
+    [("scoreA", 0.95, np.inf), "and"],
+    [[("scoreA", 0.9, np.inf), ("scoreB", -np.inf, 0.97)], "and"],
+    [{"scoreA": (-np.inf, 0.82), "scoreB": (0.99, np.inf, ">=")}, "or"],
+])
+def test_chunked_filter(stack, stored, conditions, combine):
+    assert stored.filter(conditions, combine) == stack.filter(conditions, combine)
+
+
+def test_chunked_filter_skips_chunks(stored, monkeypatch):
+    read = []
+    read_chunk = stored.read_chunk
+    monkeypatch.setattr(stored, "read_chunk",
+                        lambda i, names=None: read.append(i) or read_chunk(i, names))
+    result = stored.filter(("scoreA", 2.0, np.inf), names=["scoreB"])
+    assert read == []
+    assert result.shape == (50, 40, 1)
+    assert len(result.row) == 0
+
+
+@pytest.mark.parametrize("axis, largest", [[1, True], [0, True], [0, False]])
+def test_chunked_top_k(stack, stored, axis, largest):
+    result = stored.top_k("scoreA", k=2, axis=axis, largest=largest)
+    assert result == stack.top_k("scoreA", k=2, axis=axis, largest=largest)
+
+
+def test_chunked_writer_blocks(tmp_path, stack):
+    path = os.path.join(tmp_path, "chunked")
+    with ChunkedWriter(path, 50, 40, chunk_size=30) as writer:
+        for start in range(0, 50, 20):
+            idx = (stack.row >= start) & (stack.row < start + 20)
+            layers = {name: (stack.row[idx], stack.col[idx], stack.get_layer(name)[idx])
+                      for name in stack.score_names}
+            writer.write(StackedSparseArray.from_layers(layers, n_row=50, n_col=40))
+    assert ChunkedStackedSparseArray(path).load() == stack
+
+
+def test_chunked_writer_overlapping_rows(tmp_path, stack):
+    writer = ChunkedWriter(os.path.join(tmp_path, "chunked"), 50, 40)
+    writer.write(stack)
+    with pytest.raises(ValueError, match="increasing order"):
+        writer.write(stack)
+
+
+def test_chunked_unknown_codec(tmp_path, stack):
+    with pytest.raises(ValueError, match="Unknown codec"):
+        stack.save_chunked(os.path.join(tmp_path, "chunked"), codec="gzip")
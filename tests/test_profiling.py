@@ -0,0 +1,90 @@
+import threading
+import tracemalloc
+import numpy as np
+import pytest
+from sparsestack import StackedSparseArray
+from sparsestack.profiling import (Profiler, add_callback, profile,
+                                   remove_callback)
+
+
+@pytest.fixture
+def sparsestack_example():
+    matrix = StackedSparseArray(5, 6)
+    matrix.add_dense_matrix(np.arange(30).reshape(5, 6), "scoreA")
+    return matrix
+
+
+def test_profiler_records_calls(sparsestack_example):
+    with Profiler() as profiler:
+        sparsestack_example.add_sparse_data(np.array([0, 1]), np.array([1, 2]), np.array([0.5, 0.7]),
+                                            "scoreB", join_type="outer")
+        filtered = sparsestack_example.filter_by_range("scoreA", low=10)
+        filtered.to_array("scoreA")
+        _ = sparsestack_example[1:3, :]
+    names = [record["name"] for record in profiler.records]
+    for name in ["join_layers", "get_idx_outer", "StackedSparseArray.add_sparse_data",
+                 "StackedSparseArray.filter", "StackedSparseArray.filter_by_range",
+                 "StackedSparseArray.to_array", "StackedSparseArray.__getitem__"]:
+        assert name in names
+    record = profiler.records[names.index("StackedSparseArray.filter_by_range")]
+    assert record["wall_time"] > 0
+    assert record["peak_memory"] >= 0
+    assert record["input_size"] == 29
+    assert record["output_size"] == 19
+    summary = profiler.summary()
+    assert summary["StackedSparseArray.to_array"]["calls"] == 1
+    assert summary["StackedSparseArray.to_array"]["output_size"] == 30
+
+
+def test_profile_peak_memory_nested():
+    @profile
+    def allocate(n):
+        return np.ones(n)
+
+    @profile
+    def outer():
+        allocate(1_000_000)
+        return np.ones(10)
+
+    with Profiler() as profiler:
+        outer()
+    inner_record, outer_record = profiler.records
+    assert inner_record["name"].endswith("allocate")
+    assert inner_record["peak_memory"] >= 8_000_000
+    assert outer_record["peak_memory"] >= 8_000_000
+
+
+def test_callbacks_without_memory_tracing(sparsestack_example):
+    records = []
+    add_callback(records.append)
+    try:
+        sparsestack_example.to_array("scoreA")
+    finally:
+        remove_callback(records.append)
+    sparsestack_example.to_array("scoreA")
+    assert len(records) == 1
+    assert records[0]["peak_memory"] is None
+
+
+def test_profile_peak_memory_only_in_main_thread():
+    @profile
+    def allocate(n):
+        return np.ones(n)
+
+    with Profiler() as profiler:
+        thread = threading.Thread(target=allocate, args=(1000,))
+        thread.start()
+        thread.join()
+        allocate(1000)
+    thread_record, main_record = profiler.records
+    assert thread_record["peak_memory"] is None
+    assert main_record["peak_memory"] >= 8000
+
+
+def test_profile_peak_memory_without_reset_peak(monkeypatch, sparsestack_example):
+    monkeypatch.delattr(tracemalloc, "reset_peak", raising=False)
+    with Profiler() as profiler:
+        sparsestack_example.to_array("scoreA")
+    assert len(profiler.records) == 1
+    assert profiler.records[0]["peak_memory"] is None
+    assert profiler.summary()["StackedSparseArray.to_array"]["max_peak_memory"] is None
@@ -1,6 +1,9 @@
+import json
+import os
 import numpy as np
 import pytest
 from scipy.sparse import coo_matrix
+import sparsestack.utils
 from sparsestack.StackedSparseArray import StackedSparseArray
 
 
@@ -154,7 +157,9 @@ def test_sparsestack_equality(dense_array_sparse):
     matrix_2 = _create_array("scores1", "scores2")
     assert matrix == matrix_2
     
-    matrix_2.data[0] = 5
+    data = matrix_2.data.copy()
+    data[0] = 5
+    matrix_2.data = data
     assert matrix != matrix_2
 
     matrix_2 = _create_array("scores1", "scores_2")
@@ -180,6 +185,17 @@ def test_add_sparse_data_to_empty():
     assert np.all(matrix.data["scoreA"] == np.array([3, 2, 1.1]))
 
 
+def test_add_sparse_data_to_empty_copies_data():
+    matrix = StackedSparseArray(5, 6)
+    data_to_add = np.array([1., 2., 3.])
+    matrix.add_sparse_data(np.array([0, 2, 4]), np.array([1, 0, 5]), data_to_add, "scoreA")
+    assert not np.shares_memory(matrix.get_layer("scoreA"), data_to_add)
+    matrix.filter(("scoreA", 1.5, np.inf), inplace=True)
+    assert data_to_add.tolist() == [1., 2., 3.]
+    data_to_add[:] = 0
+    assert matrix.get_layer("scoreA").tolist() == [2., 3.]
+
+
 def test_add_structured_sparse_data_to_empty():
     matrix = StackedSparseArray(5, 6)
     assert matrix.shape == (5, 6, 0)
@@ -279,14 +295,29 @@ def test_sparsestack_slicing_mostly_empty_array():
     assert (r, c, v) == (3, 4, 1.5)
 
 
+@pytest.mark.parametrize("key", [
+    slice(2, 5),
+    slice(None, None, 2),
+    [1, 5, 9],
+    np.array([0, 3]),
+])
+def test_sparsestack_slicing_rows_only(key):
+    arr = np.arange(0, 120).reshape(12, 10)
+    matrix = StackedSparseArray(12, 10)
+    matrix.add_dense_matrix(arr, "test_score")
+
+    assert matrix[key] == matrix[key, :]
+    assert np.all(matrix[key].to_array("test_score") == arr[key])
+    r, c, v = matrix[np.int64(4)]
+    assert np.all(r == 4)
+    assert np.all(v == arr[4, c])
+
+
 @pytest.mark.parametrize("slicing_option", [
-    "matrix[0, 1:3, 'scores1']",
-    "matrix[:2, :, 0]",
-    "matrix[:2, 1, 0]",
-    "matrix[:, 1:, 0]",
-    "matrix[1, 1:, 0]",
-    "matrix[1, 1, :1]",
     "matrix[None]",
+    "matrix[1.5]",
+    "matrix[0, [0.5, 1.5]]",
+    "matrix[0, 1, 2.5]",
 ])
 def test_sparsestack_slicing_exceptions(dense_array_sparse, slicing_option):
     msg = "Wrong slicing, or option not yet implemented"
@@ -383,3 +414,897 @@ def test_change_data_to_dict():
     sparsestack.data = np.array(test_data)
     sparsestack_dict = sparsestack.to_dict()
     assert sparsestack_dict["data"] == expected_data
+
+
+def test_canonical_flag_maintained(dense_array_sparse):
+    matrix = StackedSparseArray(12, 10)
+    assert matrix.is_canonical
+    matrix.add_dense_matrix(dense_array_sparse, "scoreA")
+    assert matrix.is_canonical
+    matrix.add_coo_matrix(coo_matrix(dense_array_sparse[::-1]), "scoreB", join_type="outer")
+    assert matrix.is_canonical
+    assert np.all(np.diff(matrix.row * 10 + matrix.col) > 0)
+    matrix = matrix.filter_by_range("scoreB", low=50)
+    assert matrix.is_canonical
+    assert matrix.clone().is_canonical
+
+    matrix.row = matrix.row[::-1]
+    assert not matrix.is_canonical
+
+
+def test_add_unsorted_sparse_data_to_empty():
+    matrix = StackedSparseArray(5, 6)
+    matrix.add_sparse_data(np.array([4, 0, 2]), np.array([5, 1, 0]),
+                           np.array([1.1, 3, 2]), "scoreA")
+    assert matrix.is_canonical
+    assert np.all(matrix.row == np.array([0, 2, 4]))
+    assert np.all(matrix.col == np.array([1, 0, 5]))
+    assert np.all(matrix.data["scoreA"] == np.array([3, 2, 1.1]))
+
+    # Adding another layer must give the same result as for sorted data
+    matrix.add_sparse_data(np.array([2, 4, 1]), np.array([0, 5, 1]),
+                           np.array([0.2, 0.4, 0.1]), "scoreB", join_type="outer")
+    assert matrix.is_canonical
+    assert np.all(matrix.row == np.array([0, 1, 2, 4]))
+    assert np.all(matrix.data["scoreB"] == np.array([0, 0.1, 0.2, 0.4]))
+
+
+def test_add_sparse_data_with_duplicates_is_not_canonical():
+    matrix = StackedSparseArray(5, 6)
+    matrix.add_sparse_data(np.array([0, 0, 2]), np.array([1, 1, 0]),
+                           np.array([1., 2., 3.]), "scoreA")
+    assert not matrix.is_canonical
+
+
+def test_lookup(sparsestack_example_2layers):
+    matrix = sparsestack_example_2layers
+    rows = np.array([0, 3, 3, 4, 2, -1])
+    cols = np.array([2, 0, 1, 2, 2, 2])
+    assert np.all(matrix.lookup(rows, cols, "scoreA") == np.array([2, 30, 0, 42, 22, 42]))
+    assert np.allclose(matrix.lookup(rows, cols, "scoreB", fill_value=-1),
+                       np.array([0.2, 3.0, -1, 4.2, 2.2, 4.2]))
+    values = matrix.lookup(rows, cols)
+    assert values.dtype.names == ("scoreA", "scoreB")
+    assert np.all(values["scoreA"] == np.array([2, 30, 0, 42, 22, 42]))
+    assert matrix.lookup(3, 4, "scoreA") == np.array([34])
+
+    with pytest.raises(IndexError) as exception:
+        matrix.lookup([0, 5], [0, 1], "scoreA")
+    assert "out of range" in exception.value.args[0]
+
+
+def test_lookup_empty_and_not_canonical():
+    matrix = StackedSparseArray(5, 6)
+    matrix.add_sparse_data(np.array([1]), np.array([1]), np.array([0.5]), "scoreA")
+    assert matrix.lookup([0, 1], [0, 1]).tolist() == [0, 0.5]
+    matrix = matrix.filter_by_range(low=1)
+    assert matrix.lookup([0, 1], [0, 1]).tolist() == [0, 0]
+
+    matrix = StackedSparseArray(5, 6)
+    matrix.add_sparse_data(np.array([0, 0, 2]), np.array([1, 1, 0]),
+                           np.array([1., 2., 3.]), "scoreA")
+    assert not matrix.is_canonical
+    assert np.all(matrix[0, 1] == np.array([1., 2.]))
+    assert np.all(matrix.lookup([2, 0], [0, 1]) == np.array([3., 1.]))
+
+
+def test_key_index_is_reset(sparsestack_example):
+    assert sparsestack_example[0, 2] == 2
+    sparsestack_example.add_sparse_data(np.array([0]), np.array([1]), np.array([7]),
+                                        "scoreB", join_type="outer")
+    assert sparsestack_example[0, 1, "scoreB"] == 7
+    sparsestack_example.col = sparsestack_example.col + 1
+    assert sparsestack_example[0, 2, "scoreB"] == 7
+
+
+def test_row_and_column_slicing_uses_axis_index(dense_array_sparse):
+    matrix = StackedSparseArray(12, 10)
+    matrix.add_dense_matrix(dense_array_sparse, "scoreA")
+    for i in range(12):
+        r, c, v = matrix[i, :]
+        idx = np.where(matrix.row == i)
+        assert np.all(r == matrix.row[idx]) and np.all(c == matrix.col[idx])
+        assert np.all(v == matrix.data["scoreA"][idx])
+    for j in range(10):
+        r, c, v = matrix[:, j, "scoreA"]
+        idx = np.where(matrix.col == j)
+        assert np.all(r == matrix.row[idx]) and np.all(c == matrix.col[idx])
+        assert np.all(v == matrix.data["scoreA"][idx])
+
+    # Row slices of canonical stacks are views
+    r, _, _ = matrix[3, :]
+    assert np.shares_memory(r, matrix.row)
+
+
+def test_row_slicing_not_canonical():
+    matrix = StackedSparseArray(5, 6)
+    matrix.add_sparse_data(np.array([3, 0, 3, 3]), np.array([1, 1, 0, 1]),
+                           np.array([1., 2., 3., 4.]), "scoreA")
+    assert not matrix.is_canonical
+    r, c, v = matrix[3, :]
+    assert np.all(r == 3)
+    assert np.all(c == np.array([0, 1, 1]))
+    assert np.all(v == np.array([3., 1., 4.]))
+    r, c, v = matrix[:, 1]
+    assert np.all(r == np.array([0, 3, 3]))
+    assert np.all(v == np.array([2., 1., 4.]))
+
+    matrix.row = np.array([0, 0, 1, 1])
+    r, c, v = matrix[3, :]
+    assert len(r) == len(c) == len(v) == 0
+
+
+@pytest.mark.parametrize("rows, cols", [
+    [slice(2, 7), slice(None)],
+    [slice(None), slice(1, 8, 3)],
+    [slice(None, None, -2), slice(4, None)],
+    [[1, 5, 9], slice(None)],
+    [[9, 1, 1], [0, 2, 2, 8]],
+    [np.arange(12) % 3 == 0, slice(None)],
+    [3, slice(0, 5)],
+    [[], slice(None)],
+])
+def test_sparsestack_slicing_returns_stack(dense_array_sparse, rows, cols):
+    matrix = StackedSparseArray(12, 10)
+    matrix.add_dense_matrix(dense_array_sparse, "scoreA")
+    matrix.add_dense_matrix(0.5 * dense_array_sparse, "scoreB")
+
+    sliced = matrix[rows, cols]
+    expected = dense_array_sparse[np.ix_(np.arange(12)[rows].reshape(-1),
+                                         np.arange(10)[cols].reshape(-1))]
+    assert isinstance(sliced, StackedSparseArray)
+    assert sliced.shape == expected.shape + (2,)
+    assert sliced.score_names == ("scoreA", "scoreB")
+    assert sliced.is_canonical
+    assert np.all(sliced.to_array("scoreA") == expected)
+    assert np.all(sliced.to_array("scoreB") == 0.5 * expected)
+
+
+@pytest.mark.parametrize("names, expected_names", [
+    ["scoreB", ("scoreB",)],
+    [1, ("scoreB",)],
+    [slice(1, None), ("scoreB", "scoreC")],
+    [slice(None, None, 2), ("scoreA", "scoreC")],
+    [["scoreC", "scoreA"], ("scoreC", "scoreA")],
+    [[2, 0], ("scoreC", "scoreA")],
+    [np.array([True, False, True]), ("scoreA", "scoreC")],
+])
+def test_sparsestack_slicing_scores(dense_array_sparse, names, expected_names):
+    matrix = StackedSparseArray(12, 10)
+    matrix.add_dense_matrix(dense_array_sparse, "scoreA")
+    matrix.add_dense_matrix(2 * dense_array_sparse, "scoreB")
+    matrix.add_dense_matrix(3 * dense_array_sparse, "scoreC")
+
+    sliced = matrix[2:4, :, names]
+    assert sliced.shape == (2, 10, len(expected_names))
+    assert sliced.score_names == expected_names
+    for name in expected_names:
+        assert np.all(sliced.to_array(name) == matrix.to_array(name)[2:4, :])
+
+    r, c, v = matrix[3, :, names]
+    assert np.all(r == 3)
+    if v.dtype.names is not None:
+        v = v[expected_names[0]]
+    assert np.all(v == matrix[3, :, expected_names[0]][2])
+
+
+def test_sparsestack_slicing_numpy_integers(sparsestack_example):
+    assert sparsestack_example[np.int64(3), np.int32(4)] == 34
+    r, _, _ = sparsestack_example[np.int64(3), :]
+    assert np.all(r == 3)
+
+
+@pytest.mark.parametrize("axis, largest", [
+    [1, True], [1, False], [0, True], [0, False],
+])
+def test_top_k(axis, largest):
+    rng = np.random.default_rng(0)
+    scores = rng.random((30, 20))
+    scores[scores < 0.5] = 0
+    matrix = StackedSparseArray(30, 20)
+    matrix.add_dense_matrix(scores, "scoreA")
+    matrix.add_dense_matrix(2 * scores, "scoreB")
+
+    selected = matrix.top_k("scoreA", k=3, axis=axis, largest=largest)
+    assert selected.shape == matrix.shape
+    assert selected.is_canonical
+    assert np.all(selected.data["scoreB"] == 2 * selected.data["scoreA"])
+    dense = selected.to_array("scoreA")
+    for i in range(scores.shape[1 - axis]):
+        values = np.take(scores, i, axis=1 - axis)
+        values = np.sort(values[values > 0])
+        expected = values[-3:] if largest else values[:3]
+        selected_values = np.take(dense, i, axis=1 - axis)
+        assert np.allclose(np.sort(selected_values[selected_values > 0]), expected)
+
+
+def test_top_k_not_canonical_and_ties():
+    matrix = StackedSparseArray(3, 4)
+    matrix.add_sparse_data(np.array([1, 0, 1, 1, 0]), np.array([3, 0, 0, 2, 1]),
+                           np.array([0.5, 0.1, 0.5, 0.5, 0.2]), "scoreA")
+    matrix.row = np.array([1, 0, 1, 1, 0])
+    matrix.col = np.array([3, 0, 0, 2, 1])
+    matrix.data = np.array([0.5, 0.1, 0.5, 0.5, 0.2], dtype=[("scoreA", float)])
+    assert not matrix.is_canonical
+    selected = matrix.top_k(k=2)
+    assert np.all(selected.row == np.array([1, 0, 1, 0]))
+    assert np.all(selected.col == np.array([3, 0, 0, 1]))
+
+    with pytest.raises(ValueError):
+        matrix.top_k(k=0)
+
+
+def test_from_blocks(dense_array_sparse):
+    def blocks():
+        # Blocks in arbitrary order and of mixed type
+        yield 6, 0, dense_array_sparse[6:, :5]
+        yield 0, 0, dense_array_sparse[:6, :5]
+        yield 0, 5, coo_matrix(dense_array_sparse[:6, 5:])
+        yield 6, 5, coo_matrix(dense_array_sparse[6:, 5:]).tocsr()
+
+    matrix = StackedSparseArray.from_blocks(12, 10, blocks(), "scoreA")
+    expected = StackedSparseArray(12, 10)
+    expected.add_dense_matrix(dense_array_sparse, "scoreA")
+    assert matrix.is_canonical
+    assert np.all(matrix.row == expected.row)
+    assert np.all(matrix.col == expected.col)
+    assert np.all(matrix.data == expected.data)
+    assert matrix.row.dtype == matrix.col.dtype == np.uint16
+
+    matrix = StackedSparseArray.from_blocks(12, 10, blocks(), "scoreA", low=50, high=90,
+                                            below_operator="<=")
+    assert np.all(matrix.data == expected.filter_by_range(low=50, high=90,
+                                                          below_operator="<=").data)
+
+
+def test_from_blocks_empty_and_too_large():
+    matrix = StackedSparseArray.from_blocks(4, 4, [(0, 0, np.zeros((4, 4)))], "scoreA")
+    assert matrix.shape == (4, 4, 0)
+
+    with pytest.raises(AssertionError) as exception:
+        StackedSparseArray.from_blocks(4, 4, [(2, 0, np.ones((3, 4)))], "scoreA")
+    assert "block rows exceed dimension" in exception.value.args[0]
+
+
+@pytest.mark.parametrize("join_type", ["left", "inner", "outer"])
+def test_add_dense_matrix_with_range(dense_array_sparse, join_type):
+    matrix = StackedSparseArray(12, 10)
+    matrix.add_dense_matrix(dense_array_sparse, "scoreA", low=20)
+    assert np.all(matrix.data["scoreA"] > 20)
+    assert matrix.is_canonical
+
+    scores = dense_array_sparse.astype(float) / 100
+    scores[0, 1] = 0.99
+    matrix.add_dense_matrix(scores, "scoreB", join_type=join_type,
+                            low=0.3, high=0.7, below_operator="<=")
+    expected = StackedSparseArray(12, 10)
+    expected.add_dense_matrix(dense_array_sparse, "scoreA")
+    expected = expected.filter_by_range(low=20)
+    expected.add_dense_matrix(np.where((scores > 0.3) & (scores <= 0.7), scores, 0),
+                              "scoreB", join_type=join_type)
+    assert matrix == expected
+
+
+def test_add_sparse_data_with_range(sparsestack_example):
+    row = np.array([0, 1, 3, 4])
+    col = np.array([2, 0, 4, 5])
+    sparsestack_example.add_sparse_data(row, col, np.array([0.1, 0.9, 0.6, 0.8]),
+                                        "scoreB", join_type="outer", low=0.5, high=0.85)
+    assert sparsestack_example.shape == (5, 6, 2)
+    assert sparsestack_example.lookup(row, col, "scoreB").tolist() == [0, 0, 0.6, 0.8]
+    assert len(sparsestack_example.row) == 8
+
+    sparsestack_example.add_coo_matrix(coo_matrix((np.array([1.0, 2.0]), (row[:2], col[:2])),
+                                                  shape=(5, 6)),
+                                       "scoreC", join_type="outer", low=5)
+    assert len(sparsestack_example.row) == 8
+    assert np.all(sparsestack_example.data["scoreC"] == 0)
+
+
+def test_add_structured_data_with_range_raises(sparsestack_example):
+    data = np.array([(0.1, 3)], dtype=[('score', '<f8'), ('matches', '<i4')])
+    with pytest.raises(ValueError) as exception:
+        sparsestack_example.add_sparse_data([0], [2], data, "scoreB", low=0.5)
+    assert "only possible for non-structured data" in exception.value.args[0]
+
+
+@pytest.mark.parametrize("mmap_mode", ["r", None])
+def test_save_and_load(tmp_path, sparsestack_example_2layers, mmap_mode):
+    path = os.path.join(tmp_path, "stack")
+    sparsestack_example_2layers.save(path)
+    assert os.path.isfile(os.path.join(path, "header.json"))
+
+    loaded = StackedSparseArray.load(path, mmap_mode=mmap_mode)
+    assert loaded == sparsestack_example_2layers
+    assert loaded.is_canonical
+    assert loaded.score_names == ("scoreA", "scoreB")
+    assert loaded[3, 4, "scoreB"] == pytest.approx(3.4)
+    assert isinstance(loaded.row, np.memmap) == (mmap_mode == "r")
+
+
+def test_save_and_load_empty(tmp_path):
+    path = os.path.join(tmp_path, "stack")
+    StackedSparseArray(3, 4).save(path)
+    loaded = StackedSparseArray.load(path)
+    assert loaded.shape == (3, 4, 0)
+    assert len(loaded.row) == 0
+
+
+def test_columnar_layers(sparsestack_example):
+    layer_a = sparsestack_example.get_layer("scoreA")
+    row = sparsestack_example.row
+    sparsestack_example.add_sparse_data(np.array([0, 3]), np.array([2, 4]),
+                                        np.array([0.5, 0.7]), "scoreB")
+    # Left join keeps existing row, col and layers without copying
+    assert sparsestack_example.get_layer("scoreA") is layer_a
+    assert sparsestack_example.row is row
+    assert sparsestack_example.get_layer("scoreB").flags.c_contiguous
+    assert sparsestack_example.get_layer("scoreB").tolist() == [0.5, 0, 0, 0, 0, 0.7, 0]
+
+    # data is a read-only compatibility view
+    data = sparsestack_example.data
+    assert data.dtype.names == ("scoreA", "scoreB")
+    assert np.all(data["scoreA"] == layer_a)
+    with pytest.raises(ValueError):
+        data[0] = 5
+
+    sparsestack_example.drop_score("scoreA")
+    assert sparsestack_example.score_names == ("scoreB",)
+    assert sparsestack_example.data.dtype.names == ("scoreB",)
+    assert len(sparsestack_example.row) == 7
+
+
+def test_add_existing_score_name_raises(sparsestack_example_2layers):
+    with pytest.raises(ValueError) as exception:
+        sparsestack_example_2layers.add_sparse_data(np.array([0]), np.array([2]),
+                                                    np.array([0.5]), "scoreB")
+    assert "already exist" in exception.value.args[0]
+
+
+def test_load_layers_memory_mapped(tmp_path, sparsestack_example_2layers):
+    path = os.path.join(tmp_path, "stack")
+    sparsestack_example_2layers.save(path)
+    loaded = StackedSparseArray.load(path)
+    assert isinstance(loaded.get_layer("scoreB"), np.memmap)
+    assert loaded.top_k("scoreB", k=1) == sparsestack_example_2layers.top_k("scoreB", k=1)
+
+
+@pytest.mark.parametrize("join_type", ["left", "outer"])
+def test_add_sparse_data_n_jobs(monkeypatch, sparsestack_example, join_type):
+    monkeypatch.setattr(sparsestack.utils, "_min_entries_per_job", 2)
+    row = np.array([4, 0, 2, 3, 1])
+    col = np.array([3, 2, 2, 3, 1])
+    data = np.array([0.1, 0.2, 0.3, 0.4, 0.5])
+    expected = sparsestack_example.clone()
+    expected.add_sparse_data(row, col, data, "scoreB", join_type=join_type)
+    sparsestack_example.add_sparse_data(row, col, data, "scoreB", join_type=join_type, n_jobs=2)
+    assert sparsestack_example == expected
+
+
+@pytest.mark.parametrize("chunk_size", [None, 2, 100])
+def test_derive(sparsestack_example_2layers, chunk_size):
+    matrix = sparsestack_example_2layers
+    row, col = matrix.row, matrix.col
+    matrix.derive("combined", lambda d: 0.7 * d["scoreA"] + 0.3 * d["scoreB"],
+                  chunk_size=chunk_size)
+    assert matrix.score_names == ("scoreA", "scoreB", "combined")
+    assert matrix.row is row and matrix.col is col
+    expected = 0.7 * matrix.get_layer("scoreA") + 0.3 * matrix.get_layer("scoreB")
+    assert np.allclose(matrix.get_layer("combined"), expected)
+
+
+def test_derive_numba_function(sparsestack_example_2layers):
+    numba = pytest.importorskip("numba")
+
+    @numba.vectorize
+    def masked_score(score_a, score_b):
+        return score_a if score_b > 5 else 0
+
+    matrix = sparsestack_example_2layers
+    matrix.derive("masked", masked_score, names=["scoreA", "scoreB"], chunk_size=3)
+    expected = np.where(matrix.get_layer("scoreB") > 5, matrix.get_layer("scoreA"), 0)
+    assert np.all(matrix.get_layer("masked") == expected)
+
+
+def test_derive_wrong_input(sparsestack_example_2layers):
+    with pytest.raises(ValueError, match="already exist"):
+        sparsestack_example_2layers.derive("scoreA", lambda d: d["scoreB"])
+    with pytest.raises(AssertionError, match="one value per entry"):
+        sparsestack_example_2layers.derive("new", lambda d: d["scoreB"][:2])
+    with pytest.raises(ValueError, match="chunk_size must be at least 1"):
+        sparsestack_example_2layers.derive("new", lambda d: d["scoreB"], chunk_size=0)
+
+
+@pytest.mark.parametrize("func, names", [
+    [lambda d: d["scoreA"], None],
+    [lambda x: x, "scoreA"],
+])
+def test_derive_identity_copies_layer(sparsestack_example_2layers, func, names):
+    matrix = sparsestack_example_2layers
+    matrix.derive("copy", func, names=names)
+    assert not np.shares_memory(matrix.get_layer("copy"), matrix.get_layer("scoreA"))
+    expected = matrix.filter(("scoreA", 20, np.inf)).get_layer("scoreA").tolist()
+    matrix.filter(("scoreA", 20, np.inf), inplace=True)
+    assert matrix.get_layer("scoreA").tolist() == expected
+    assert matrix.get_layer("copy").tolist() == expected
+
+
+@pytest.mark.parametrize("how, expected_rows", [
+    ["outer", [0, 0, 1, 2, 4]],
+    ["inner", [0, 2]],
+    ["left", [0, 0, 2, 4]],
+    ["right", [0, 1, 2]],
+])
+def test_merge(how, expected_rows):
+    matrix1 = StackedSparseArray(5, 5)
+    matrix1.add_sparse_data([0, 0, 2, 4], [1, 3, 2, 0], np.array([1., 2., 3., 4.]), "scoreA")
+    matrix2 = StackedSparseArray(5, 5)
+    matrix2.add_sparse_data([2, 1, 0], [2, 1, 1], np.array([5., 6., 7.]), "scoreA")
+    merged = matrix1.merge(matrix2, how=how)
+    assert merged.row.tolist() == expected_rows
+    assert merged.score_names == ("scoreA", "scoreA_other")
+    assert merged.is_canonical
+    for r, c, a, b in zip(merged.row, merged.col, merged.get_layer("scoreA"),
+                          merged.get_layer("scoreA_other")):
+        assert a == matrix1.to_array("scoreA")[r, c]
+        assert b == matrix2.to_array("scoreA")[r, c]
+
+
+@pytest.mark.parametrize("how, expected_rows", [
+    ["outer", [1, 65537, 69999]],
+    ["left", [1]],
+    ["right", [65537, 69999]],
+    ["inner", []],
+])
+def test_merge_different_index_dtypes(how, expected_rows):
+    small = StackedSparseArray(10, 10)
+    small.add_sparse_data(np.array([1]), np.array([1]), np.array([1.0]), "scoreA")
+    large = StackedSparseArray(70000, 10)
+    large.add_sparse_data(np.array([65537, 69999]), np.array([1, 1]), np.array([2.0, 3.0]), "scoreB")
+    merged = small.merge(large, how=how)
+    assert merged.row.tolist() == expected_rows
+    if how == "left":
+        assert merged.get_layer("scoreB").tolist() == [0.0]
+    summed = small + StackedSparseArray.from_layers(
+        {"scoreA": (large.row, large.col, large.get_layer("scoreB"))}, n_row=70000, n_col=10)
+    assert summed.row.tolist() == [1, 65537, 69999]
+    assert summed.row.dtype == np.uint32
+
+
+def test_merge_selected_layers(sparsestack_example, sparsestack_example_2layers):
+    merged = sparsestack_example.merge(sparsestack_example_2layers, how="left", layers="scoreB",
+                                       suffixes=("_x", "_y"))
+    assert merged.score_names == ("scoreA", "scoreB")
+    assert np.all(merged.get_layer("scoreB") == sparsestack_example_2layers.get_layer("scoreB"))
+    merged = sparsestack_example.merge(sparsestack_example_2layers, suffixes=("_x", "_y"))
+    assert merged.score_names == ("scoreA_x", "scoreA_y", "scoreB")
+
+
+def test_arithmetic_between_stacks():
+    matrix1 = StackedSparseArray(3, 3)
+    matrix1.add_sparse_data([0, 1, 2], [0, 1, 2], np.array([1., 2., 3.]), "scoreA")
+    matrix2 = StackedSparseArray(3, 3)
+    matrix2.add_sparse_data([2, 0], [2, 1], np.array([0.5, 4.]), "scoreA")
+    dense1, dense2 = matrix1.to_array("scoreA"), matrix2.to_array("scoreA")
+    assert np.all((matrix1 + matrix2).to_array("scoreA") == dense1 + dense2)
+    assert np.all((matrix1 - matrix2).to_array("scoreA") == dense1 - dense2)
+    product = matrix1 * matrix2
+    assert product.row.tolist() == [2]
+    assert np.all(product.to_array("scoreA") == dense1 * dense2)
+    assert np.all((0.5 * matrix1).to_array("scoreA") == 0.5 * dense1)
+    assert np.all((matrix1 * 2).get_layer("scoreA") == [2., 4., 6.])
+
+
+def test_arithmetic_different_scores_raises(sparsestack_example, sparsestack_example_2layers):
+    with pytest.raises(ValueError, match="same score names"):
+        sparsestack_example + sparsestack_example_2layers
+    with pytest.raises(TypeError):
+        sparsestack_example + 1
+
+
+@pytest.mark.parametrize("combine, conditions, expected", [
+    ["and", [("scoreA", 10, 60), ("scoreB", 0, 5.5, ">", "<=")], [14, 18, 22, 26, 30, 34, 38, 42, 46, 50, 54]],
+    ["and", {"scoreA": (10, 60), "scoreB": (0, 5.5, ">", "<=")}, [14, 18, 22, 26, 30, 34, 38, 42, 46, 50, 54]],
+    ["or", [("scoreA", -np.inf, 10), ("scoreB", 10, np.inf)], [2, 6, 102, 106, 110, 114, 118]],
+    ["and", ("scoreA", 100, np.inf), [102, 106, 110, 114, 118]],
+])
+def test_filter(dense_array_sparse, combine, conditions, expected):
+    matrix = StackedSparseArray(12, 10)
+    matrix.add_dense_matrix(dense_array_sparse, "scoreA")
+    matrix.add_dense_matrix(dense_array_sparse / 10, "scoreB")
+    row, col = matrix.row.copy(), matrix.col.copy()
+
+    filtered = matrix.filter(conditions, combine=combine)
+    assert filtered.get_layer("scoreA").tolist() == expected
+    assert np.all(filtered.get_layer("scoreB") == filtered.get_layer("scoreA") / 10)
+    assert filtered.is_canonical
+
+    assert matrix.filter(conditions, combine=combine, inplace=True) is None
+    assert matrix == filtered
+    idx = np.isin(dense_array_sparse[row, col], expected)
+    assert np.all(matrix.row == row[idx]) and np.all(matrix.col == col[idx])
+
+
+def test_filter_inplace_memory_mapped(tmp_path, sparsestack_example_2layers):
+    sparsestack_example_2layers.save(tmp_path / "stack")
+    matrix = StackedSparseArray.load(tmp_path / "stack")
+    expected = matrix.filter([("scoreA", 20, np.inf)])
+    matrix.filter([("scoreA", 20, np.inf)], inplace=True)
+    assert matrix == expected
+    assert np.all(StackedSparseArray.load(tmp_path / "stack").row == sparsestack_example_2layers.row)
+
+
+def _derive_layer(matrix):
+    derived = matrix.clone()
+    derived.derive("copy", lambda d: d["scoreA"])
+    return derived
+
+
+def _from_caller_data(matrix):
+    derived = StackedSparseArray(*matrix.shape[:2])
+    derived.add_sparse_data(matrix.row, matrix.col, matrix.get_layer("scoreA"), "scoreA")
+    return derived
+
+
+@pytest.mark.parametrize("derive, factor", [
+    [lambda matrix: matrix.clone(), 1],
+    [lambda matrix: matrix * 2, 2],
+    [lambda matrix: matrix.merge(matrix, how="left"), 1],
+    [_derive_layer, 1],
+    [_from_caller_data, 1],
+])
+def test_filter_inplace_does_not_change_original(sparsestack_example_2layers, derive, factor):
+    matrix = sparsestack_example_2layers
+    row, col = matrix.row, matrix.col
+    score_a = matrix.get_layer("scoreA")
+    original = (row.copy(), col.copy(), score_a.copy())
+    expected = factor * score_a[score_a > 20]
+    derived = derive(matrix)
+    derived.filter([("scoreA", 20 * factor, np.inf)], inplace=True)
+    assert np.all(derived.get_layer("scoreA") == expected)
+    if "copy" in derived.score_names:
+        assert np.all(derived.get_layer("copy") == expected)
+    assert np.all(row == original[0]) and np.all(col == original[1])
+    assert np.all(score_a == original[2])
+
+
+def test_filter_inplace_aliased_layers(sparsestack_example_2layers):
+    matrix = sparsestack_example_2layers
+    expected = matrix.filter([("scoreA", 20, np.inf)])
+    layers = {name: matrix.get_layer(name) for name in matrix.score_names}
+    layers["alias"] = layers["scoreA"]
+    layers["view"] = layers["scoreB"][:]
+    matrix._set_layers(layers)
+    matrix.filter([("scoreA", 20, np.inf)], inplace=True)
+    for name in ["scoreA", "alias"]:
+        assert np.all(matrix.get_layer(name) == expected.get_layer("scoreA"))
+    for name in ["scoreB", "view"]:
+        assert np.all(matrix.get_layer(name) == expected.get_layer("scoreB"))
+
+
+def test_filter_wrong_combine(sparsestack_example):
+    with pytest.raises(ValueError, match="combine must be"):
+        sparsestack_example.filter([("scoreA", 0, 1)], combine="xor")
+
+
+@pytest.mark.parametrize("method", ["to_csr", "to_csc", "to_coo_array"])
+def test_sparse_export(sparsestack_example_2layers, method):
+    matrix = sparsestack_example_2layers
+    for name in matrix.score_names:
+        exported = getattr(matrix, method)(name)
+        assert exported.shape == (5, 6)
+        assert np.all(exported.toarray() == matrix.to_array(name))
+    assert exported.has_canonical_format
+
+
+def test_sparse_export_does_not_share_scores():
+    matrix = StackedSparseArray(5, 6)
+    matrix.add_sparse_data(np.array([0, 1, 3], dtype=np.int32), np.array([2, 2, 1], dtype=np.int32),
+                           np.array([1., 2., 3.]), "scoreA")
+    csr = matrix.to_csr()
+    assert csr.indices.dtype == np.int32
+    assert np.all(csr.indices == matrix.col)
+    assert not np.shares_memory(csr.data, matrix.get_layer("scoreA"))
+    assert csr.has_sorted_indices
+    csr.data[0] = 0
+    csr.eliminate_zeros()
+    assert matrix.get_layer("scoreA").tolist() == [1., 2., 3.]
+    assert matrix.col.tolist() == [2, 2, 1]
+    coo = matrix.to_coo_array()
+    assert not np.shares_memory(coo.data, matrix.get_layer("scoreA"))
+    coo.data[0] = 0
+    assert matrix.get_layer("scoreA").tolist() == [1., 2., 3.]
+
+
+@pytest.mark.parametrize("method", ["to_csr", "to_csc", "to_coo_array"])
+def test_sparse_export_not_canonical(method):
+    matrix = StackedSparseArray(3, 4)
+    matrix.add_sparse_data(np.array([0, 1, 2]), np.array([3, 0, 1]), np.array([1., 2., 3.]), "scoreA")
+    matrix.row = np.array([2, 0, 2])
+    assert not matrix.is_canonical
+    expected = np.array([[2, 0, 0, 0], [0, 0, 0, 0], [0, 3, 0, 1]])
+    assert np.all(getattr(matrix, method)().toarray() == expected)
+
+
+def test_to_sparse_coo(sparsestack_example_2layers):
+    pytest.importorskip("sparse")
+    matrix = sparsestack_example_2layers
+    exported = matrix.to_sparse_coo()
+    assert exported.shape == (5, 6, 2)
+    dense = exported.todense()
+    assert np.all(dense[:, :, 0] == matrix.to_array("scoreA"))
+    assert np.all(dense[:, :, 1] == matrix.to_array("scoreB"))
+
+
+def test_to_arrow_and_from_arrow(sparsestack_example_2layers):
+    pytest.importorskip("pyarrow")
+    matrix = sparsestack_example_2layers
+    table = matrix.to_arrow()
+    assert table.column_names == ["row", "col", "scoreA", "scoreB"]
+    assert str(table.schema.field("row").type) == "uint16"
+    restored = StackedSparseArray.from_arrow(table)
+    assert restored == matrix
+    assert restored.is_canonical
+    # Buffers are shared without copy
+    assert np.shares_memory(restored.get_layer("scoreA"), matrix.get_layer("scoreA"))
+    assert np.shares_memory(restored.row, matrix.row)
+
+
+def test_from_arrow_without_metadata():
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table({"row": [3, 0, 1], "col": [0, 2, 1], "score": [0.5, 1.5, 2.5]})
+    matrix = StackedSparseArray.from_arrow(table)
+    assert matrix.shape == (4, 3, 1)
+    assert not matrix.is_canonical
+    assert matrix[0, 2] == 1.5
+    assert StackedSparseArray.from_arrow(table, n_row=10, n_col=5).shape == (10, 5, 1)
+
+
+def test_to_and_read_parquet(tmp_path, sparsestack_example_2layers):
+    pytest.importorskip("pyarrow")
+    matrix = sparsestack_example_2layers
+    path = os.path.join(tmp_path, "stack.parquet")
+    matrix.to_parquet(path, row_group_size=2)
+    assert StackedSparseArray.read_parquet(path) == matrix
+
+    restored = StackedSparseArray.read_parquet(path, columns=["scoreB"])
+    assert restored.score_names == ("scoreB", )
+    assert restored.shape == (5, 6, 1)
+    assert np.all(restored.to_array() == matrix.to_array("scoreB"))
+
+
+def test_read_parquet_filters(tmp_path, sparsestack_example_2layers):
+    pq = pytest.importorskip("pyarrow.parquet")
+    matrix = sparsestack_example_2layers
+    path = os.path.join(tmp_path, "stack.parquet")
+    matrix.to_parquet(path, row_group_size=2)
+    # Row groups cover narrow row ranges (sorted by row)
+    statistics = pq.ParquetFile(path).metadata.row_group(0).column(0).statistics
+    assert (statistics.min, statistics.max) == (0, 1)
+
+    restored = StackedSparseArray.read_parquet(
+        path, columns=["scoreB"], filters=[("row", ">=", 1), ("row", "<", 4), ("scoreA", ">", 20)])
+    assert restored.shape == (5, 6, 1)
+    assert restored.is_canonical
+    idx = (matrix.row >= 1) & (matrix.row < 4) & (matrix.get_layer("scoreA") > 20)
+    assert np.all(restored.row == matrix.row[idx])
+    assert np.all(restored.col == matrix.col[idx])
+    assert np.all(restored.get_layer("scoreB") == matrix.get_layer("scoreB")[idx])
+
+
+def test_to_arrow_reserved_names():
+    pytest.importorskip("pyarrow")
+    matrix = StackedSparseArray(3, 3)
+    matrix.add_dense_matrix(np.eye(3), "row")
+    with pytest.raises(ValueError, match="reserved column name"):
+        matrix.to_arrow()
+
+
+@pytest.mark.parametrize("dtype", [np.uint16, np.uint32, np.int64])
+def test_from_layers_entries_shape(dtype):
+    layers = {"scoreA": (np.array([0, 3], dtype=dtype), np.array([1, 2], dtype=dtype),
+                         np.array([1.0, 2.0])),
+              "scoreB": (np.array([], dtype=dtype), np.array([], dtype=dtype), np.array([]))}
+    matrix = StackedSparseArray.from_layers(layers)
+    assert matrix.shape == (4, 3, 2)
+    assert matrix.to_array("scoreA")[3, 2] == 2.0
+
+
+@pytest.mark.parametrize("join_type", ["outer", "inner", "left"])
+def test_from_layers(dense_array_sparse, join_type):
+    dense_b = dense_array_sparse.copy()
+    dense_b[dense_b % 10 == 0] = 0
+    dense_b[0, 1] = 7
+    layers = {"scoreA": coo_matrix(dense_array_sparse), "scoreB": coo_matrix(dense_b / 2).tocsr(),
+              "scoreC": dense_array_sparse * 3}
+    matrix = StackedSparseArray.from_layers(layers, join_type=join_type)
+    expected = StackedSparseArray(12, 10)
+    expected.add_coo_matrix(coo_matrix(dense_array_sparse), "scoreA")
+    expected.add_coo_matrix(coo_matrix(dense_b / 2), "scoreB",
+                            join_type="outer" if join_type == "outer" else "left")
+    expected.add_dense_matrix(dense_array_sparse * 3, "scoreC")
+    if join_type == "inner":
+        expected = expected.filter(("scoreB", 0, np.inf))
+    assert matrix == expected
+    assert matrix.is_canonical
+
+
+def test_from_layers_tuples():
+    matrix = StackedSparseArray.from_layers({
+        "scoreA": (np.array([2, 0, 1]), np.array([0, 3, 1]), np.array([0.1, 0.2, 0.3])),
+        "scoreB": (np.array([1, 4]), np.array([1, 0]), np.array([5, 6])),
+    })
+    assert matrix.shape == (5, 4, 2)
+    assert matrix.row.tolist() == [0, 1, 2, 4]
+    assert matrix.col.tolist() == [3, 1, 0, 0]
+    assert matrix.get_layer("scoreA").tolist() == [0.2, 0.3, 0.1, 0]
+    assert matrix.get_layer("scoreB").tolist() == [0, 5, 0, 6]
+
+
+def test_from_layers_wrong_join_type():
+    with pytest.raises(ValueError, match="Unknown join_type"):
+        StackedSparseArray.from_layers({}, join_type="right")
+
+
+def test_from_dict(sparsestack_example_2layers):
+    dictionary = json.loads(json.dumps(sparsestack_example_2layers.to_dict()))
+    matrix = StackedSparseArray.from_dict(dictionary)
+    assert matrix == sparsestack_example_2layers
+    assert matrix.is_canonical
+
+
+def test_from_dict_unstructured():
+    matrix = StackedSparseArray(3, 3)
+    matrix.row, matrix.col, matrix.data = np.array([0, 2]), np.array([1, 1]), np.array([0.5, 1.5])
+    loaded = StackedSparseArray.from_dict(matrix.to_dict())
+    assert loaded == matrix
+    assert loaded.is_canonical
+    assert loaded.data.dtype.names is None
+
+
+def test_to_array_dtype_and_fill_value(sparsestack_example_2layers):
+    matrix = sparsestack_example_2layers
+    array = matrix.to_array("scoreB", dtype=np.float32, fill_value=np.nan)
+    assert array.dtype == np.float32
+    expected = matrix.to_array("scoreB").astype(np.float32)
+    expected[expected == 0] = np.nan
+    assert np.allclose(array, expected, equal_nan=True)
+    array = matrix.to_array(dtype=np.float32, fill_value=-1)
+    assert array.dtype.names == ("scoreA", "scoreB")
+    assert array["scoreA"].dtype == np.float32
+    assert np.sum(array["scoreA"] == -1) == 30 - len(matrix.row)
+
+
+def test_to_array_out_memmap(tmp_path, sparsestack_example_2layers):
+    matrix = sparsestack_example_2layers
+    out = np.lib.format.open_memmap(tmp_path / "scores.npy", mode="w+", dtype=np.float64, shape=(5, 6))
+    out[:] = 99
+    assert matrix.to_array("scoreA", out=out) is out
+    out.flush()
+    assert np.all(np.load(tmp_path / "scores.npy") == matrix.to_array("scoreA"))
+    with pytest.raises(AssertionError, match="out must be of shape"):
+        matrix.to_array("scoreA", out=np.zeros((2, 2)))
+
+
+@pytest.mark.parametrize("canonical", [True, False])
+@pytest.mark.parametrize("name", ["scoreA", None])
+def test_iter_row_blocks(dense_array_sparse, canonical, name):
+    matrix = StackedSparseArray(12, 10)
+    matrix.add_dense_matrix(dense_array_sparse, "scoreA")
+    if not canonical:
+        idx = np.arange(len(matrix.row))[::-1]
+        matrix.row, matrix.col, matrix.data = matrix.row[idx], matrix.col[idx], matrix.data[idx]
+        assert not matrix.is_canonical
+    blocks = list(matrix.iter_row_blocks(name, block_size=5, fill_value=-1))
+    assert [row_start for row_start, _ in blocks] == [0, 5, 10]
+    assert [block.shape for _, block in blocks] == [(5, 10), (5, 10), (2, 10)]
+    assert np.all(np.vstack([block for _, block in blocks]) == matrix.to_array(name, fill_value=-1))
+
+
+@pytest.mark.parametrize("canonical", [True, False])
+@pytest.mark.parametrize("axis", [0, 1])
+def test_reduce(canonical, axis):
+    dense = np.array([[0, 3., 1., 0], [0, 0, 0, 0], [2., 0, 5., 5.]])
+    matrix = StackedSparseArray(3, 4)
+    matrix.add_dense_matrix(dense, "scoreA")
+    if not canonical:
+        idx = [3, 0, 4, 2, 1]
+        matrix.row, matrix.col, matrix.data = matrix.row[idx], matrix.col[idx], matrix.data[idx]
+    dense = dense if axis == 1 else dense.T
+    stored = dense != 0
+    assert matrix.reduce("scoreA", "count", axis=axis).tolist() == stored.sum(axis=1).tolist()
+    assert matrix.reduce("scoreA", "sum", axis=axis).tolist() == dense.sum(axis=1).tolist()
+    assert matrix.reduce("scoreA", "max", axis=axis).tolist() == dense.max(axis=1).tolist()
+    expected_min = np.where(stored, dense, np.inf).min(axis=1)
+    assert matrix.reduce("scoreA", "min", axis=axis, fill_value=np.inf).tolist() == expected_min.tolist()
+    with np.errstate(invalid="ignore"):
+        expected_mean = dense.sum(axis=1) / stored.sum(axis=1)
+    assert np.allclose(matrix.reduce("scoreA", "mean", axis=axis), expected_mean, equal_nan=True)
+    expected_argmax = np.where(stored.any(axis=1), dense.argmax(axis=1), -1)
+    assert matrix.reduce("scoreA", "argmax", axis=axis).tolist() == expected_argmax.tolist()
+    expected_argmin = np.where(stored.any(axis=1), np.where(stored, dense, np.inf).argmin(axis=1), -1)
+    assert matrix.reduce("scoreA", "argmin", axis=axis).tolist() == expected_argmin.tolist()
+
+
+def test_reduce_wrong_input(sparsestack_example):
+    with pytest.raises(ValueError, match="Unknown operation"):
+        sparsestack_example.reduce("scoreA", "median")
+    with pytest.raises(ValueError, match="axis must be 0 or 1"):
+        sparsestack_example.reduce("scoreA", "max", axis=2)
+
+
+@pytest.mark.parametrize("n_row, n_col, row_dtype, col_dtype", [
+    [12, 10, np.uint16, np.uint16],
+    [70_000, 10, np.uint32, np.uint16],
+    [10, 2**33, np.uint16, np.int64],
+])
+def test_compact_index_dtypes(n_row, n_col, row_dtype, col_dtype):
+    matrix = StackedSparseArray(n_row, n_col)
+    assert matrix.row.dtype == row_dtype and matrix.col.dtype == col_dtype
+    matrix.add_sparse_data(np.array([0, 5, 9]), np.array([1, 2, 3]), np.array([1., 2., 3.]), "scoreA")
+    matrix.add_dense_matrix(np.ones((10, 3)), "scoreB", join_type="outer")
+    matrix.add_coo_matrix(coo_matrix(np.ones((10, 3))), "scoreC")
+    assert matrix.row.dtype == row_dtype and matrix.col.dtype == col_dtype
+    assert matrix[5, 2, "scoreA"] == 2
+    assert np.all(matrix.to_csr("scoreB")[:10, :3].toarray() == 1)
+
+
+def test_compact_index_dtypes_out_of_range():
+    matrix = StackedSparseArray(5, 5)
+    matrix.add_sparse_data(np.array([0, 4]), np.array([1, 2]), np.array([1., 2.]), "scoreA")
+    # Entries outside the stack are ignored by left joins (and must not wrap around)
+    matrix.add_sparse_data(np.array([65536, 4]), np.array([1, 2]), np.array([5., 6.]), "scoreB")
+    assert matrix.get_layer("scoreB").tolist() == [0, 6.]
+    with pytest.raises(AssertionError, match="row values have dimension larger"):
+        matrix.add_sparse_data(np.array([-1]), np.array([1]), np.array([5.]), "scoreC", join_type="outer")
+    with pytest.raises(AssertionError, match="index values exceed"):
+        matrix.row = np.array([0, 70000])
+
+
+def test_downcast_layers(sparsestack_example_2layers):
+    matrix = sparsestack_example_2layers
+    matrix.derive("count", lambda d: (d["scoreA"] > 20).astype(np.int64))
+    matrix.derive("negative", lambda d: -d["scoreA"])
+    nbytes = matrix.nbytes
+    expected = matrix.to_array()
+    saved = matrix.downcast_layers()
+    assert saved == nbytes - matrix.nbytes > 0
+    assert matrix.get_layer("scoreA").dtype == np.uint8
+    assert matrix.get_layer("scoreB").dtype == np.float32
+    assert matrix.get_layer("count").dtype == np.uint8
+    assert matrix.get_layer("negative").dtype == np.int8
+    for name in ["scoreA", "count", "negative"]:
+        assert np.all(matrix.to_array(name) == expected[name])
+    assert np.allclose(matrix.to_array("scoreB"), expected["scoreB"])
+    assert matrix.downcast_layers(float_dtype=None) == 0
+
+
+def test_downcast_layers_float16_raises(sparsestack_example_2layers):
+    with pytest.raises(ValueError, match="float16"):
+        sparsestack_example_2layers.downcast_layers(float_dtype=np.float16)
+    assert sparsestack_example_2layers.get_layer("scoreB").dtype == np.float64
+
+
+def test_downcast_layers_kernels(sparsestack_example_2layers):
+    matrix = sparsestack_example_2layers
+    expected = matrix.clone()
+    matrix.downcast_layers()
+    for name in ["scoreA", "scoreB"]:
+        assert matrix.top_k(name, k=2).row.tolist() == expected.top_k(name, k=2).row.tolist()
+        assert np.all(matrix.reduce(name, "argmax") == expected.reduce(name, "argmax"))
+    matrix.filter(("scoreB", 2, np.inf), inplace=True)
+    assert matrix.row.tolist() == expected.filter(("scoreB", 2, np.inf)).row.tolist()
+
+
+def test_memory_usage(sparsestack_example_2layers):
+    matrix = sparsestack_example_2layers
+    n_entries = len(matrix.row)
+    usage = matrix.memory_usage()
+    assert usage["row"] == usage["col"] == 2 * n_entries
+    assert usage["layers"] == {"scoreA": 8 * n_entries, "scoreB": 8 * n_entries}
+    assert usage["cache"] == {}
+    assert usage["total"] == matrix.nbytes
+    _ = matrix[:, 2], matrix.data
+    usage = matrix.memory_usage()
+    assert set(usage["cache"]) == {"axis_index_1", "data_view"}
+    assert usage["total"] == matrix.nbytes + sum(usage["cache"].values())
@@ -1,6 +1,12 @@
+import subprocess
+import sys
 import numpy as np
 import pytest
-from sparsestack.utils import join_arrays
+import sparsestack.utils
+from sparsestack.utils import (arg_extreme_segments, compact_array, fill_layer,
+                               get_idx, is_canonical_coo, join_arrays,
+                               join_layers, lexsort_if_needed, match_indices,
+                               top_k_segments, warmup)
 
 
 @pytest.mark.parametrize("row2, col2", [
@@ -84,3 +90,215 @@ def test_join_arrays_larger(join_type):
     row_out, col_out, data_out = join_arrays(row, col, data1, row, col, data2, "test1",
                                  join_type=join_type)
     assert np.allclose(sorted(data_out["test1_layer2"]), sorted(np.array([x[0] for x in data2])))
+
+
+@pytest.mark.parametrize("join_type", [
+    "left", "right", "inner", "outer"
+])
+def test_get_idx_returns_numpy_arrays(join_type):
+    row1 = np.array([0, 0, 1, 3], dtype=np.int32)
+    col1 = np.array([1, 2, 0, 3], dtype=np.int32)
+    row2 = np.array([0, 1, 2, 3], dtype=np.int32)
+    col2 = np.array([2, 1, 1, 3], dtype=np.int32)
+    idx_left, idx_right, idx_left_new, idx_right_new, row_new, col_new = get_idx(
+        row1, col1, row2, col2, join_type=join_type)
+    for idx in [idx_left, idx_right, idx_left_new, idx_right_new]:
+        assert isinstance(idx, np.ndarray)
+        assert idx.dtype == np.int64
+    assert row_new.dtype == col_new.dtype == np.int32
+    assert np.all(row_new[idx_left_new] == row1[idx_left])
+    assert np.all(col_new[idx_right_new] == col2[idx_right])
+    expected_length = {"left": 4, "right": 4, "inner": 2, "outer": 6}[join_type]
+    assert len(row_new) == expected_length
+
+
+@pytest.mark.parametrize("join_type", [
+    "left", "right", "inner", "outer"
+])
+def test_join_arrays_random_against_reference(join_type):
+    rng = np.random.default_rng(42)
+    n_row, n_col = 50, 40
+    keys1 = rng.choice(n_row * n_col, 300, replace=False)
+    keys2 = rng.choice(n_row * n_col, 400, replace=False)
+    row1, col1 = np.divmod(keys1, n_col)
+    row2, col2 = np.divmod(keys2, n_col)
+    data1 = np.array(rng.random(300), dtype=[("layer1", np.float64)])
+    data2 = rng.random(400)
+
+    row, col, data = join_arrays(row1, col1, data1, row2, col2, data2, "layer2",
+                                 join_type=join_type)
+
+    entries1 = dict(zip(keys1, data1["layer1"]))
+    entries2 = dict(zip(keys2, data2))
+    expected_keys = {"left": set(keys1), "right": set(keys2),
+                     "inner": set(keys1) & set(keys2),
+                     "outer": set(keys1) | set(keys2)}[join_type]
+    expected_keys = np.array(sorted(expected_keys))
+    assert np.all(row * n_col + col == expected_keys)
+    assert np.allclose(data["layer1"], [entries1.get(k, 0) for k in expected_keys])
+    assert np.allclose(data["layer2"], [entries2.get(k, 0) for k in expected_keys])
+
+
+def test_join_arrays_unknown_join_type():
+    row = np.array([0, 1])
+    data = np.array(row, dtype=[("layer1", row.dtype)])
+    with pytest.raises(ValueError) as exception:
+        join_arrays(row, row, data, row, row, row, "test1", join_type="cross")
+    assert "Unknown join_type" in exception.value.args[0]
+
+
+@pytest.mark.parametrize("join_type", [
+    "left", "right", "inner", "outer"
+])
+def test_join_arrays_left_sorted(join_type):
+    row1 = np.array([0, 1, 1, 4, 5])
+    col1 = np.array([3, 1, 2, 4, 0])
+    row2 = np.array([7, 5, 1, 6, 1])
+    col2 = np.array([7, 0, 2, 6, 0])
+    data1 = np.array(np.arange(5), dtype=[("layer1", np.int64)])
+    data2 = 10 * np.arange(1, 6)
+
+    expected = join_arrays(row1, col1, data1, row2, col2, data2, "layer2",
+                           join_type=join_type)
+    row, col, data = join_arrays(row1, col1, data1, row2, col2, data2, "layer2",
+                                 join_type=join_type, left_sorted=True)
+    assert np.all(row == expected[0])
+    assert np.all(col == expected[1])
+    assert np.all(data == expected[2])
+
+
+@pytest.mark.parametrize("row, col, expected", [
+    [[0, 0, 1, 3], [1, 2, 0, 0], True],
+    [[], [], True],
+    [[0, 0, 1], [2, 1, 0], False],
+    [[0, 1, 0], [1, 0, 2], False],
+    [[0, 0, 1], [1, 1, 0], False],
+])
+def test_is_canonical_coo(row, col, expected):
+    assert is_canonical_coo(np.array(row, dtype=np.int64),
+                            np.array(col, dtype=np.int64)) == expected
+
+
+@pytest.mark.parametrize("largest, expected", [
+    [True, [True, False, True, True, True, False, False, True, True]],
+    [False, [True, True, False, True, True, False, False, True, True]],
+])
+def test_top_k_segments(largest, expected):
+    values = np.array([3, 1, 5, 2, 2, 2, 2, 7, 1])
+    indptr = np.array([0, 3, 3, 7, 9])
+    keep = top_k_segments(values, indptr, 2, largest)
+    assert keep.tolist() == expected
+
+
+def test_match_indices():
+    row1 = np.array([0, 0, 1, 3, 4])
+    col1 = np.array([1, 2, 0, 3, 0])
+    row2 = np.array([3, 0, 2, 0, 4], dtype=np.int32)
+    col2 = np.array([3, 2, 2, 0, 0], dtype=np.int32)
+    idx_left, idx_right = match_indices(row1, col1, row2, col2)
+    assert idx_left.tolist() == [1, 3, 4]
+    assert idx_right.tolist() == [1, 0, 4]
+
+
+def test_join_layers_left_keeps_arrays():
+    row1 = np.array([0, 0, 1, 3])
+    col1 = np.array([1, 2, 0, 3])
+    layers1 = {"layer1": np.arange(4)}
+    row, col, layers = join_layers(row1, col1, layers1,
+                                   np.array([3, 0]), np.array([3, 2]),
+                                   {"layer2": np.array([0.5, 0.2])},
+                                   join_type="left", left_sorted=True)
+    assert row is row1 and col is col1
+    assert layers["layer1"] is layers1["layer1"]
+    assert layers["layer2"].tolist() == [0, 0.2, 0, 0.5]
+
+
+@pytest.mark.parametrize("join_type", ["left", "right", "inner", "outer"])
+def test_join_layers_parallel(monkeypatch, join_type):
+    monkeypatch.setattr(sparsestack.utils, "_min_entries_per_job", 10)
+    rng = np.random.default_rng(0)
+    row1, col1 = np.divmod(rng.choice(2500, 200, replace=False), 50)
+    row2, col2 = np.divmod(rng.choice(2500, 300, replace=False), 50)
+    layers1 = {"layer1": rng.random(200)}
+    layers2 = {"layer2": rng.random(300)}
+    expected = join_layers(row1, col1, layers1, row2, col2, layers2, join_type=join_type)
+    result = join_layers(row1, col1, layers1, row2, col2, layers2, join_type=join_type, n_jobs=3)
+    assert np.all(result[0] == expected[0])
+    assert np.all(result[1] == expected[1])
+    for name in ["layer1", "layer2"]:
+        assert np.all(result[2][name] == expected[2][name])
+
+
+def test_lexsort_if_needed_parallel(monkeypatch):
+    monkeypatch.setattr(sparsestack.utils, "_min_entries_per_job", 10)
+    rng = np.random.default_rng(1)
+    row = rng.integers(0, 20, 500)
+    col = rng.integers(0, 20, 500)
+    idx = lexsort_if_needed(row, col, n_jobs=4)
+    assert np.all(idx == np.lexsort((col, row)))
+
+
+def test_fill_layer_all_cores(monkeypatch):
+    monkeypatch.setattr(sparsestack.utils, "_min_entries_per_job", 10)
+    monkeypatch.setattr(sparsestack.utils.os, "cpu_count", lambda: 4)
+    calls = []
+    run_parallel = sparsestack.utils._run_parallel
+    monkeypatch.setattr(sparsestack.utils, "_run_parallel",
+                        lambda func, arguments, n_jobs: calls.append((len(arguments), n_jobs))
+                        or run_parallel(func, arguments, n_jobs))
+    values = np.arange(100, dtype=np.float64)
+    idx = np.arange(100)[::-1]
+    layer = fill_layer(values, idx, np.arange(100), 100, n_jobs=-1)
+    assert calls == [(4, 4)]
+    assert np.all(layer == values[::-1])
+
+
+def test_compact_array():
+    values = np.array([5, 3, 8, 1, 7])
+    n = compact_array(values, np.array([False, True, True, False, True]))
+    assert n == 3
+    assert values[:n].tolist() == [3, 8, 7]
+
+
+@pytest.mark.parametrize("largest, expected", [
+    [True, [2, -1, 3, 7]],
+    [False, [1, -1, 3, 8]],
+])
+def test_arg_extreme_segments(largest, expected):
+    values = np.array([3, 1, 5, 2, 2, 2, 2, 7, 1])
+    indptr = np.array([0, 3, 3, 7, 9])
+    assert arg_extreme_segments(values, indptr, largest).tolist() == expected
+
+
+def test_import_does_not_import_numba():
+    code = "import sys, sparsestack; print('numba' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
+
+
+def test_warmup():
+    warmup(index_dtypes=("uint16", ), value_dtypes=("float32", ))
+    kernels = sparsestack.utils._get_kernels()
+    signatures = [tuple(str(x) for x in sig) for sig in kernels.get_idx_outer.signatures]
+    assert ("array(uint16, 1d, C)", ) * 4 in signatures
+    signatures = [str(sig[0]) for sig in kernels.top_k_segments.signatures]
+    assert "array(float32, 1d, C)" in signatures
+    signatures = [str(sig[0]) for sig in kernels.compact_array.signatures]
+    assert "array(uint16, 1d, C)" in signatures
+
+
+def test_join_layers_does_not_narrow_index_dtypes():
+    row1 = np.array([1, 3], dtype=np.uint16)
+    col1 = np.array([0, 0], dtype=np.uint16)
+    row2 = np.array([1, 65537], dtype=np.int64)
+    col2 = np.array([0, 0], dtype=np.int64)
+    row, col, layers = join_layers(row1, col1, {"a": np.array([1.0, 2.0])},
+                                   row2, col2, {"b": np.array([3.0, 4.0])},
+                                   join_type="outer")
+    assert row.tolist() == [1, 3, 65537]
+    assert col.tolist() == [0, 0, 0]
+    assert layers["b"].tolist() == [3.0, 0.0, 4.0]
+    _, _, layers = join_layers(row1, col1, {"a": np.array([1.0, 2.0])},
+                               row2, col2, {"b": np.array([3.0, 4.0])},
+                               join_type="left", left_sorted=True)
+    assert layers["b"].tolist() == [3.0, 0.0]